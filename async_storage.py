@@ -0,0 +1,341 @@
+import json
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+from utils import create_redis_client, create_async_redis_client
+from membership_cache import membership_cache
+from storage import (
+    StorageHandler,
+    LOG_LEVELS,
+    get_default_log_level,
+    get_log_writer,
+    get_stats_retention_days,
+    queue_processing_stats,
+    queue_statistics_reads,
+    build_statistics,
+)
+
+class AsyncStorageHandler:
+    """
+    Contraparte assíncrona do StorageHandler para a API e os workers.
+
+    Usa redis.asyncio sobre um pool de conexões compartilhado, de modo que
+    uma resposta lenta do Redis suspende apenas a corrotina que a aguarda,
+    sem congelar as demais transcrições em andamento. Mantém os mesmos
+    nomes de métodos do StorageHandler para o caminho de processamento;
+    o manager (Streamlit) continua usando o handler síncrono.
+    """
+    WEBHOOK_KEY = StorageHandler.WEBHOOK_KEY
+    WEBHOOK_STATS_KEY = StorageHandler.WEBHOOK_STATS_KEY
+
+    MESSAGE_STATUS_RECEIVED = StorageHandler.MESSAGE_STATUS_RECEIVED
+    MESSAGE_STATUS_PROCESSING = StorageHandler.MESSAGE_STATUS_PROCESSING
+    MESSAGE_STATUS_RETRYING = StorageHandler.MESSAGE_STATUS_RETRYING
+    MESSAGE_STATUS_DONE = StorageHandler.MESSAGE_STATUS_DONE
+    MESSAGE_STATUS_FAILED = StorageHandler.MESSAGE_STATUS_FAILED
+
+    _RECLAIM_MESSAGE_SCRIPT = StorageHandler._RECLAIM_MESSAGE_SCRIPT
+
+    def __init__(self):
+        # Mesmo logger do StorageHandler, sem duplicar o handler de console
+        self.logger = logging.getLogger("StorageHandler")
+        if not self.logger.handlers:
+            handler = logging.StreamHandler()
+            formatter = logging.Formatter(
+                '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+            )
+            handler.setFormatter(formatter)
+            self.logger.addHandler(handler)
+        self.logger.setLevel(LOG_LEVELS[get_default_log_level()])
+
+        # Cliente assíncrono (pool compartilhado) para o caminho da requisição
+        self.redis = create_async_redis_client()
+        # Grupos permitidos e usuários bloqueados em memória (sem round-trip)
+        self.membership = membership_cache
+        # Os logs continuam com o escritor em lote (thread própria, cliente síncrono)
+        self.log_writer = get_log_writer(create_redis_client(), self._get_redis_key("log_stream"))
+
+        self.message_state_ttl = int(os.getenv('MESSAGE_STATE_TTL', 86400))
+        # Validade do `received` até o job entrar na fila (confirm_message)
+        self.message_claim_ttl = int(os.getenv('MESSAGE_CLAIM_TTL', 60))
+        self.stats_retention_days = get_stats_retention_days()
+
+    def _get_redis_key(self, key):
+        return f"transcrevezap:{key}"
+
+    def add_log(self, level: str, message: str, metadata: dict = None):
+        """
+        Síncrono de propósito: apenas enfileira a entrada no escritor em
+        lote, sem I/O no event loop.
+        """
+        level = level.upper()
+        self.logger.log(LOG_LEVELS.get(level, logging.INFO), f"{message} | Metadata: {metadata}")
+
+        sample_rate = self.log_writer.should_write(level, message)
+        if sample_rate is None:
+            return
+
+        log_entry = {
+            "timestamp": datetime.now().isoformat(),
+            "level": level,
+            "message": message,
+            "metadata": json.dumps(metadata) if metadata else ""
+        }
+        if sample_rate > 1:
+            log_entry["sample_rate"] = sample_rate
+        self.log_writer.submit(level, log_entry)
+
+    # Estado de processamento por mensagem (idempotência de webhooks)
+    def _message_state_key(self, message_id: str) -> str:
+        return self._get_redis_key(f"message_state:{message_id}")
+
+    def _build_message_state(self, status: str, **extra) -> str:
+        state = {"status": status, "updated_at": datetime.now().isoformat()}
+        state.update(extra)
+        return json.dumps(state)
+
+    async def claim_message(self, message_id: str) -> Optional[Dict]:
+        """Versão assíncrona de StorageHandler.claim_message."""
+        key = self._message_state_key(message_id)
+        new_state = self._build_message_state(self.MESSAGE_STATUS_RECEIVED)
+        if await self.redis.set(key, new_state, nx=True, ex=self.message_claim_ttl):
+            return None
+
+        current = await self.redis.get(key)
+        if current is None:
+            if await self.redis.set(key, new_state, nx=True, ex=self.message_claim_ttl):
+                return None
+            current = await self.redis.get(key)
+
+        try:
+            state = json.loads(current)
+        except (TypeError, ValueError):
+            state = {"status": self.MESSAGE_STATUS_RECEIVED}
+
+        if state.get("status") == self.MESSAGE_STATUS_FAILED:
+            reclaimed = await self.redis.eval(
+                self._RECLAIM_MESSAGE_SCRIPT, 1, key,
+                current, new_state, self.message_claim_ttl
+            )
+            if reclaimed:
+                return None
+        return state
+
+    async def confirm_message(self, message_id: str):
+        """Versão assíncrona de StorageHandler.confirm_message."""
+        await self.redis.expire(self._message_state_key(message_id), self.message_state_ttl)
+
+    async def get_message_state(self, message_id: str) -> Optional[Dict]:
+        current = await self.redis.get(self._message_state_key(message_id))
+        if not current:
+            return None
+        try:
+            return json.loads(current)
+        except ValueError:
+            return None
+
+    async def set_message_state(self, message_id: str, status: str, **extra):
+        await self.redis.set(
+            self._message_state_key(message_id),
+            self._build_message_state(status, **extra),
+            ex=self.message_state_ttl
+        )
+
+    # Permissões
+    async def get_allowed_groups(self) -> List[str]:
+        return await self.redis.smembers(self._get_redis_key("allowed_groups"))
+
+    async def get_blocked_users(self) -> List[str]:
+        return await self.redis.smembers(self._get_redis_key("blocked_users"))
+
+    async def can_process_message(self, remote_jid):
+        try:
+            if await self.membership.is_blocked_user(remote_jid):
+                return False
+            if "@g.us" in remote_jid and not await self.membership.is_allowed_group(remote_jid):
+                return False
+
+            return True
+        except Exception as e:
+            self.logger.error(f"Erro ao verificar se pode processar mensagem: {e}")
+            return False
+
+    # Estatísticas
+    async def get_statistics(self) -> Dict:
+        pipe = self.redis.pipeline(transaction=False)
+        days = queue_statistics_reads(pipe, self.stats_retention_days)
+        return build_statistics(await pipe.execute(), days)
+
+    async def record_processing(self, remote_jid):
+        """Contadores atômicos (HINCRBY/INCR) em um único MULTI, sem ler nada antes."""
+        try:
+            pipe = self.redis.pipeline(transaction=True)
+            queue_processing_stats(pipe, remote_jid, self.stats_retention_days)
+            await pipe.execute()
+        except Exception as e:
+            self.logger.error(f"Erro ao registrar processamento: {e}")
+
+    async def record_error(self):
+        await self.redis.incr(self._get_redis_key("error_count"))
+
+    # Chaves de API
+    async def get_groq_keys(self) -> List[str]:
+        return list(await self.redis.smembers(self._get_redis_key("groq_keys")))
+
+    async def get_next_groq_key(self) -> Optional[str]:
+        """Rodízio atômico (INCR) sobre as chaves GROQ ordenadas."""
+        keys = sorted(await self.get_groq_keys())
+        if not keys:
+            return None
+        counter = await self.redis.incr(self._get_redis_key("groq_key_counter")) - 1
+        return keys[counter % len(keys)]
+
+    async def get_openai_keys(self) -> List[str]:
+        return list(await self.redis.smembers(self._get_redis_key("openai_keys")))
+
+    # Configurações (o caminho quente usa o config_snapshot; estes são para paridade)
+    async def get_message_settings(self):
+        keys = ["summary_header", "transcription_header", "output_mode", "character_limit"]
+        values = await self.redis.mget([self._get_redis_key(key) for key in keys])
+        summary_header, transcription_header, output_mode, character_limit = values
+        return {
+            "summary_header": summary_header or "🤖 *Resumo do áudio:*",
+            "transcription_header": transcription_header or "🔊 *Transcrição do áudio:*",
+            "output_mode": output_mode or "both",
+            "character_limit": int(character_limit or "500"),
+        }
+
+    async def get_process_mode(self):
+        return await self.redis.get(self._get_redis_key("process_mode")) or "all"
+
+    async def get_llm_provider(self) -> str:
+        return await self.redis.get(self._get_redis_key("active_llm_provider")) or "groq"
+
+    async def get_auto_language_detection(self) -> bool:
+        return await self.redis.get(self._get_redis_key("auto_language_detection")) == "true"
+
+    async def get_auto_translation(self) -> bool:
+        return await self.redis.get(self._get_redis_key("auto_translation")) == "true"
+
+    # Idiomas
+    async def get_contact_language(self, contact_id: str) -> str:
+        contact_id = contact_id.split('@')[0]
+        return await self.redis.hget(self._get_redis_key("contact_languages"), contact_id)
+
+    async def set_contact_language(self, contact_id: str, language: str):
+        contact_id = contact_id.split('@')[0]
+        await self.redis.hset(self._get_redis_key("contact_languages"), contact_id, language)
+        self.logger.info(f"Idioma {language} definido para o contato {contact_id}")
+
+    async def record_language_usage(self, language: str, from_me: bool, auto_detected: bool = False):
+        """Registra estatísticas de uso de idiomas em um único pipeline."""
+        try:
+            if not language:
+                self.add_log("WARNING", "Tentativa de registrar uso sem idioma definido")
+                return
+
+            stats_key = self._get_redis_key("language_stats")
+            direction = 'sent' if from_me else 'received'
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.hincrby(stats_key, f"{language}_total", 1)
+            pipe.hincrby(stats_key, f"{language}_{direction}", 1)
+            if auto_detected:
+                pipe.hincrby(stats_key, f"{language}_auto_detected", 1)
+            pipe.hset(stats_key, f"{language}_last_used", datetime.now().isoformat())
+            await pipe.execute()
+
+            self.add_log("DEBUG", "Uso de idioma registrado", {
+                "language": language,
+                "direction": direction,
+                "auto_detected": auto_detected
+            })
+
+        except Exception as e:
+            self.add_log("ERROR", "Erro ao registrar uso de idioma", {
+                "error": str(e),
+                "type": type(e).__name__
+            })
+
+    async def cache_language_detection(self, contact_id: str, language: str, confidence: float = 1.0):
+        contact_id = contact_id.split('@')[0]
+        cache_data = {
+            'language': language,
+            'confidence': confidence,
+            'timestamp': datetime.now().isoformat(),
+            'auto_detected': True
+        }
+        await self.redis.hset(
+            self._get_redis_key("language_detection_cache"),
+            contact_id,
+            json.dumps(cache_data)
+        )
+
+    async def get_cached_language(self, contact_id: str) -> Dict:
+        """Idioma em cache para o contato, ou None se ausente/expirado (24 horas)."""
+        contact_id = contact_id.split('@')[0]
+        cached = await self.redis.hget(
+            self._get_redis_key("language_detection_cache"),
+            contact_id
+        )
+
+        if not cached:
+            return None
+
+        try:
+            data = json.loads(cached)
+            cache_time = datetime.fromisoformat(data['timestamp'])
+            if datetime.now() - cache_time > timedelta(hours=24):
+                return None
+            return data
+        except (ValueError, KeyError, TypeError):
+            return None
+
+    # Webhooks
+    async def get_webhook_redirects(self) -> List[Dict]:
+        webhooks_raw = await self.redis.hgetall(self._get_redis_key("webhook_redirects"))
+        webhooks = []
+
+        for webhook_id, data in webhooks_raw.items():
+            webhook_data = json.loads(data)
+            webhook_data['id'] = webhook_id
+            webhooks.append(webhook_data)
+
+        return webhooks
+
+    async def update_webhook_stats(self, webhook_id: str, success: bool, error_message: str = None):
+        try:
+            webhook_data = json.loads(
+                await self.redis.hget(self._get_redis_key("webhook_redirects"), webhook_id)
+            )
+
+            if success:
+                webhook_data["success_count"] += 1
+                webhook_data["last_success"] = datetime.now().isoformat()
+            else:
+                webhook_data["error_count"] += 1
+                webhook_data["last_error"] = {
+                    "timestamp": datetime.now().isoformat(),
+                    "message": error_message
+                }
+
+            await self.redis.hset(
+                self._get_redis_key("webhook_redirects"),
+                webhook_id,
+                json.dumps(webhook_data)
+            )
+        except Exception as e:
+            self.logger.error(f"Erro ao atualizar estatísticas do webhook {webhook_id}: {e}")
+
+    async def add_failed_delivery(self, webhook_id: str, payload: dict):
+        key = self._get_redis_key(f"webhook_failed_{webhook_id}")
+        failed_delivery = {
+            "timestamp": datetime.now().isoformat(),
+            "payload": payload,
+            "retry_count": 0
+        }
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.lpush(key, json.dumps(failed_delivery))
+        # Manter apenas as últimas 100 falhas
+        pipe.ltrim(key, 0, 99)
+        await pipe.execute()
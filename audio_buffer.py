@@ -0,0 +1,121 @@
+import base64
+import hashlib
+import io
+import os
+import tempfile
+import weakref
+from typing import BinaryIO, Optional, Union
+
+def _default_spill_dir() -> str:
+    # tmpfs em memória quando disponível (containers Linux), senão o tmp do sistema
+    return "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+
+def _remove_file(path: str):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+class AudioBuffer:
+    """
+    Áudio em memória que transborda para tmpfs acima de um limite.
+
+    Substitui os arquivos temporários criados a cada áudio: o conteúdo
+    fica em memória até AUDIO_SPILL_THRESHOLD bytes e só então é gravado em
+    AUDIO_SPILL_DIR (padrão /dev/shm). `upload_payload()` pode ser chamado
+    quantas vezes for preciso (ex.: detecção de idioma + transcrição) sem
+    reler o disco quando o áudio está em memória. O arquivo transbordado é
+    removido ao sair do bloco `with`, em `close()` ou, em último caso,
+    quando o objeto é coletado.
+    """
+    BASE64_CHUNK_CHARS = 64 * 1024  # múltiplo de 4
+
+    def __init__(self, spill_threshold: int = None, spill_dir: str = None, suffix: str = ".mp3"):
+        self.spill_threshold = spill_threshold if spill_threshold is not None else int(
+            os.getenv("AUDIO_SPILL_THRESHOLD", 8 * 1024 * 1024)
+        )
+        self.spill_dir = spill_dir or os.getenv("AUDIO_SPILL_DIR") or _default_spill_dir()
+        self.suffix = suffix
+        self.size = 0
+        self._sha256 = hashlib.sha256()
+        self._memory: Optional[io.BytesIO] = io.BytesIO()
+        self._file: Optional[BinaryIO] = None
+        self.path: Optional[str] = None
+        self._finalizer = None
+
+    @classmethod
+    def from_base64(cls, data: str, **kwargs) -> "AudioBuffer":
+        """Decodifica o base64 em blocos, sem materializar uma segunda cópia inteira."""
+        if any(char in data for char in "\r\n "):
+            data = "".join(data.split())
+        buffer = cls(**kwargs)
+        try:
+            for start in range(0, len(data), cls.BASE64_CHUNK_CHARS):
+                buffer.write(base64.b64decode(data[start:start + cls.BASE64_CHUNK_CHARS]))
+        except Exception:
+            buffer.close()
+            raise
+        return buffer.finish()
+
+    @property
+    def spilled(self) -> bool:
+        return self.path is not None
+
+    @property
+    def sha256(self) -> str:
+        """Hash do conteúdo, calculado durante a escrita (sem reler o áudio)."""
+        return self._sha256.hexdigest()
+
+    def write(self, chunk: bytes):
+        if not chunk:
+            return
+        if self._file is None and self.size + len(chunk) > self.spill_threshold:
+            self._spill()
+        if self._file is not None:
+            self._file.write(chunk)
+        else:
+            self._memory.write(chunk)
+        self._sha256.update(chunk)
+        self.size += len(chunk)
+
+    def _spill(self):
+        """Move o conteúdo em memória para um arquivo no tmpfs."""
+        self._file = tempfile.NamedTemporaryFile(delete=False, dir=self.spill_dir, suffix=self.suffix)
+        self.path = self._file.name
+        self._finalizer = weakref.finalize(self, _remove_file, self.path)
+        self._file.write(self._memory.getbuffer())
+        self._memory = None
+
+    def finish(self) -> "AudioBuffer":
+        """Conclui a escrita; o buffer passa a ser somente leitura."""
+        if self._file is not None:
+            self._file.close()
+        return self
+
+    def upload_payload(self) -> Union[bytes, BinaryIO]:
+        """
+        Conteúdo para um upload multipart. Cada chamada retorna um payload
+        novo, pois o aiohttp fecha o arquivo ao final do envio.
+        """
+        if self.path is not None:
+            return open(self.path, "rb")
+        return self._memory.getvalue()
+
+    def read(self) -> bytes:
+        if self.path is not None:
+            with open(self.path, "rb") as audio_file:
+                return audio_file.read()
+        return self._memory.getvalue()
+
+    def close(self):
+        if self._file is not None and not self._file.closed:
+            self._file.close()
+        if self._finalizer is not None:
+            self._finalizer()
+        self._memory = None
+
+    def __enter__(self) -> "AudioBuffer":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
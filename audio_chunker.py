@@ -0,0 +1,195 @@
+import asyncio
+import os
+import re
+import logging
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+from audio_buffer import AudioBuffer
+
+logger = logging.getLogger("TranscreveZAP")
+
+SILENCE_PATTERN = re.compile(r"silence_(start|end): (-?\d+(?:\.\d+)?)")
+DURATION_PATTERN = re.compile(r"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)")
+
+@dataclass
+class AudioChunk:
+    """
+    Trecho de um áudio longo. `start`/`end` delimitam o que é enviado ao
+    Whisper (com sobreposição); `keep_start`/`keep_end` delimitam a parte
+    da linha do tempo que pertence a este trecho na costura.
+    """
+    start: float
+    end: float
+    keep_start: float
+    keep_end: float
+    audio: Optional[AudioBuffer] = None
+
+class AudioChunker:
+    """
+    Divide áudios longos em trechos nos silêncios usando o ffmpeg.
+
+    Áudios com duração estimada a partir de AUDIO_CHUNK_MIN_SECONDS são
+    analisados com o filtro `silencedetect`; os cortes ficam no silêncio
+    mais próximo de cada múltiplo de AUDIO_CHUNK_SECONDS e cada trecho
+    inclui AUDIO_CHUNK_OVERLAP segundos dos vizinhos, para que nenhuma
+    palavra seja perdida no corte. Sem o ffmpeg instalado, o áudio segue
+    inteiro em uma única requisição.
+    """
+
+    def __init__(self, min_seconds: float = None, chunk_seconds: float = None, overlap: float = None):
+        self.min_seconds = min_seconds if min_seconds is not None else float(os.getenv("AUDIO_CHUNK_MIN_SECONDS", 600))
+        self.chunk_seconds = chunk_seconds or float(os.getenv("AUDIO_CHUNK_SECONDS", 120))
+        self.overlap = overlap if overlap is not None else float(os.getenv("AUDIO_CHUNK_OVERLAP", 1.5))
+        self.ffmpeg = os.getenv("FFMPEG_PATH", "ffmpeg")
+        self._available = True
+        self._extract_semaphore = asyncio.Semaphore(os.cpu_count() or 2)
+
+    def should_split(self, estimated_seconds: float) -> bool:
+        return self._available and self.min_seconds > 0 and estimated_seconds >= self.min_seconds
+
+    async def _run(self, audio: AudioBuffer, args: List[str]) -> Tuple[bytes, str]:
+        """Executa o ffmpeg com o áudio como entrada (arquivo em tmpfs ou stdin)."""
+        if audio.spilled:
+            command = [self.ffmpeg, "-hide_banner", "-nostdin", "-i", audio.path, *args]
+        else:
+            command = [self.ffmpeg, "-hide_banner", "-i", "pipe:0", *args]
+        process = await asyncio.create_subprocess_exec(
+            *command,
+            stdin=None if audio.spilled else asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        stdout, stderr = await process.communicate(None if audio.spilled else audio.read())
+        stderr = stderr.decode("utf-8", errors="replace")
+        if process.returncode != 0:
+            raise RuntimeError(f"ffmpeg terminou com código {process.returncode}: {stderr[-300:]}")
+        return stdout, stderr
+
+    async def analyze(self, audio: AudioBuffer) -> Tuple[float, List[Tuple[float, float]]]:
+        """Duração do áudio e intervalos de silêncio detectados."""
+        _, output = await self._run(audio, [
+            "-af", "silencedetect=noise=-30dB:d=0.4", "-f", "null", "-"
+        ])
+        match = DURATION_PATTERN.search(output)
+        duration = int(match.group(1)) * 3600 + int(match.group(2)) * 60 + float(match.group(3)) if match else 0.0
+
+        silences, silence_start = [], None
+        for kind, value in SILENCE_PATTERN.findall(output):
+            if kind == "start":
+                silence_start = max(float(value), 0.0)
+            elif silence_start is not None:
+                silences.append((silence_start, float(value)))
+                silence_start = None
+        if silence_start is not None:
+            silences.append((silence_start, duration))
+        return duration, silences
+
+    def plan(self, duration: float, silences: List[Tuple[float, float]]) -> List[AudioChunk]:
+        """Escolhe os pontos de corte e monta os trechos com sobreposição."""
+        window = self.chunk_seconds / 4
+        midpoints = [(start + end) / 2 for start, end in silences]
+        cuts = [0.0]
+        # Evita um último trecho muito curto: só corta se sobrar mais que 1,5 trecho
+        while duration - cuts[-1] > self.chunk_seconds * 1.5:
+            ideal = cuts[-1] + self.chunk_seconds
+            candidates = [point for point in midpoints if abs(point - ideal) <= window]
+            cuts.append(min(candidates, key=lambda point: abs(point - ideal)) if candidates else ideal)
+        cuts.append(duration)
+
+        return [
+            AudioChunk(
+                start=max(keep_start - self.overlap, 0.0),
+                end=min(keep_end + self.overlap, duration),
+                keep_start=keep_start,
+                keep_end=keep_end,
+            )
+            for keep_start, keep_end in zip(cuts, cuts[1:])
+        ]
+
+    async def extract(self, audio: AudioBuffer, chunk: AudioChunk) -> AudioBuffer:
+        """Recorta um trecho em mp3 mono de 16 kHz (suficiente para o Whisper)."""
+        async with self._extract_semaphore:
+            data, _ = await self._run(audio, [
+                "-ss", f"{chunk.start:.3f}", "-t", f"{chunk.end - chunk.start:.3f}",
+                "-vn", "-ac", "1", "-ar", "16000", "-c:a", "libmp3lame", "-b:a", "48k",
+                "-f", "mp3", "pipe:1",
+            ])
+        buffer = AudioBuffer()
+        buffer.write(data)
+        return buffer.finish()
+
+    async def split(self, audio: AudioBuffer) -> List[AudioChunk]:
+        """
+        Divide o áudio em trechos. Retorna lista vazia quando não há o que
+        dividir ou quando o ffmpeg não está disponível ou não consegue ler
+        o áudio; nesses casos ele segue inteiro em uma única requisição.
+        """
+        try:
+            duration, silences = await self.analyze(audio)
+            if duration < self.min_seconds:
+                return []
+            chunks = self.plan(duration, silences)
+            if len(chunks) < 2:
+                return []
+            buffers = await asyncio.gather(
+                *(self.extract(audio, chunk) for chunk in chunks), return_exceptions=True
+            )
+        except FileNotFoundError:
+            logger.warning("ffmpeg não encontrado; áudios longos serão enviados inteiros")
+            self._available = False
+            return []
+        except (RuntimeError, OSError) as e:
+            # Container corrompido ou não suportado pelo ffmpeg: o Whisper ainda pode aceitar o arquivo
+            logger.warning(f"Falha ao dividir o áudio com o ffmpeg; enviando inteiro: {e}")
+            return []
+
+        for chunk, buffer in zip(chunks, buffers):
+            if isinstance(buffer, AudioBuffer):
+                chunk.audio = buffer
+        failed = [buffer for buffer in buffers if isinstance(buffer, BaseException)]
+        if failed:
+            close_chunks(chunks)
+            if not isinstance(failed[0], (RuntimeError, OSError)):
+                raise failed[0]
+            logger.warning(f"Falha ao extrair trechos com o ffmpeg; enviando o áudio inteiro: {failed[0]}")
+            return []
+        return chunks
+
+def close_chunks(chunks: List[AudioChunk]):
+    for chunk in chunks:
+        if chunk.audio is not None:
+            chunk.audio.close()
+
+def stitch_responses(chunks: List[AudioChunk], responses: List[Dict]) -> Dict:
+    """
+    Junta as respostas verbose_json dos trechos em uma só, com os tempos
+    dos segmentos deslocados para a linha do tempo do áudio original. Na
+    sobreposição, cada segmento fica com o trecho em que começa, evitando
+    frases duplicadas.
+    """
+    segments = []
+    language_weight: Dict[str, float] = {}
+    for index, (chunk, response) in enumerate(zip(chunks, responses)):
+        language = response.get("language")
+        if language:
+            language_weight[language] = language_weight.get(language, 0.0) + chunk.keep_end - chunk.keep_start
+
+        chunk_segments = response.get("segments")
+        if not chunk_segments:
+            # Sem segmentos: usa o texto inteiro no intervalo do trecho
+            chunk_segments = [{"start": chunk.keep_start - chunk.start, "end": chunk.keep_end - chunk.start,
+                               "text": response.get("text", "")}]
+        is_last = index == len(chunks) - 1
+        for segment in chunk_segments:
+            start = segment.get("start", 0) + chunk.start
+            end = segment.get("end", 0) + chunk.start
+            if start < chunk.keep_start or (start >= chunk.keep_end and not is_last):
+                continue
+            segments.append(dict(segment, id=len(segments), start=start, end=end))
+
+    return {
+        "text": " ".join(segment.get("text", "").strip() for segment in segments).strip(),
+        "segments": segments,
+        "language": max(language_weight, key=language_weight.get) if language_weight else None,
+        "duration": chunks[-1].end if chunks else 0,
+    }
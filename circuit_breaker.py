@@ -0,0 +1,193 @@
+import os
+import time
+import logging
+from typing import Dict
+import redis
+from metrics import metrics
+
+logger = logging.getLogger("TranscreveZAP")
+
+# Libera ou bloqueia uma chamada conforme o estado do circuito.
+# KEYS: hash de estado. ARGV: agora (epoch), duração máxima de uma sonda (s).
+# Retorna {permitido (0/1), estado}.
+ALLOW_SCRIPT = """
+local now = tonumber(ARGV[1])
+local f = redis.call('HMGET', KEYS[1], 'state', 'open_until', 'probe_until')
+local state = f[1] or 'closed'
+
+if state == 'closed' then
+    return {1, state}
+end
+if state == 'open' then
+    if now < (tonumber(f[2]) or 0) then
+        return {0, state}
+    end
+    -- Fim do período aberto: a próxima chamada é a sonda
+    redis.call('HSET', KEYS[1], 'state', 'half_open', 'probe_until', now + tonumber(ARGV[2]), 'changed_at', now)
+    return {1, 'half_open'}
+end
+-- half_open: uma sonda por vez; se a sonda não responder a tempo, outra é liberada
+if now >= (tonumber(f[3]) or 0) then
+    redis.call('HSET', KEYS[1], 'probe_until', now + tonumber(ARGV[2]))
+    return {1, state}
+end
+return {0, state}
+"""
+
+# Registra o resultado de uma chamada e aplica as transições de estado.
+# KEYS: hash de estado, hash da janela (contadores por intervalo).
+# ARGV: agora, falhou (0/1), lenta (0/1), janela (s), intervalo (s),
+#       mínimo de chamadas, taxa de erro, taxa de lentidão, tempo aberto (s).
+# Retorna o estado resultante ('opened' quando o circuito acabou de abrir).
+RECORD_SCRIPT = """
+local now = tonumber(ARGV[1])
+local failed, slow = tonumber(ARGV[2]), tonumber(ARGV[3])
+local window, bucket = tonumber(ARGV[4]), tonumber(ARGV[5])
+local state = redis.call('HGET', KEYS[1], 'state') or 'closed'
+
+if state == 'half_open' then
+    if failed == 0 and slow == 0 then
+        redis.call('DEL', KEYS[2])
+        redis.call('HSET', KEYS[1], 'state', 'closed', 'changed_at', now)
+        return 'closed'
+    end
+    redis.call('HSET', KEYS[1], 'state', 'open', 'open_until', now + tonumber(ARGV[9]), 'changed_at', now)
+    return 'opened'
+end
+if state == 'open' then
+    -- Respostas atrasadas de chamadas anteriores à abertura
+    return state
+end
+
+local slot = tostring(math.floor(now / bucket) * bucket)
+redis.call('HINCRBY', KEYS[2], slot .. ':n', 1)
+if failed == 1 then redis.call('HINCRBY', KEYS[2], slot .. ':e', 1) end
+if slow == 1 then redis.call('HINCRBY', KEYS[2], slot .. ':s', 1) end
+redis.call('EXPIRE', KEYS[2], math.ceil(window + bucket))
+
+local counts = {n = 0, e = 0, s = 0}
+local fields = redis.call('HGETALL', KEYS[2])
+for i = 1, #fields, 2 do
+    local name = fields[i]
+    local sep = string.find(name, ':')
+    if tonumber(string.sub(name, 1, sep - 1)) + bucket <= now - window then
+        redis.call('HDEL', KEYS[2], name)
+    else
+        local kind = string.sub(name, sep + 1)
+        counts[kind] = counts[kind] + tonumber(fields[i + 1])
+    end
+end
+
+if counts.n >= tonumber(ARGV[6]) and (
+    counts.e / counts.n >= tonumber(ARGV[7]) or counts.s / counts.n >= tonumber(ARGV[8])
+) then
+    redis.call('DEL', KEYS[2])
+    redis.call('HSET', KEYS[1], 'state', 'open', 'open_until', now + tonumber(ARGV[9]), 'changed_at', now)
+    return 'opened'
+end
+return state
+"""
+
+class CircuitBreaker:
+    """
+    Circuit breaker por provedor e tipo de chamada ('transcription' ou 'chat').
+
+    A taxa de erros e de chamadas lentas é contada em uma janela deslizante
+    de CIRCUIT_BREAKER_WINDOW_SECONDS no Redis, de modo que API, workers e
+    réplicas enxerguem o mesmo estado. Com ao menos
+    CIRCUIT_BREAKER_MIN_REQUESTS chamadas na janela e erros acima de
+    CIRCUIT_BREAKER_ERROR_RATE (ou lentidão acima de
+    CIRCUIT_BREAKER_SLOW_RATE), o circuito abre por
+    CIRCUIT_BREAKER_OPEN_SECONDS. Depois disso fica meio aberto: uma única
+    chamada de sonda por vez é liberada; se ela funcionar o circuito fecha,
+    senão volta a abrir. Se o Redis falhar, as chamadas são liberadas.
+    """
+    KEY_PREFIX = "transcrevezap:circuit"
+    STATE_CLOSED = "closed"
+    STATE_OPEN = "open"
+    STATE_HALF_OPEN = "half_open"
+
+    def __init__(self, client):
+        self.redis = client
+        self.window = float(os.getenv("CIRCUIT_BREAKER_WINDOW_SECONDS", 60))
+        self.bucket = max(self.window / 12, 1.0)
+        self.min_requests = int(os.getenv("CIRCUIT_BREAKER_MIN_REQUESTS", 10))
+        self.error_rate = float(os.getenv("CIRCUIT_BREAKER_ERROR_RATE", 0.5))
+        self.slow_rate = float(os.getenv("CIRCUIT_BREAKER_SLOW_RATE", 0.8))
+        self.open_seconds = float(os.getenv("CIRCUIT_BREAKER_OPEN_SECONDS", 30))
+        self.slow_seconds = {
+            "transcription": float(os.getenv("CIRCUIT_BREAKER_SLOW_TRANSCRIPTION_SECONDS", 60)),
+            "chat": float(os.getenv("CIRCUIT_BREAKER_SLOW_CHAT_SECONDS", 20)),
+        }
+        self._allow_script = client.register_script(ALLOW_SCRIPT)
+        self._record_script = client.register_script(RECORD_SCRIPT)
+
+    @property
+    def enabled(self) -> bool:
+        return self.min_requests > 0
+
+    @classmethod
+    def state_key(cls, provider: str, endpoint: str) -> str:
+        return f"{cls.KEY_PREFIX}:{provider}:{endpoint}"
+
+    @classmethod
+    def read_state(cls, client: redis.Redis, provider: str, endpoint: str) -> Dict:
+        """Leitura síncrona do estado de um circuito (usada pelo manager)."""
+        data = client.hgetall(cls.state_key(provider, endpoint))
+        return data or {"state": cls.STATE_CLOSED}
+
+    async def allow(self, provider: str, endpoint: str) -> bool:
+        """Indica se uma chamada ao provedor pode ser feita agora."""
+        if not self.enabled:
+            return True
+        try:
+            allowed, state = await self._allow_script(
+                keys=[self.state_key(provider, endpoint)],
+                args=[time.time(), self.slow_seconds.get(endpoint, 60)]
+            )
+        except redis.exceptions.RedisError as e:
+            logger.error(f"Erro ao consultar circuit breaker {provider}/{endpoint}: {e}")
+            return True
+        if not int(allowed):
+            metrics.incr("circuit_breaker", f"{provider}.{endpoint}.rejected")
+        elif state == self.STATE_HALF_OPEN:
+            metrics.incr("circuit_breaker", f"{provider}.{endpoint}.probes")
+        return bool(int(allowed))
+
+    async def record(self, provider: str, endpoint: str, failed: bool, elapsed: float):
+        """Registra o resultado de uma chamada e atualiza o estado do circuito."""
+        if not self.enabled:
+            return
+        slow = elapsed >= self.slow_seconds.get(endpoint, 60)
+        try:
+            state = await self._record_script(
+                keys=[self.state_key(provider, endpoint), f"{self.state_key(provider, endpoint)}:window"],
+                args=[
+                    time.time(), int(failed), int(slow), self.window, self.bucket,
+                    self.min_requests, self.error_rate, self.slow_rate, self.open_seconds,
+                ]
+            )
+        except redis.exceptions.RedisError as e:
+            logger.error(f"Erro ao registrar no circuit breaker {provider}/{endpoint}: {e}")
+            return
+        if failed:
+            metrics.incr("circuit_breaker", f"{provider}.{endpoint}.failures")
+        if slow:
+            metrics.incr("circuit_breaker", f"{provider}.{endpoint}.slow_calls")
+        if state == "opened":
+            metrics.incr("circuit_breaker", f"{provider}.{endpoint}.opened")
+            logger.warning(f"Circuito {provider}/{endpoint} aberto por {self.open_seconds:.0f}s")
+
+def is_provider_failure(response_data: Dict) -> bool:
+    """
+    Indica se uma chamada malsucedida é falha do provedor (erro de rede,
+    timeout, 5xx, limite de taxa, chaves esgotadas) e não da requisição
+    (ex.: áudio inválido), que não deve abrir o circuito.
+    """
+    if not response_data:
+        return True
+    error = response_data.get("error")
+    if not isinstance(error, dict):
+        # Resposta válida, porém vazia (ex.: áudio sem fala)
+        return bool(error)
+    return error.get("type") != "invalid_request_error" or error.get("code") == "invalid_api_key"
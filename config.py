@@ -1,7 +1,14 @@
 import logging
 import redis
 import os
-from utils import create_redis_client
+import threading
+import time
+from utils import (
+    create_redis_client,
+    publish_config_change,
+    CONFIG_VERSION_KEY,
+    CONFIG_CHANNEL,
+)
 
 # Configuração de logging com cores e formatação melhorada
 class ColoredFormatter(logging.Formatter):
@@ -33,21 +40,149 @@ logger.setLevel(logging.INFO)
 # Conexão com o Redis
 redis_client = create_redis_client()
 
+class ConfigSnapshot:
+    """
+    Snapshot versionado das configurações em memória.
+
+    Todas as chaves de configuração são carregadas com um único MGET e
+    servidas localmente. O manager incrementa `transcrevezap:config_version`
+    e publica em `transcrevezap:config_updates` a cada alteração; o snapshot
+    é invalidado pela notificação e, como fallback, confere a versão no
+    Redis a cada CONFIG_SNAPSHOT_TTL segundos.
+    """
+    VERSION_KEY = CONFIG_VERSION_KEY
+    CHANNEL = CONFIG_CHANNEL
+
+    # Chaves carregadas no snapshot (globais e prefixadas do StorageHandler)
+    DEFAULT_KEYS = [
+        "GROQ_API_KEY",
+        "OPENAI_API_KEY",
+        "ACTIVE_LLM_PROVIDER",
+        "BUSINESS_MESSAGE",
+        "PROCESS_GROUP_MESSAGES",
+        "PROCESS_SELF_MESSAGES",
+        "DEBUG_MODE",
+        "TRANSCRIPTION_LANGUAGE",
+        "output_mode",
+        "summary_header",
+        "transcription_header",
+        "character_limit",
+        "use_timestamps",
+        "progressive_delivery",
+        "transcrevezap:active_llm_provider",
+        "transcrevezap:process_mode",
+        "transcrevezap:auto_language_detection",
+        "transcrevezap:auto_translation",
+        "transcrevezap:redis_log_level",
+    ]
+
+    def __init__(self, client, ttl: float = None):
+        self.redis = client
+        self.ttl = ttl if ttl is not None else float(os.getenv("CONFIG_SNAPSHOT_TTL", 30))
+        self._keys = list(self.DEFAULT_KEYS)
+        self._values = {}
+        self._version = None
+        self._loaded_at = 0.0
+        self._invalidated = True
+        self._lock = threading.Lock()
+        self._listener = None
+
+    @property
+    def version(self):
+        return self._version
+
+    def _load(self):
+        """Carrega todas as chaves com um único round-trip."""
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.get(self.VERSION_KEY)
+        pipe.mget(self._keys)
+        version, values = pipe.execute()
+        self._values = dict(zip(self._keys, values))
+        self._version = version
+        self._loaded_at = time.monotonic()
+        self._invalidated = False
+        logger.debug(f"Snapshot de configurações carregado (versão {version})")
+
+    def _ensure_fresh(self):
+        self._ensure_listener()
+        if not self._invalidated and time.monotonic() - self._loaded_at < self.ttl:
+            return
+        with self._lock:
+            if not self._invalidated and time.monotonic() - self._loaded_at < self.ttl:
+                return
+            try:
+                if not self._invalidated and self._values:
+                    # Fallback por TTL: só recarrega se a versão mudou
+                    if self.redis.get(self.VERSION_KEY) == self._version:
+                        self._loaded_at = time.monotonic()
+                        return
+                self._load()
+            except redis.exceptions.RedisError as e:
+                # Mantém o último snapshot válido se o Redis estiver indisponível
+                logger.error(f"Erro ao recarregar snapshot de configurações: {e}")
+                if not self._values:
+                    raise
+
+    def _ensure_listener(self):
+        """Inicia (uma vez) a thread que escuta notificações de alteração."""
+        if self._listener is not None:
+            return
+        try:
+            pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(**{self.CHANNEL: lambda message: self.invalidate()})
+            self._listener = pubsub.run_in_thread(sleep_time=1, daemon=True)
+        except Exception as e:
+            # Sem pub/sub o snapshot continua válido via fallback de TTL
+            logger.warning(f"Não foi possível assinar notificações de configuração: {e}")
+            self._listener = False
+
+    def invalidate(self):
+        """Força o recarregamento na próxima leitura."""
+        self._invalidated = True
+
+    def get(self, key, default=None):
+        """Obtém uma configuração do snapshot com fallback para o padrão."""
+        self._ensure_fresh()
+        if key not in self._values:
+            # Chave ainda não rastreada: passa a fazer parte do snapshot
+            with self._lock:
+                if key not in self._keys:
+                    self._keys.append(key)
+                self._values[key] = self.redis.get(key)
+        value = self._values.get(key)
+        return default if value is None else value
+
+    def get_llm_provider(self) -> str:
+        return self.get("transcrevezap:active_llm_provider", "groq")
+
+    def get_process_mode(self) -> str:
+        return self.get("transcrevezap:process_mode", "all")
+
+    def get_auto_language_detection(self) -> bool:
+        return self.get("transcrevezap:auto_language_detection") == "true"
+
+    def get_auto_translation(self) -> bool:
+        return self.get("transcrevezap:auto_translation") == "true"
+
+    def get_transcription_language(self) -> str:
+        return self.get("TRANSCRIPTION_LANGUAGE") or "pt"
+
+# Snapshot compartilhado pelo processo
+config_snapshot = ConfigSnapshot(redis_client)
+
 class Settings:
-    """Classe para gerenciar configurações do sistema."""
-    def __init__(self):
+    """
+    Classe para gerenciar configurações do sistema.
+    Os valores dinâmicos são lidos do snapshot a cada acesso, portanto
+    refletem as alterações feitas no manager sem recriar a instância.
+    """
+    def __init__(self, snapshot: ConfigSnapshot = None):
         """Inicializa as configurações."""
         logger.debug("Carregando configurações do Redis...")
+        self._snapshot = snapshot or config_snapshot
 
-        self.ACTIVE_LLM_PROVIDER = self.get_redis_value("ACTIVE_LLM_PROVIDER", "groq")
-        self.OPENAI_API_KEY = self.get_redis_value("OPENAI_API_KEY", "")
-        self.GROQ_API_KEY = self.get_redis_value("GROQ_API_KEY", "gsk_default_key")
-        self.BUSINESS_MESSAGE = self.get_redis_value("BUSINESS_MESSAGE", "*Impacte AI* Premium Services")
-        self.PROCESS_GROUP_MESSAGES = self.get_redis_value("PROCESS_GROUP_MESSAGES", "false").lower() == "true"
-        self.PROCESS_SELF_MESSAGES = self.get_redis_value("PROCESS_SELF_MESSAGES", "true").lower() == "true"
         self.DEBUG_MODE = os.getenv("DEBUG_MODE", "false").lower() == "true"
         self.LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
-        self.TRANSCRIPTION_LANGUAGE = self.get_redis_value("TRANSCRIPTION_LANGUAGE", "pt")
         
         # Mascarar chave ao logar
         if self.GROQ_API_KEY:
@@ -62,17 +197,42 @@ class Settings:
             f"PROCESS_SELF_MESSAGES={self.PROCESS_SELF_MESSAGES}"
         )
 
+    @property
+    def ACTIVE_LLM_PROVIDER(self):
+        return self.get_redis_value("ACTIVE_LLM_PROVIDER", "groq")
+
+    @property
+    def OPENAI_API_KEY(self):
+        return self.get_redis_value("OPENAI_API_KEY", "")
+
+    @property
+    def GROQ_API_KEY(self):
+        return self.get_redis_value("GROQ_API_KEY", "gsk_default_key")
+
+    @property
+    def BUSINESS_MESSAGE(self):
+        return self.get_redis_value("BUSINESS_MESSAGE", "*Impacte AI* Premium Services")
+
+    @property
+    def PROCESS_GROUP_MESSAGES(self):
+        return self.get_redis_value("PROCESS_GROUP_MESSAGES", "false").lower() == "true"
+
+    @property
+    def PROCESS_SELF_MESSAGES(self):
+        return self.get_redis_value("PROCESS_SELF_MESSAGES", "true").lower() == "true"
+
+    @property
+    def TRANSCRIPTION_LANGUAGE(self):
+        return self.get_redis_value("TRANSCRIPTION_LANGUAGE", "pt")
+
     def get_redis_value(self, key, default):
-        """Obtém um valor do Redis com fallback para o valor padrão."""
-        value = redis_client.get(key)
-        if value is None:
-            logger.warning(f"Configuração '{key}' não encontrada no Redis. Usando padrão: {default}")
-            return default
-        return value
+        """Obtém um valor do snapshot com fallback para o valor padrão."""
+        return self._snapshot.get(key, default)
 
     def set_redis_value(self, key, value):
-        """Define um valor no Redis."""
+        """Define um valor no Redis e notifica os demais processos."""
         redis_client.set(key, value)
+        publish_config_change(redis_client)
         logger.debug(f"Configuração '{key}' atualizada no Redis")
 
     def validate(self):
@@ -104,8 +264,32 @@ def load_settings():
     Recarrega as configurações do Redis.
     """
     global settings
+    config_snapshot.invalidate()
     settings = Settings()
     # Ajustar nível de log
     log_level = getattr(logging, settings.LOG_LEVEL, logging.INFO)
     logger.setLevel(log_level)
-    logger.info(f"Nível de log ajustado para: {logging.getLevelName(log_level)}")
\ No newline at end of file
+    logger.info(f"Nível de log ajustado para: {logging.getLevelName(log_level)}")
+
+
+# Função para buscar configurações do snapshot com fallback para valores padrão
+def get_config(key, default=None):
+    try:
+        value = config_snapshot.get(key)
+        if value is None:
+            logger.debug(f"Configuração '{key}' não encontrada no Redis. Usando padrão: {default}")
+            return default
+        return value
+    except Exception as e:
+        logger.error(f"Erro ao acessar Redis: {e}")
+        return default
+
+# Carregando configurações dinâmicas do snapshot
+def load_dynamic_settings():
+    return {
+        "GROQ_API_KEY": get_config("GROQ_API_KEY", "default_key"),
+        "BUSINESS_MESSAGE": get_config("BUSINESS_MESSAGE", "*Impacte AI* Premium Services"),
+        "PROCESS_GROUP_MESSAGES": get_config("PROCESS_GROUP_MESSAGES", "false") == "true",
+        "PROCESS_SELF_MESSAGES": get_config("PROCESS_SELF_MESSAGES", "true") == "true",
+        "DEBUG_MODE": get_config("DEBUG_MODE", "false") == "true",
+    }
@@ -1,10 +1,9 @@
-import aiohttp
-import json
 from typing import Optional, Tuple, Any
-from datetime import datetime
 import logging
-from storage import StorageHandler
-import asyncio
+import os
+from async_storage import AsyncStorageHandler
+from http_client import http_client
+from key_pool import KeyPool
 
 logger = logging.getLogger("GROQHandler")
 logger.setLevel(logging.DEBUG)
@@ -19,7 +18,7 @@ async def test_groq_key(key: str) -> bool:
     headers = {"Authorization": f"Bearer {key}"}
 
     try:
-        async with aiohttp.ClientSession() as session:
+        async with http_client.session() as session:
             async with session.get(url, headers=headers) as response:
                 if response.status == 200:
                     data = await response.json()
@@ -38,23 +37,31 @@ async def validate_transcription_response(response_text: str) -> bool:
         logger.error(f"Erro ao validar resposta da transcrição: {e}")
         return False
 
-async def get_working_groq_key(storage: StorageHandler) -> Optional[str]:
-    """Obtenha uma chave GROQ funcional do pool disponível."""
-    keys = storage.get_groq_keys()
+_groq_key_pool: Optional[KeyPool] = None
 
-    for _ in range(len(keys)):
-        key = storage.get_next_groq_key()
-        if not key:
-            continue
+def get_groq_key_pool(storage: AsyncStorageHandler) -> KeyPool:
+    """Retorna o registro de saúde compartilhado das chaves GROQ."""
+    global _groq_key_pool
+    if _groq_key_pool is None:
+        _groq_key_pool = KeyPool(
+            storage,
+            "groq",
+            storage.get_groq_keys,
+            resource_limits={
+                "audio": (3600, float(os.getenv("GROQ_AUDIO_SECONDS_PER_HOUR", 7200))),
+                "tokens": (60, float(os.getenv("GROQ_TOKENS_PER_MINUTE", 6000))),
+            }
+        )
+    return _groq_key_pool
 
-        penalized_until = storage.get_penalized_until(key)
-        if penalized_until and penalized_until > datetime.utcnow():
-            continue
-
-        if await test_groq_key(key):
-            return key
-        else:
-            storage.penalize_key(key, penalty_duration=300)
+async def get_working_groq_key(storage: AsyncStorageHandler, resource: str = None, exclude: Optional[set] = None) -> Optional[str]:
+    """
+    Obtenha a chave GROQ com mais folga de cota para o recurso
+    ('audio' para Whisper, 'tokens' para chat), sem requisição de teste.
+    """
+    key = await get_groq_key_pool(storage).select_key(resource, exclude)
+    if key:
+        return key
 
     storage.add_log("ERROR", "Nenhuma chave GROQ funcional disponível.")
     return None
@@ -63,49 +70,13 @@ async def handle_groq_request(
     url: str, 
     headers: dict, 
     data: Any, 
-    storage: StorageHandler,
-    is_form_data: bool = False
+    storage: AsyncStorageHandler,
+    is_form_data: bool = False,
+    audio_seconds: float = None
 ) -> Tuple[bool, dict, str]:
-    """Lida com requisições para a API GROQ com suporte a retries e rotação de chaves."""
-    max_retries = len(storage.get_groq_keys())
-    
-    for attempt in range(max_retries):
-        try:
-            storage.add_log("DEBUG", "Iniciando tentativa de requisição para GROQ", {
-                "url": url,
-                "is_form_data": is_form_data,
-                "attempt": attempt + 1
-            })
-
-            async with aiohttp.ClientSession() as session:
-                if is_form_data:
-                    async with session.post(url, headers=headers, data=data) as response:
-                        response_data = await response.json()
-                        if response.status == 200 and response_data.get("text"):
-                            return True, response_data, ""
-                else:
-                    async with session.post(url, headers=headers, json=data) as response:
-                        response_data = await response.json()
-                        if response.status == 200 and response_data.get("choices"):
-                            return True, response_data, ""
-                
-                error_msg = response_data.get("error", {}).get("message", "")
-                
-                if "organization_restricted" in error_msg or "invalid_api_key" in error_msg:
-                    new_key = await get_working_groq_key(storage)
-                    if new_key:
-                        headers["Authorization"] = f"Bearer {new_key}"
-                        await asyncio.sleep(1)
-                        continue
-
-                return False, response_data, error_msg
-
-        except Exception as e:
-            storage.add_log("ERROR", "Erro na requisição", {"error": str(e)})
-            if attempt < max_retries - 1:
-                await asyncio.sleep(1)
-                continue
-            return False, {}, f"Request failed: {str(e)}"
-
-    storage.add_log("ERROR", "Todas as chaves GROQ falharam.")
-    return False, {}, "All GROQ keys exhausted."
\ No newline at end of file
+    """
+    Lida com requisições para a API GROQ com suporte a retries e rotação de chaves.
+    audio_seconds é a duração estimada do áudio, usada na cota por janela
+    quando a resposta não informa a duração.
+    """
+    return await get_groq_key_pool(storage).request(url, headers, data, is_form_data, audio_seconds)
@@ -0,0 +1,107 @@
+import os
+from contextlib import asynccontextmanager
+from typing import Optional
+import logging
+import aiohttp
+from metrics import metrics
+
+logger = logging.getLogger("TranscreveZAP")
+
+class HTTPClient:
+    """
+    Sessão aiohttp compartilhada por todo o processo.
+
+    Reaproveita conexões (keep-alive), mantém cache de DNS e limita
+    conexões por host, evitando um novo DNS + TCP + TLS a cada chamada
+    para Groq, OpenAI, Evolution API e webhooks. É criada no lifespan do
+    FastAPI (e no início do worker) e fechada no desligamento.
+    """
+
+    def __init__(self):
+        self.limit = int(os.getenv("HTTP_POOL_LIMIT", 100))
+        self.limit_per_host = int(os.getenv("HTTP_POOL_LIMIT_PER_HOST", 20))
+        self.dns_cache_ttl = int(os.getenv("HTTP_DNS_CACHE_TTL", 300))
+        self.keepalive_timeout = float(os.getenv("HTTP_KEEPALIVE_TIMEOUT", 30))
+        self.timeout = aiohttp.ClientTimeout(
+            total=float(os.getenv("HTTP_TOTAL_TIMEOUT", 300)),
+            connect=float(os.getenv("HTTP_CONNECT_TIMEOUT", 10)),
+            sock_read=float(os.getenv("HTTP_READ_TIMEOUT", 240)),
+        )
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def _build_trace_config(self) -> aiohttp.TraceConfig:
+        """Contadores de reutilização de conexões e cache de DNS."""
+        trace_config = aiohttp.TraceConfig()
+
+        async def on_request_end(session, context, params):
+            metrics.incr("http", "requests")
+
+        async def on_connection_create_end(session, context, params):
+            metrics.incr("http", "connections_created")
+
+        async def on_connection_reuseconn(session, context, params):
+            metrics.incr("http", "connections_reused")
+
+        async def on_dns_cache_hit(session, context, params):
+            metrics.incr("http", "dns_cache_hits")
+
+        async def on_dns_cache_miss(session, context, params):
+            metrics.incr("http", "dns_cache_misses")
+
+        trace_config.on_request_end.append(on_request_end)
+        trace_config.on_connection_create_end.append(on_connection_create_end)
+        trace_config.on_connection_reuseconn.append(on_connection_reuseconn)
+        trace_config.on_dns_cache_hit.append(on_dns_cache_hit)
+        trace_config.on_dns_cache_miss.append(on_dns_cache_miss)
+        return trace_config
+
+    def _create_session(self) -> aiohttp.ClientSession:
+        connector = aiohttp.TCPConnector(
+            limit=self.limit,
+            limit_per_host=self.limit_per_host,
+            ttl_dns_cache=self.dns_cache_ttl,
+            use_dns_cache=True,
+            keepalive_timeout=self.keepalive_timeout,
+        )
+        return aiohttp.ClientSession(
+            connector=connector,
+            timeout=self.timeout,
+            trace_configs=[self._build_trace_config()],
+        )
+
+    async def start(self):
+        """Cria a sessão compartilhada (deve ser chamado dentro do event loop)."""
+        self.get_session()
+        logger.info("Sessão HTTP compartilhada iniciada")
+
+    def get_session(self) -> aiohttp.ClientSession:
+        """Retorna a sessão compartilhada, criando-a sob demanda."""
+        if self._session is None or self._session.closed:
+            self._session = self._create_session()
+        return self._session
+
+    @asynccontextmanager
+    async def session(self):
+        """
+        Context manager que entrega a sessão compartilhada sem fechá-la
+        ao final, substituindo `async with aiohttp.ClientSession()`.
+        """
+        yield self.get_session()
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+            logger.info("Sessão HTTP compartilhada encerrada")
+        self._session = None
+
+    def get_stats(self) -> dict:
+        """Contadores deste processo, incluindo a taxa de reutilização de conexões."""
+        stats = metrics.snapshot().get("http", {})
+        created = stats.get("connections_created", 0)
+        reused = stats.get("connections_reused", 0)
+        total = created + reused
+        stats["reuse_rate"] = (reused / total) * 100 if total else 0.0
+        return stats
+
+# Cliente compartilhado pelo processo
+http_client = HTTPClient()
@@ -0,0 +1,199 @@
+import json
+import os
+import socket
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+import logging
+import redis
+from utils import create_redis_client
+
+logger = logging.getLogger("TranscreveZAP")
+
+# Zera o tempo ocioso de uma entrada somente se ela ainda pertencer ao
+# consumidor informado (XCLAIM JUSTID não conta como nova entrega).
+# KEYS: stream. ARGV: grupo, consumidor, ID da entrada.
+RENEW_ENTRY_SCRIPT = """
+local pending = redis.call('XPENDING', KEYS[1], ARGV[1], ARGV[3], ARGV[3], 1)
+if #pending == 0 or pending[1][2] ~= ARGV[2] then
+    return 0
+end
+redis.call('XCLAIM', KEYS[1], ARGV[1], ARGV[2], 0, ARGV[3], 'JUSTID')
+return 1
+"""
+
+# Remove um consumidor do grupo somente se ele não tiver entradas pendentes
+# (DELCONSUMER descartaria as pendências junto).
+# KEYS: stream. ARGV: grupo, consumidor.
+DELETE_IDLE_CONSUMER_SCRIPT = """
+if #redis.call('XPENDING', KEYS[1], ARGV[1], '-', '+', 1, ARGV[2]) > 0 then
+    return 0
+end
+redis.call('XGROUP', 'DELCONSUMER', KEYS[1], ARGV[1], ARGV[2])
+return 1
+"""
+
+class JobQueue:
+    """
+    Fila de jobs de transcrição baseada em Redis Streams.
+
+    O endpoint do webhook apenas publica um job compacto no stream e os
+    workers (consumer group) executam o pipeline. Mensagens de workers que
+    morreram no meio do processamento são recuperadas via XPENDING/XCLAIM.
+    """
+    STREAM_KEY = "transcrevezap:jobs"
+    DEAD_LETTER_KEY = "transcrevezap:jobs:dead"
+    GROUP_NAME = "transcrevezap-workers"
+
+    def __init__(self, redis_client: Optional[redis.Redis] = None):
+        self.redis = redis_client or create_redis_client()
+        self.max_length = int(os.getenv("QUEUE_MAX_LENGTH", 10000))
+        self.claim_idle_ms = int(os.getenv("QUEUE_CLAIM_IDLE_MS", 300000))
+        self.max_deliveries = int(os.getenv("QUEUE_MAX_DELIVERIES", 3))
+        self.consumer_max_idle_ms = int(os.getenv("QUEUE_CONSUMER_MAX_IDLE_MS", 3600000))
+        self._renew_script = self.redis.register_script(RENEW_ENTRY_SCRIPT)
+        self._delete_consumer_script = self.redis.register_script(DELETE_IDLE_CONSUMER_SCRIPT)
+
+    @staticmethod
+    def default_consumer_name() -> str:
+        """Nome único do consumidor (host + pid) para escalar entre containers."""
+        return f"{socket.gethostname()}-{os.getpid()}"
+
+    def ensure_group(self):
+        """Cria o consumer group (e o stream) caso ainda não existam."""
+        try:
+            self.redis.xgroup_create(self.STREAM_KEY, self.GROUP_NAME, id="0", mkstream=True)
+            logger.info(f"Consumer group '{self.GROUP_NAME}' criado")
+        except redis.exceptions.ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    def enqueue(self, job: Dict) -> str:
+        """Publica um job no stream e retorna o ID da entrada."""
+        fields = {
+            "payload": json.dumps(job),
+            "enqueued_at": datetime.now().isoformat(),
+        }
+        return self.redis.xadd(
+            self.STREAM_KEY,
+            fields,
+            maxlen=self.max_length,
+            approximate=True
+        )
+
+    def _decode_entry(self, fields: Dict) -> Dict:
+        job = json.loads(fields.get("payload") or "{}")
+        job["enqueued_at"] = fields.get("enqueued_at")
+        return job
+
+    def read(self, consumer: str, count: int = 1, block_ms: int = 5000) -> List[Tuple[str, Dict]]:
+        """Lê novos jobs destinados a este consumidor (bloqueante até block_ms)."""
+        response = self.redis.xreadgroup(
+            self.GROUP_NAME,
+            consumer,
+            {self.STREAM_KEY: ">"},
+            count=count,
+            block=block_ms
+        )
+        entries = []
+        for _stream, messages in response or []:
+            for entry_id, fields in messages:
+                entries.append((entry_id, self._decode_entry(fields)))
+        return entries
+
+    def claim_stale(self, consumer: str, count: int = 10) -> List[Tuple[str, Dict, int]]:
+        """
+        Assume jobs pendentes há mais de claim_idle_ms (worker travado ou morto).
+        Retorna tuplas (id, job, número de entregas).
+        """
+        pending = self.redis.xpending_range(
+            self.STREAM_KEY,
+            self.GROUP_NAME,
+            min="-",
+            max="+",
+            count=count,
+            idle=self.claim_idle_ms
+        )
+        if not pending:
+            return []
+
+        deliveries = {p["message_id"]: p["times_delivered"] for p in pending}
+        claimed = self.redis.xclaim(
+            self.STREAM_KEY,
+            self.GROUP_NAME,
+            consumer,
+            min_idle_time=self.claim_idle_ms,
+            message_ids=list(deliveries.keys())
+        )
+        entries = []
+        for entry_id, fields in claimed:
+            if fields is None:
+                # Entrada removida do stream pelo MAXLEN; só resta confirmar
+                self.ack(entry_id)
+                continue
+            entries.append((entry_id, self._decode_entry(fields), deliveries.get(entry_id, 1) + 1))
+        return entries
+
+    def renew(self, consumer: str, entry_id: str) -> bool:
+        """
+        Renova a posse de um job em execução, para que ele não seja
+        reassumido por outro worker enquanto ainda está sendo processado.
+        Retorna False se a entrada já não pertencer a este consumidor.
+        """
+        return bool(self._renew_script(keys=[self.STREAM_KEY], args=[self.GROUP_NAME, consumer, entry_id]))
+
+    def remove_consumer(self, consumer: str) -> bool:
+        """Remove o consumidor do grupo se ele não tiver jobs pendentes."""
+        return bool(self._delete_consumer_script(keys=[self.STREAM_KEY], args=[self.GROUP_NAME, consumer]))
+
+    def remove_idle_consumers(self) -> int:
+        """
+        Remove os consumidores sem pendências e ociosos há mais de
+        QUEUE_CONSUMER_MAX_IDLE_MS. Como o nome inclui o PID, cada restart
+        de um worker deixaria um consumidor morto no grupo.
+        """
+        try:
+            consumers = self.redis.xinfo_consumers(self.STREAM_KEY, self.GROUP_NAME)
+        except redis.exceptions.ResponseError:
+            return 0
+        removed = 0
+        for consumer in consumers:
+            if consumer["pending"] or consumer["idle"] < self.consumer_max_idle_ms:
+                continue
+            if self.remove_consumer(consumer["name"]):
+                removed += 1
+        if removed:
+            logger.info(f"{removed} consumidor(es) ocioso(s) removido(s) do grupo '{self.GROUP_NAME}'")
+        return removed
+
+    def ack(self, entry_id: str):
+        """Confirma o processamento e remove a entrada do stream."""
+        pipe = self.redis.pipeline()
+        pipe.xack(self.STREAM_KEY, self.GROUP_NAME, entry_id)
+        pipe.xdel(self.STREAM_KEY, entry_id)
+        pipe.execute()
+
+    def dead_letter(self, entry_id: str, job: Dict, reason: str):
+        """Move um job que excedeu o limite de entregas para o stream de falhas."""
+        self.redis.xadd(
+            self.DEAD_LETTER_KEY,
+            {
+                "payload": json.dumps(job),
+                "reason": reason,
+                "failed_at": datetime.now().isoformat(),
+            },
+            maxlen=1000,
+            approximate=True
+        )
+        self.ack(entry_id)
+
+    def get_queue_stats(self) -> Dict:
+        """Retorna tamanho do stream, pendências e quantidade de jobs mortos."""
+        try:
+            pending = self.redis.xpending(self.STREAM_KEY, self.GROUP_NAME)
+            return {
+                "length": self.redis.xlen(self.STREAM_KEY),
+                "pending": pending.get("pending", 0),
+                "dead_letter": self.redis.xlen(self.DEAD_LETTER_KEY),
+            }
+        except redis.exceptions.ResponseError:
+            return {"length": 0, "pending": 0, "dead_letter": 0}
@@ -0,0 +1,516 @@
+import asyncio
+import hashlib
+import os
+import re
+import time
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+import logging
+import redis
+from async_storage import AsyncStorageHandler
+from http_client import http_client
+from metrics import metrics
+from retry_policy import retry_policy, retry_budget
+
+logger = logging.getLogger("TranscreveZAP")
+
+# Escolhe atomicamente a chave com mais folga de cota.
+# KEYS: pares (hash de saúde, hash de uso por intervalo) por chave.
+# ARGV: agora (epoch), janela (s), limite da janela, intervalo (s).
+SELECT_KEY_SCRIPT = """
+local now = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local window_limit = tonumber(ARGV[3])
+local bucket = tonumber(ARGV[4])
+local best, best_score, best_last = nil, nil, nil
+
+for i = 1, #KEYS / 2 do
+    local health_key = KEYS[2 * i - 1]
+    local usage_key = KEYS[2 * i]
+    local f = redis.call('HMGET', health_key,
+        'status', 'penalized_until_ts', 'retry_after_until',
+        'remaining_requests', 'limit_requests', 'reset_requests_at',
+        'remaining_tokens', 'limit_tokens', 'reset_tokens_at', 'last_used')
+
+    local usable = f[1] ~= 'invalid'
+    if usable and tonumber(f[2]) and tonumber(f[2]) > now then usable = false end
+    if usable and tonumber(f[3]) and tonumber(f[3]) > now then usable = false end
+
+    if usable then
+        local score = 1.0
+        -- Folga informada pelos headers x-ratelimit (válida até o reset)
+        for _, idx in ipairs({4, 7}) do
+            local remaining, limit, reset = tonumber(f[idx]), tonumber(f[idx + 1]), tonumber(f[idx + 2])
+            if remaining and limit and limit > 0 and (not reset or reset > now) then
+                score = math.min(score, remaining / limit)
+            end
+        end
+        -- Estimativa por janela deslizante (segundos de áudio ou tokens):
+        -- um total por intervalo, no máximo ~60 campos por chave
+        if window_limit > 0 then
+            local used = 0
+            local usage = redis.call('HGETALL', usage_key)
+            for j = 1, #usage, 2 do
+                if tonumber(usage[j]) + bucket <= now - window then
+                    redis.call('HDEL', usage_key, usage[j])
+                else
+                    used = used + tonumber(usage[j + 1])
+                end
+            end
+            score = math.min(score, 1 - used / window_limit)
+        end
+        local last = tonumber(f[10]) or 0
+        if best == nil or score > best_score or (score == best_score and last < best_last) then
+            best, best_score, best_last = i, score, last
+        end
+    end
+end
+
+if best == nil then
+    return nil
+end
+
+-- Reserva: marca o uso e desconta uma requisição da folga conhecida
+local chosen = KEYS[2 * best - 1]
+redis.call('HSET', chosen, 'last_used', ARGV[1])
+if redis.call('HEXISTS', chosen, 'remaining_requests') == 1 then
+    redis.call('HINCRBYFLOAT', chosen, 'remaining_requests', -1)
+end
+return {best, tostring(best_score)}
+"""
+
+_DURATION_PATTERN = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+
+def parse_reset_duration(value: Optional[str]) -> Optional[float]:
+    """Converte durações como '2m59.56s', '7.66s' ou '120ms' em segundos."""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    total = 0.0
+    matched = False
+    for amount, unit in _DURATION_PATTERN.findall(value):
+        matched = True
+        amount = float(amount)
+        total += {"h": amount * 3600, "m": amount * 60, "s": amount, "ms": amount / 1000}[unit]
+    return total if matched else None
+
+def get_request_key(headers: dict) -> Optional[str]:
+    """Extrai a chave usada na requisição a partir do header Authorization."""
+    authorization = headers.get("Authorization", "")
+    return authorization[len("Bearer "):] if authorization.startswith("Bearer ") else None
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Header retry-after em segundos (número, duração como '7.66s' ou data HTTP)."""
+    seconds = parse_reset_duration(value)
+    if seconds is not None or not value:
+        return seconds
+    try:
+        return max((parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+class KeyPool:
+    """
+    Registro de saúde de um pool de chaves de API.
+
+    O estado de cada chave (healthy, penalized ou invalid, horário da última
+    verificação e último erro) fica em um hash no Redis, compartilhado entre
+    API e workers. A seleção de chave usa uma cópia local desse registro,
+    atualizada a cada KEY_HEALTH_REFRESH_SECONDS, sem chamadas extras ao
+    provedor: os sinais vêm das próprias respostas (200, 401, 403, 429).
+
+    A escolha da chave é feita por um script Lua atômico que considera os
+    headers x-ratelimit-* e retry-after registrados a cada resposta e uma
+    estimativa por janela deslizante do consumo de cada recurso
+    (segundos de áudio no Whisper, tokens no chat), de modo que vários
+    workers nunca disputem a mesma folga.
+    """
+    STATUS_HEALTHY = "healthy"
+    STATUS_PENALIZED = "penalized"
+    STATUS_INVALID = "invalid"
+
+    def __init__(
+        self,
+        storage: AsyncStorageHandler,
+        provider: str,
+        keys_getter: Callable[[], Awaitable[List[str]]],
+        resource_limits: Dict[str, Tuple[int, float]] = None
+    ):
+        self.storage = storage
+        self.provider = provider
+        self.keys_getter = keys_getter
+        # recurso -> (janela em segundos, limite estimado na janela)
+        self.resource_limits = resource_limits or {}
+        self._select_script = storage.redis.register_script(SELECT_KEY_SCRIPT)
+        self.refresh_interval = float(os.getenv("KEY_HEALTH_REFRESH_SECONDS", 10))
+        self.invalid_recheck_seconds = int(os.getenv("KEY_INVALID_RECHECK_SECONDS", 3600))
+        self._keys: List[str] = []
+        self._health: Dict[str, Dict] = {}
+        self._refreshed_at = 0.0
+        self._cursor = 0
+
+    @staticmethod
+    def fingerprint(key: str) -> str:
+        """Identificador curto da chave, para não expor a chave nas chaves Redis."""
+        return hashlib.sha1(key.encode()).hexdigest()[:12]
+
+    @classmethod
+    def health_key(cls, provider: str, key: str) -> str:
+        return f"transcrevezap:key_health:{provider}:{cls.fingerprint(key)}"
+
+    @classmethod
+    def read_health(cls, client: redis.Redis, provider: str, key: str) -> Dict:
+        """Leitura síncrona do estado de uma chave (usada pelo manager)."""
+        data = client.hgetall(cls.health_key(provider, key))
+        return data or {"status": cls.STATUS_HEALTHY}
+
+    def _health_key(self, key: str) -> str:
+        return self.health_key(self.provider, key)
+
+    def _usage_key(self, key: str, resource: str) -> str:
+        return self.storage._get_redis_key(f"key_usage_window:{self.provider}:{self.fingerprint(key)}:{resource}")
+
+    @staticmethod
+    def _bucket_seconds(window: float) -> float:
+        """Intervalo dos totais de uso: 1/60 da janela (ex.: 1 min na janela de 1 h)."""
+        return max(window / 60, 1.0)
+
+    async def refresh(self, force: bool = False):
+        """Recarrega a lista de chaves e o registro de saúde em um único pipeline."""
+        if not force and time.monotonic() - self._refreshed_at < self.refresh_interval:
+            return
+        keys = sorted(await self.keys_getter())
+        pipe = self.storage.redis.pipeline(transaction=False)
+        for key in keys:
+            pipe.hgetall(self._health_key(key))
+        results = await pipe.execute() if keys else []
+        self._keys = keys
+        self._health = {key: data or {} for key, data in zip(keys, results)}
+        self._refreshed_at = time.monotonic()
+
+    async def get_health(self, key: str) -> Dict:
+        """Retorna o estado de saúde registrado para a chave."""
+        data = await self.storage.redis.hgetall(self._health_key(key))
+        return data or {"status": self.STATUS_HEALTHY}
+
+    def _is_usable(self, health: Dict, now: datetime) -> bool:
+        status = health.get("status", self.STATUS_HEALTHY)
+        if status == self.STATUS_INVALID:
+            return False
+        if status == self.STATUS_PENALIZED:
+            penalized_until = health.get("penalized_until")
+            if penalized_until and datetime.fromisoformat(penalized_until) > now:
+                return False
+        return True
+
+    def _select_local(self) -> Optional[str]:
+        """Rodízio simples sobre o registro local (fallback se o Redis falhar)."""
+        if not self._keys:
+            return None
+
+        now = datetime.utcnow()
+        for _ in range(len(self._keys)):
+            key = self._keys[self._cursor % len(self._keys)]
+            self._cursor = (self._cursor + 1) % len(self._keys)
+            if self._is_usable(self._health.get(key, {}), now):
+                return key
+        return None
+
+    async def select_key(self, resource: str = None, exclude: Optional[set] = None) -> Optional[str]:
+        """
+        Escolhe a chave com mais folga para o recurso informado
+        ('audio' ou 'tokens'), de forma atômica entre todos os workers.
+        Chaves em `exclude` (ex.: já em uso por trechos do mesmo áudio) só
+        são consideradas se não houver outra.
+        """
+        await self.refresh()
+        if not self._keys:
+            return None
+
+        candidates = [key for key in self._keys if not exclude or key not in exclude] or self._keys
+        window, window_limit = self.resource_limits.get(resource, (0, 0))
+        redis_keys = []
+        for key in candidates:
+            redis_keys.append(self._health_key(key))
+            redis_keys.append(self._usage_key(key, resource or "none"))
+
+        try:
+            result = await self._select_script(
+                keys=redis_keys, args=[time.time(), window, window_limit, self._bucket_seconds(window)]
+            )
+        except Exception as e:
+            logger.error(f"Erro no agendador de chaves {self.provider.upper()}: {e}")
+            return self._select_local()
+
+        if not result:
+            return None
+        index, score = int(result[0]) - 1, float(result[1])
+        if score <= 0:
+            self.storage.add_log("WARNING", f"Todas as chaves {self.provider.upper()} sem folga de cota estimada", {
+                "resource": resource,
+                "best_score": score
+            })
+        return candidates[index]
+
+    async def record_rate_limits(self, key: str, headers) -> Dict:
+        """Registra os headers x-ratelimit-* e retry-after de uma resposta."""
+        now = time.time()
+        fields = {}
+        for name in ("requests", "tokens"):
+            limit = headers.get(f"x-ratelimit-limit-{name}")
+            remaining = headers.get(f"x-ratelimit-remaining-{name}")
+            reset = parse_reset_duration(headers.get(f"x-ratelimit-reset-{name}"))
+            if limit is not None:
+                fields[f"limit_{name}"] = limit
+            if remaining is not None:
+                fields[f"remaining_{name}"] = remaining
+            if reset is not None:
+                fields[f"reset_{name}_at"] = now + reset
+        retry_after = parse_retry_after(headers.get("retry-after"))
+        if retry_after is not None:
+            fields["retry_after_until"] = now + retry_after
+        if fields:
+            await self.storage.redis.hset(self._health_key(key), mapping=fields)
+        return fields
+
+    async def record_usage(self, key: str, resource: str, amount: float):
+        """
+        Registra consumo na janela deslizante do recurso (segundos de áudio
+        ou tokens), somado ao total do intervalo atual.
+        """
+        if resource not in self.resource_limits or not amount:
+            return
+        window, window_limit = self.resource_limits[resource]
+        if window_limit <= 0:
+            return
+        bucket = self._bucket_seconds(window)
+        usage_key = self._usage_key(key, resource)
+        pipe = self.storage.redis.pipeline(transaction=False)
+        pipe.hincrbyfloat(usage_key, str(int(time.time() // bucket * bucket)), float(amount))
+        pipe.expire(usage_key, int(window + bucket) + 60)
+        await pipe.execute()
+
+    async def _set_health(self, key: str, status: str, error: str = None, penalized_until: datetime = None):
+        health = {
+            "status": status,
+            "last_checked": datetime.utcnow().isoformat(),
+            "last_error": error or "",
+            "penalized_until": penalized_until.isoformat() if penalized_until else "",
+            "penalized_until_ts": (
+                penalized_until.replace(tzinfo=timezone.utc).timestamp() if penalized_until else ""
+            ),
+        }
+        await self.storage.redis.hset(self._health_key(key), mapping=health)
+        self._health[key] = health
+
+    async def mark_success(self, key: str):
+        """Sinal passivo de sucesso; só grava no Redis quando o estado muda."""
+        if self._health.get(key, {}).get("status", self.STATUS_HEALTHY) != self.STATUS_HEALTHY:
+            await self._set_health(key, self.STATUS_HEALTHY)
+
+    async def mark_invalid(self, key: str, error: str):
+        """Marca a chave como inválida (ex.: 401/403)."""
+        await self._set_health(key, self.STATUS_INVALID, error=error)
+        self.storage.add_log("WARNING", f"Chave {self.provider.upper()} marcada como inválida", {
+            "key": f"{key[:10]}...{key[-4:]}",
+            "error": error
+        })
+
+    async def penalize(self, key: str, seconds: int, error: str = None):
+        """Penaliza a chave temporariamente (ex.: 429)."""
+        penalized_until = datetime.utcnow() + timedelta(seconds=seconds)
+        await self._set_health(key, self.STATUS_PENALIZED, error=error, penalized_until=penalized_until)
+        self.storage.add_log("INFO", f"Chave {self.provider.upper()} penalizada", {
+            "key": f"{key[:10]}...{key[-4:]}",
+            "penalized_until": penalized_until.isoformat(),
+            "error": error
+        })
+
+    def _needs_probe(self, health: Dict, now: datetime) -> bool:
+        status = health.get("status", self.STATUS_HEALTHY)
+        if status == self.STATUS_PENALIZED:
+            penalized_until = health.get("penalized_until")
+            return not penalized_until or datetime.fromisoformat(penalized_until) <= now
+        if status == self.STATUS_INVALID:
+            last_checked = health.get("last_checked")
+            return not last_checked or (
+                now - datetime.fromisoformat(last_checked)
+            ).total_seconds() >= self.invalid_recheck_seconds
+        return False
+
+    async def probe_keys(self, test_key: Callable):
+        """Verifica ativamente as chaves penalizadas (e inválidas há muito tempo)."""
+        await self.refresh(force=True)
+        now = datetime.utcnow()
+        for key in list(self._keys):
+            health = self._health.get(key, {})
+            if not self._needs_probe(health, now):
+                continue
+            if await test_key(key):
+                await self._set_health(key, self.STATUS_HEALTHY)
+                logger.info(f"Chave {self.provider.upper()} {key[:10]}... voltou a responder")
+            elif health.get("status") == self.STATUS_INVALID:
+                await self._set_health(key, self.STATUS_INVALID, "probe failed")
+            else:
+                await self.penalize(key, 300, "probe failed")
+
+    async def run_prober(self, test_key: Callable, interval: float):
+        """Loop opcional de verificação em background."""
+        while True:
+            try:
+                await self.probe_keys(test_key)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Erro ao verificar chaves {self.provider.upper()}: {e}")
+            await asyncio.sleep(interval)
+
+    async def request(
+        self,
+        url: str,
+        headers: dict,
+        data: Any,
+        is_form_data: bool = False,
+        audio_seconds: float = None
+    ) -> Tuple[bool, dict, str]:
+        """
+        Requisição à API do provedor com rotação de chaves. As respostas
+        alimentam o registro de saúde (401/403 invalidam a chave, 429
+        penaliza) e, em caso de falha da chave, outra é escolhida.
+
+        Retries seguem `retry_policy` (Retry-After, backoff exponencial com
+        full jitter) e consomem o orçamento compartilhado `retry_budget`.
+        Um 429 troca de chave sem esperar quando há outra com folga. Em
+        formulários, `data` deve ser uma função que monta um FormData novo
+        a cada tentativa, pois o aiohttp não reenvia um FormData já usado.
+        audio_seconds é a duração estimada do áudio, usada na cota por
+        janela quando a resposta não informa a duração.
+        """
+        storage = self.storage
+        name = self.provider.upper()
+        max_attempts = max(len(await self.keys_getter()), retry_policy.max_attempts)
+        resource = "audio" if is_form_data else "tokens"
+        response_data, error_msg = {}, ""
+        delay = 0.0
+
+        retry_budget.record_request()
+        for attempt in range(max_attempts):
+            if attempt > 0:
+                if not retry_budget.try_spend():
+                    metrics.incr("retry", f"{self.provider}.budget_exhausted")
+                    storage.add_log("WARNING", f"Orçamento de retries esgotado; desistindo da requisição {name}", {
+                        "url": url,
+                        "attempt": attempt
+                    })
+                    return False, response_data, error_msg or "Retry budget exhausted"
+                metrics.incr("retry", f"{self.provider}.retries")
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+            try:
+                storage.add_log("DEBUG", f"Iniciando tentativa de requisição para {name}", {
+                    "url": url,
+                    "is_form_data": is_form_data,
+                    "attempt": attempt + 1
+                })
+
+                current_key = get_request_key(headers)
+                payload = data() if callable(data) else data
+
+                async with http_client.session() as session:
+                    if is_form_data:
+                        async with session.post(url, headers=headers, data=payload) as response:
+                            status = response.status
+                            retry_after = parse_retry_after(response.headers.get("retry-after"))
+                            if current_key:
+                                await self.record_rate_limits(current_key, response.headers)
+                            response_data = await response.json(content_type=None)
+                            if status == 200 and response_data.get("text"):
+                                if current_key:
+                                    await self.mark_success(current_key)
+                                    await self.record_usage(
+                                        current_key, resource,
+                                        response_data.get("duration") or audio_seconds
+                                    )
+                                return True, response_data, ""
+                    else:
+                        async with session.post(url, headers=headers, json=payload) as response:
+                            status = response.status
+                            retry_after = parse_retry_after(response.headers.get("retry-after"))
+                            if current_key:
+                                await self.record_rate_limits(current_key, response.headers)
+                            response_data = await response.json(content_type=None)
+                            if status == 200 and response_data.get("choices"):
+                                if current_key:
+                                    await self.mark_success(current_key)
+                                    await self.record_usage(
+                                        current_key, resource,
+                                        (response_data.get("usage") or {}).get("total_tokens")
+                                    )
+                                return True, response_data, ""
+
+                error = response_data.get("error")
+                error_msg = (error.get("message", "") if isinstance(error, dict) else str(error or "")) or f"Status {status}"
+
+                # Sinais passivos de saúde da chave a partir da resposta real
+                if status in (401, 403) or "organization_restricted" in error_msg or "invalid_api_key" in error_msg:
+                    if current_key:
+                        await self.mark_invalid(current_key, f"Status {status}: {error_msg}")
+                    new_key = await self.select_key(resource)
+                    if not new_key or new_key == current_key:
+                        storage.add_log("ERROR", f"Nenhuma chave {name} funcional disponível.")
+                        return False, response_data, error_msg
+                    # Chave inválida não é sobrecarga: troca sem esperar
+                    headers["Authorization"] = f"Bearer {new_key}"
+                    delay = 0.0
+                    continue
+
+                if status == 429:
+                    metrics.incr("retry", f"{self.provider}.rate_limited")
+                    if current_key:
+                        await self.penalize(
+                            current_key, max(int(retry_after or 60), 1), f"Status {status}: {error_msg}"
+                        )
+                    new_key = await self.select_key(resource)
+                    if new_key and new_key != current_key:
+                        # Outra chave com folga: só um pequeno jitter antes de usá-la
+                        headers["Authorization"] = f"Bearer {new_key}"
+                        delay = retry_policy.delay(0)
+                        continue
+
+                if not retry_policy.is_retryable(status):
+                    return False, response_data, error_msg
+                delay = retry_policy.delay(attempt, retry_after)
+                if delay is None:
+                    storage.add_log("WARNING", f"Retry-After de {name} acima do limite de espera", {
+                        "status": status,
+                        "retry_after": retry_after
+                    })
+                    return False, response_data, error_msg
+
+            except Exception as e:
+                # Erros de rede, timeout ou corpo inválido (ex.: página de erro 5xx)
+                storage.add_log("ERROR", "Erro na requisição", {"error": str(e), "type": type(e).__name__})
+                response_data, error_msg = {}, f"Request failed: {str(e)}"
+                delay = retry_policy.delay(attempt)
+
+        storage.add_log("ERROR", f"Todas as tentativas para {name} falharam.", {"attempts": max_attempts})
+        return False, response_data, error_msg or f"All {name} keys exhausted."
+
+    async def get_pool_status(self) -> List[Dict]:
+        """Resumo do pool (estado de todas as chaves)."""
+        await self.refresh(force=True)
+        return [
+            {
+                "key": f"{key[:10]}...{key[-4:]}",
+                "status": self._health.get(key, {}).get("status") or self.STATUS_HEALTHY,
+                "last_checked": self._health.get(key, {}).get("last_checked"),
+                "last_error": self._health.get(key, {}).get("last_error"),
+                "penalized_until": self._health.get(key, {}).get("penalized_until"),
+            }
+            for key in self._keys
+        ]
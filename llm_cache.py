@@ -0,0 +1,112 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+import logging
+from collections import OrderedDict
+from typing import Callable, List, Optional
+import redis
+from metrics import metrics
+
+logger = logging.getLogger("TranscreveZAP")
+
+# Texto de referência usado para calcular a versão de um prompt
+PROMPT_PLACEHOLDER = "\x00texto\x00"
+
+def normalize_text(text: str) -> str:
+    """Normaliza Unicode e espaços para que variações triviais gerem a mesma chave."""
+    text = unicodedata.normalize("NFC", text)
+    lines = (re.sub(r"[ \t\u00a0]+", " ", line).strip() for line in text.strip().splitlines())
+    return "\n".join(lines)
+
+def prompt_version(build_messages: Callable[[str], List[dict]]) -> str:
+    """
+    Hash das mensagens montadas com um texto de referência. Qualquer
+    alteração no prompt muda a versão e, com ela, a chave do cache.
+    """
+    messages = build_messages(PROMPT_PLACEHOLDER)
+    return hashlib.sha1(json.dumps(messages, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+
+class LLMCache:
+    """
+    Memoização das chamadas de chat (resumo, tradução, detecção de idioma).
+
+    A chave combina operação, idiomas, modelo, versão do prompt e o hash do
+    texto normalizado. Os resultados ficam em um LRU limitado no processo
+    (LLM_CACHE_LOCAL_SIZE entradas) na frente de uma camada no Redis com
+    TTL (LLM_CACHE_TTL). Alterar um prompt invalida as entradas antigas
+    automaticamente, pois a versão do prompt faz parte da chave; as órfãs
+    expiram pelo TTL.
+    """
+    KEY_PREFIX = "transcrevezap:llm_cache"
+
+    def __init__(self, client, local_size: int = None, ttl: int = None):
+        self.redis = client
+        self.local_size = local_size if local_size is not None else int(os.getenv("LLM_CACHE_LOCAL_SIZE", 1000))
+        self.ttl = ttl if ttl is not None else int(os.getenv("LLM_CACHE_TTL", 7 * 86400))
+        self._local: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0
+
+    def key(self, operation: str, text: str, model: str, version: str, *languages: str) -> str:
+        digest = hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+        return f"{self.KEY_PREFIX}:{operation}:{':'.join(languages) or '-'}:{model}:{version}:{digest}"
+
+    def _get_local(self, key: str) -> Optional[str]:
+        with self._lock:
+            item = self._local.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at <= time.monotonic():
+                del self._local[key]
+                return None
+            self._local.move_to_end(key)
+            return value
+
+    def _set_local(self, key: str, value: str, expires_at: float):
+        if self.local_size <= 0:
+            return
+        with self._lock:
+            self._local[key] = (value, expires_at)
+            self._local.move_to_end(key)
+            while len(self._local) > self.local_size:
+                self._local.popitem(last=False)
+
+    async def get(self, operation: str, key: str) -> Optional[str]:
+        if not self.enabled:
+            return None
+        value = self._get_local(key)
+        if value is not None:
+            metrics.incr("llm_cache", f"{operation}.local_hits")
+            return value
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.get(key)
+            pipe.ttl(key)
+            value, remaining = await pipe.execute()
+        except redis.exceptions.RedisError as e:
+            logger.error(f"Erro ao ler cache de LLM: {e}")
+            return None
+        if value is None:
+            metrics.incr("llm_cache", f"{operation}.misses")
+            return None
+        metrics.incr("llm_cache", f"{operation}.redis_hits")
+        # A cópia local não sobrevive à entrada no Redis
+        self._set_local(key, value, time.monotonic() + max(remaining, 1))
+        return value
+
+    async def set(self, key: str, value: str):
+        if not self.enabled:
+            return
+        self._set_local(key, value, time.monotonic() + self.ttl)
+        try:
+            await self.redis.set(key, value, ex=self.ttl)
+        except redis.exceptions.RedisError as e:
+            logger.error(f"Erro ao gravar cache de LLM: {e}")
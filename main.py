@@ -1,53 +1,79 @@
 from fastapi import FastAPI, Request, HTTPException
-from services import (
-    convert_base64_to_file,
-    transcribe_audio,
-    send_message_to_whatsapp,
-    get_audio_base64,
-    summarize_text_if_needed,
-    download_remote_audio,
-)
+from fastapi.responses import JSONResponse
 from models import WebhookRequest
-from config import logger, settings, redis_client
+from config import logger, settings, redis_client, load_dynamic_settings, config_snapshot
+from async_storage import AsyncStorageHandler
 from storage import StorageHandler
+from maintenance import MaintenanceScheduler
+from job_queue import JobQueue
+from pipeline import build_job
+from groq_handler import get_groq_key_pool, test_groq_key
+from openai_handler import get_openai_key_pool, test_openai_key
+from http_client import http_client
+from metrics import metrics, get_metrics
+from contextlib import asynccontextmanager
 import traceback
 import os
 import asyncio
-import aiohttp
 
-app = FastAPI()
-storage = StorageHandler()
-@app.on_event("startup")
-async def startup_event():
+storage = AsyncStorageHandler()
+job_queue = JobQueue(redis_client)
+maintenance = None
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
     api_domain = os.getenv("API_DOMAIN", "seu.dominio.com")
     redis_client.set("API_DOMAIN", api_domain)
-# Função para buscar configurações do Redis com fallback para valores padrão
-def get_config(key, default=None):
-    try:
-        value = redis_client.get(key)
-        if value is None:
-            logger.warning(f"Configuração '{key}' não encontrada no Redis. Usando padrão: {default}")
-            return default
-        return value
-    except Exception as e:
-        logger.error(f"Erro ao acessar Redis: {e}")
-        return default
-
-# Carregando configurações dinâmicas do Redis
-def load_dynamic_settings():
+    job_queue.ensure_group()
+
+    # Sessão HTTP compartilhada por todas as chamadas externas
+    await http_client.start()
+    background_tasks = [
+        asyncio.create_task(
+            metrics.run_flusher(redis_client, float(os.getenv("METRICS_FLUSH_INTERVAL", 10)))
+        )
+    ]
+
+    # Verificação opcional em background das chaves GROQ e OpenAI penalizadas
+    prober_interval = float(os.getenv("KEY_PROBER_INTERVAL", 120))
+    if prober_interval > 0:
+        background_tasks.append(asyncio.create_task(
+            get_groq_key_pool(storage).run_prober(test_groq_key, prober_interval)
+        ))
+        background_tasks.append(asyncio.create_task(
+            get_openai_key_pool(storage).run_prober(test_openai_key, prober_interval)
+        ))
+
+    # Backups, retenção de logs e reenvio de webhooks em background
+    global maintenance
+    if os.getenv("MAINTENANCE_ENABLED", "true").lower() == "true":
+        maintenance = MaintenanceScheduler(StorageHandler(), storage.redis)
+        background_tasks.append(asyncio.create_task(maintenance.run()))
+
+    yield
+
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    await http_client.close()
+
+app = FastAPI(lifespan=lifespan)
+
+@app.get("/metrics")
+async def get_service_metrics():
+    """Métricas agregadas (API e workers) e contadores HTTP deste processo."""
     return {
-        "GROQ_API_KEY": get_config("GROQ_API_KEY", "default_key"),
-        "BUSINESS_MESSAGE": get_config("BUSINESS_MESSAGE", "*Impacte AI* Premium Services"),
-        "PROCESS_GROUP_MESSAGES": get_config("PROCESS_GROUP_MESSAGES", "false") == "true",
-        "PROCESS_SELF_MESSAGES": get_config("PROCESS_SELF_MESSAGES", "true") == "true",
-        "DEBUG_MODE": get_config("DEBUG_MODE", "false") == "true",
+        "metrics": await asyncio.to_thread(get_metrics, redis_client),
+        "http": http_client.get_stats(),
+        "queue": await asyncio.to_thread(job_queue.get_queue_stats),
+        "maintenance": await maintenance.get_status() if maintenance else {},
     }
 
-async def forward_to_webhooks(body: dict, storage: StorageHandler):
+async def forward_to_webhooks(body: dict, storage: AsyncStorageHandler):
     """Encaminha o payload para todos os webhooks cadastrados."""
-    webhooks = storage.get_webhook_redirects()
+    webhooks = await storage.get_webhook_redirects()
     
-    async with aiohttp.ClientSession() as session:
+    async with http_client.session() as session:
         for webhook in webhooks:
             try:
                 # Configura os headers mantendo o payload intacto
@@ -64,24 +90,24 @@ async def forward_to_webhooks(body: dict, storage: StorageHandler):
                     timeout=10
                 ) as response:
                     if response.status in [200, 201, 202]:
-                        storage.update_webhook_stats(webhook["id"], True)
+                        await storage.update_webhook_stats(webhook["id"], True)
                     else:
                         error_text = await response.text()
-                        storage.update_webhook_stats(
+                        await storage.update_webhook_stats(
                             webhook["id"],
                             False,
                             f"Status {response.status}: {error_text}"
                         )
                         # Registra falha para retry posterior
-                        storage.add_failed_delivery(webhook["id"], body)
+                        await storage.add_failed_delivery(webhook["id"], body)
             except Exception as e:
-                storage.update_webhook_stats(
+                await storage.update_webhook_stats(
                     webhook["id"],
                     False,
                     f"Erro ao encaminhar: {str(e)}"
                 )
                 # Registra falha para retry posterior
-                storage.add_failed_delivery(webhook["id"], body)
+                await storage.add_failed_delivery(webhook["id"], body)
 
 @app.post("/transcreve-audios")
 async def transcreve_audios(request: Request):
@@ -102,13 +128,17 @@ async def transcreve_audios(request: Request):
             })
 
         # Extraindo informações
-        server_url = body["server_url"]
-        instance = body["instance"]
-        apikey = body["apikey"]
-        audio_key = body["data"]["key"]["id"]
-        from_me = body["data"]["key"]["fromMe"]
-        remote_jid = body["data"]["key"]["remoteJid"]
-        message_type = body["data"]["messageType"]
+        try:
+            job = build_job(body)
+        except (KeyError, TypeError) as e:
+            storage.add_log("WARNING", "Payload inválido recebido", {
+                "missing_field": str(e)
+            })
+            raise HTTPException(status_code=400, detail=f"Payload inválido: campo ausente {str(e)}")
+
+        from_me = job["from_me"]
+        remote_jid = job["remote_jid"]
+        message_type = job["message_type"]
 
         # Verificação de tipo de mensagem
         if "audioMessage" not in message_type:
@@ -119,7 +149,7 @@ async def transcreve_audios(request: Request):
             return {"message": "Mensagem recebida não é um áudio"}
 
         # Verificação de permissões
-        if not storage.can_process_message(remote_jid):
+        if not await storage.can_process_message(remote_jid):
             is_group = "@g.us" in remote_jid
             storage.add_log("INFO", 
                 "Mensagem não autorizada para processamento",
@@ -132,7 +162,7 @@ async def transcreve_audios(request: Request):
             return {"message": "Mensagem não autorizada para processamento"}
 
         # Verificação do modo de processamento (grupos/todos)
-        process_mode = storage.get_process_mode()
+        process_mode = config_snapshot.get_process_mode()
         is_group = "@g.us" in remote_jid
         
         if process_mode == "groups_only" and not is_group:
@@ -149,106 +179,48 @@ async def transcreve_audios(request: Request):
             })
             return {"message": "Mensagem enviada por mim, sem operação"}
 
-        # Obter áudio
-        try:
-            if "mediaUrl" in body["data"]["message"]:
-                media_url = body["data"]["message"]["mediaUrl"]
-                storage.add_log("DEBUG", "Baixando áudio via URL", {"mediaUrl": media_url})
-                audio_source = await download_remote_audio(media_url)   # Baixa o arquivo remoto e retorna o caminho local
-            else:
-                storage.add_log("DEBUG", "Obtendo áudio via base64")
-                base64_audio = await get_audio_base64(server_url, instance, apikey, audio_key)
-                audio_source = await convert_base64_to_file(base64_audio)
-                storage.add_log("DEBUG", "Áudio convertido", {"source": audio_source})
-
-            # Carregar configurações de formatação
-            output_mode = get_config("output_mode", "both")
-            summary_header = get_config("summary_header", "🤖 *Resumo do áudio:*")
-            transcription_header = get_config("transcription_header", "🔊 *Transcrição do áudio:*")
-            character_limit = int(get_config("character_limit", "500"))
-
-            # Verificar se timestamps estão habilitados
-            use_timestamps = get_config("use_timestamps", "false") == "true"
-            
-            storage.add_log("DEBUG", "Informações da mensagem", {
-                "from_me": from_me,
+        # Deduplicação: reentregas da Evolution não geram novo processamento
+        audio_key = job["audio_key"]
+        existing_state = await storage.claim_message(audio_key)
+        if existing_state:
+            storage.add_log("DEBUG", "Mensagem duplicada ignorada", {
+                "message_id": audio_key,
                 "remote_jid": remote_jid,
-                "is_group": is_group
-            })
-
-            # Transcrever áudio
-            storage.add_log("INFO", "Iniciando transcrição")
-            transcription_text, has_timestamps = await transcribe_audio(
-                audio_source,
-                apikey=apikey,
-                remote_jid=remote_jid,
-                from_me=from_me,
-                use_timestamps=use_timestamps
-            )
-            # Log do resultado
-            storage.add_log("INFO", "Transcrição concluída", {
-                "has_timestamps": has_timestamps,
-                "text_length": len(transcription_text),
-                "remote_jid": remote_jid
+                "status": existing_state.get("status")
             })
-            # Determinar se precisa de resumo baseado no modo de saída
-            summary_text = None
-            if output_mode in ["both", "summary_only"] or (
-                output_mode == "smart" and len(transcription_text) > character_limit
-            ):
-                summary_text = await summarize_text_if_needed(transcription_text)
-
-            # Construir mensagem baseada no modo de saída
-            message_parts = []
-            
-            if output_mode == "smart":
-                if len(transcription_text) > character_limit:
-                    message_parts.append(f"{summary_header}\n\n{summary_text}")
-                else:
-                    message_parts.append(f"{transcription_header}\n\n{transcription_text}")
-            else:
-                if output_mode in ["both", "summary_only"] and summary_text:
-                    message_parts.append(f"{summary_header}\n\n{summary_text}")
-                if output_mode in ["both", "transcription_only"]:
-                    message_parts.append(f"{transcription_header}\n\n{transcription_text}")
-            
-            # Adicionar mensagem de negócio
-            message_parts.append(dynamic_settings['BUSINESS_MESSAGE'])
-            
-            # Juntar todas as partes da mensagem
-            summary_message = "\n\n".join(message_parts)            
-
-            # Enviar resposta
-            await send_message_to_whatsapp(
-                server_url,
-                instance,
-                apikey,
-                summary_message,
-                remote_jid,
-                audio_key,
-            )
-
-            # Registrar sucesso
-            storage.record_processing(remote_jid)
-            storage.add_log("INFO", "Áudio processado com sucesso", {
-                "remote_jid": remote_jid,
-                "transcription_length": len(transcription_text) if transcription_text else 0,
-                "summary_length": len(summary_text) if summary_text else 0  # Adiciona verificação
-            })
-
-            return {"message": "Áudio transcrito e resposta enviada com sucesso"}
+            if existing_state.get("status") == storage.MESSAGE_STATUS_DONE:
+                return {
+                    "message": "Áudio já processado anteriormente",
+                    "result": existing_state.get("result")
+                }
+            return {
+                "message": "Áudio já recebido e em processamento",
+                "status": existing_state.get("status")
+            }
 
+        # Enfileirar para os workers e responder imediatamente
+        try:
+            job_id = await asyncio.to_thread(job_queue.enqueue, job)
         except Exception as e:
-            storage.add_log("ERROR", f"Erro ao processar áudio: {str(e)}", {
-                "error_type": type(e).__name__,
-                "remote_jid": remote_jid,
-                "traceback": traceback.format_exc()
-            })
-            raise HTTPException(
-                status_code=500,
-                detail=f"Erro ao processar áudio: {str(e)}"
-            )
+            await storage.set_message_state(audio_key, storage.MESSAGE_STATUS_FAILED, error=str(e))
+            raise
+        # Só agora o estado passa a valer MESSAGE_STATE_TTL (ver claim_message)
+        await storage.confirm_message(audio_key)
+        storage.add_log("INFO", "Áudio enfileirado para processamento", {
+            "job_id": job_id,
+            "remote_jid": remote_jid
+        })
+
+        return JSONResponse(
+            status_code=202,
+            content={
+                "message": "Áudio recebido e enfileirado para processamento",
+                "job_id": job_id
+            }
+        )
 
+    except HTTPException:
+        raise
     except Exception as e:
         storage.add_log("ERROR", f"Erro na requisição: {str(e)}", {
             "error_type": type(e).__name__,
@@ -257,4 +229,4 @@ async def transcreve_audios(request: Request):
         raise HTTPException(
             status_code=500,
             detail=f"Erro ao processar a requisição: {str(e)}"
-        )
\ No newline at end of file
+        )
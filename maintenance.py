@@ -0,0 +1,186 @@
+import asyncio
+import os
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List
+import logging
+from metrics import metrics
+from storage import StorageHandler
+from job_queue import JobQueue
+from transcript_cache import trim_transcript_cache
+from utils import RENEW_LOCK_SCRIPT, RELEASE_LOCK_SCRIPT
+
+logger = logging.getLogger("TranscreveZAP")
+
+@dataclass
+class MaintenanceJob:
+    """
+    Tarefa periódica executada em fatias. `step` recebe o estado da fatia
+    anterior (None na primeira) e retorna o estado da próxima, ou None
+    quando a execução terminou.
+    """
+    name: str
+    interval: float
+    step: Callable[[Any], Any]
+    state: Any = None
+    in_progress: bool = False
+
+class MaintenanceScheduler:
+    """
+    Agendador das rotinas de manutenção dentro do processo da API.
+
+    Cada fatia roda em uma thread (asyncio.to_thread) e o trabalho é
+    dividido em lotes pequenos com pausa entre eles, sem travar o event
+    loop nem sobrecarregar o Redis. Um lock por tarefa no Redis, com lease
+    renovado enquanto a tarefa roda, garante que apenas uma réplica
+    execute cada tarefa; o horário da última execução também fica no
+    Redis, para que as réplicas respeitem o mesmo intervalo.
+    """
+    KEY_PREFIX = "transcrevezap:maintenance"
+
+    def __init__(self, storage: StorageHandler, async_redis):
+        self.storage = storage
+        self.redis = async_redis
+        self.tick = float(os.getenv("MAINTENANCE_TICK_SECONDS", 30))
+        self.lease_ms = int(float(os.getenv("MAINTENANCE_LOCK_LEASE_SECONDS", 30)) * 1000)
+        self.slice_pause = float(os.getenv("MAINTENANCE_SLICE_PAUSE", 0.2))
+        self.max_run_seconds = float(os.getenv("MAINTENANCE_MAX_RUN_SECONDS", 60))
+        self.owner = uuid.uuid4().hex
+        self._renew_script = async_redis.register_script(RENEW_LOCK_SCRIPT)
+        self._release_script = async_redis.register_script(RELEASE_LOCK_SCRIPT)
+        self.jobs: List[MaintenanceJob] = self._build_jobs()
+
+    def _build_jobs(self) -> List[MaintenanceJob]:
+        storage = self.storage
+        queue = JobQueue(storage.redis)
+
+        def backup(_state):
+            storage.backup_data()
+            return None
+
+        def clean_backups(cursor):
+            # Um lote do SCAN por fatia; cursor 0 encerra a varredura
+            next_cursor = storage.clean_old_backups(cursor=cursor or 0, count=100)
+            return next_cursor or None
+
+        def clean_logs(_state):
+            storage.clean_old_logs()
+            return None
+
+        def retry_webhooks(_state):
+            return True if storage.retry_failed_webhooks(max_deliveries=10) else None
+
+        def trim_transcripts(_state):
+            return True if trim_transcript_cache(storage.redis, batch=500) else None
+
+        def remove_idle_consumers(_state):
+            queue.remove_idle_consumers()
+            return None
+
+        def migrate_statistics(_state):
+            storage.migrate_legacy_statistics()
+            return None
+
+        return [
+            MaintenanceJob("clean_old_logs", float(os.getenv("MAINTENANCE_LOG_CLEANUP_INTERVAL", 3600)), clean_logs),
+            MaintenanceJob("retry_failed_webhooks", float(os.getenv("MAINTENANCE_WEBHOOK_RETRY_INTERVAL", 300)), retry_webhooks),
+            MaintenanceJob("backup_data", float(os.getenv("MAINTENANCE_BACKUP_INTERVAL", 86400)), backup),
+            MaintenanceJob("clean_old_backups", float(os.getenv("MAINTENANCE_BACKUP_CLEANUP_INTERVAL", 21600)), clean_backups),
+            MaintenanceJob("trim_transcript_cache", float(os.getenv("MAINTENANCE_TRANSCRIPT_CACHE_INTERVAL", 600)), trim_transcripts),
+            MaintenanceJob("remove_idle_consumers", float(os.getenv("MAINTENANCE_CONSUMER_CLEANUP_INTERVAL", 3600)), remove_idle_consumers),
+            # Roda na primeira passada após o deploy; depois disso é só um MGET vazio por dia
+            MaintenanceJob("migrate_legacy_statistics", 86400, migrate_statistics),
+        ]
+
+    def _lock_key(self, job: MaintenanceJob) -> str:
+        return f"{self.KEY_PREFIX}:lock:{job.name}"
+
+    def _status_key(self, job: MaintenanceJob) -> str:
+        return f"{self.KEY_PREFIX}:{job.name}"
+
+    async def _is_due(self, job: MaintenanceJob) -> bool:
+        if job.in_progress:
+            return True
+        last_run = await self.redis.hget(self._status_key(job), "last_run")
+        return not last_run or time.time() - float(last_run) >= job.interval
+
+    async def _renew_lease(self, job: MaintenanceJob, lost: asyncio.Event):
+        while True:
+            await asyncio.sleep(self.lease_ms / 3000)
+            renewed = await self._renew_script(keys=[self._lock_key(job)], args=[self.owner, self.lease_ms])
+            if not renewed:
+                logger.warning(f"Lock da manutenção '{job.name}' perdido; interrompendo a execução")
+                lost.set()
+                return
+
+    async def run_job(self, job: MaintenanceJob):
+        """Executa as fatias de uma tarefa enquanto houver trabalho e tempo."""
+        lock_key = self._lock_key(job)
+        if not await self.redis.set(lock_key, self.owner, nx=True, px=self.lease_ms):
+            return
+        lost = asyncio.Event()
+        renewer = asyncio.create_task(self._renew_lease(job, lost))
+        started = time.monotonic()
+        slices = 0
+        try:
+            # Outra réplica pode ter concluído a tarefa enquanto esperávamos o lock
+            if not await self._is_due(job):
+                return
+            job.in_progress = True
+            while not lost.is_set():
+                job.state = await asyncio.to_thread(job.step, job.state)
+                slices += 1
+                if job.state is None:
+                    job.in_progress = False
+                    break
+                if time.monotonic() - started >= self.max_run_seconds:
+                    # Continua de onde parou no próximo ciclo
+                    break
+                await asyncio.sleep(self.slice_pause)
+
+            duration = time.monotonic() - started
+            metrics.incr("maintenance", f"{job.name}_slices", slices)
+            metrics.incr("maintenance", f"{job.name}_seconds", duration)
+            if not job.in_progress:
+                metrics.incr("maintenance", f"{job.name}_runs")
+                await self.redis.hset(self._status_key(job), mapping={
+                    "last_run": time.time(),
+                    "last_duration": duration,
+                    "last_error": "",
+                })
+        except Exception as e:
+            job.state = None
+            job.in_progress = False
+            metrics.incr("maintenance", f"{job.name}_errors")
+            await self.redis.hset(self._status_key(job), mapping={
+                "last_run": time.time(),
+                "last_error": str(e),
+            })
+            logger.error(f"Erro na manutenção '{job.name}': {e}")
+        finally:
+            renewer.cancel()
+            await asyncio.gather(renewer, return_exceptions=True)
+            await self._release_script(keys=[lock_key], args=[self.owner])
+
+    async def run(self):
+        """Loop em background iniciado no lifespan da API."""
+        logger.info("Agendador de manutenção iniciado")
+        while True:
+            for job in self.jobs:
+                try:
+                    if await self._is_due(job):
+                        await self.run_job(job)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.error(f"Erro ao agendar manutenção '{job.name}': {e}")
+            await asyncio.sleep(self.tick)
+
+    async def get_status(self) -> Dict[str, Dict]:
+        """Última execução e duração de cada tarefa."""
+        pipe = self.redis.pipeline(transaction=False)
+        for job in self.jobs:
+            pipe.hgetall(self._status_key(job))
+        results = await pipe.execute()
+        return {job.name: status for job, status in zip(self.jobs, results)}
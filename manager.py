@@ -1,12 +1,16 @@
 import requests
 import streamlit as st
 import pandas as pd
-from datetime import datetime
+from datetime import datetime, timedelta
 from storage import StorageHandler
+from key_pool import KeyPool
+from circuit_breaker import CircuitBreaker
 import plotly.express as px
 import os
 import redis
 from utils import create_redis_client
+from metrics import get_metrics
+from transcript_cache import INDEX_KEY as TRANSCRIPT_CACHE_INDEX_KEY
 
 # 1. Primeiro: Configuração da página
 st.set_page_config(
@@ -146,6 +150,7 @@ IDIOMAS = {
 def save_to_redis(key, value):
     try:
         redis_client.set(key, value)
+        storage.notify_config_change()
         st.success(f"Configuração {key} salva com sucesso!")
     except Exception as e:
         st.error(f"Erro ao salvar no Redis: {key} -> {e}")
@@ -330,6 +335,8 @@ def show_statistics():
         else:
             st.info("Ainda não há dados de processamento disponíveis.")
 
+        show_transcript_cache_statistics()
+
         # Adicionar informações sobre o endpoint da API
         st.subheader("Endpoint da API")
         api_domain = get_from_redis("API_DOMAIN", "seu.dominio.com")
@@ -350,6 +357,28 @@ def show_statistics():
     except Exception as e:
         st.error(f"Erro ao carregar estatísticas: {e}")
 
+def show_transcript_cache_statistics():
+    """Acertos e economia do cache de transcrições (áudios encaminhados)."""
+    st.subheader("♻️ Cache de Transcrições")
+    cache_metrics = get_metrics(redis_client).get("transcript_cache", {})
+    hits = cache_metrics.get("hits", 0)
+    misses = cache_metrics.get("misses", 0)
+    total = hits + misses
+    if not total:
+        st.info("O cache de transcrições ainda não foi utilizado.")
+        return
+
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("Taxa de Acerto", f"{hits / total:.1%}")
+    with col2:
+        st.metric("Transcrições Reaproveitadas", int(hits))
+    with col3:
+        st.metric("Downloads Evitados", int(cache_metrics.get("downloads_skipped", 0)))
+    with col4:
+        st.metric("Áudio Economizado", f"{cache_metrics.get('bytes_saved', 0) / (1024 * 1024):.1f} MB")
+    st.caption(f"Entradas no cache: {redis_client.zcard(TRANSCRIPT_CACHE_INDEX_KEY)}")
+
 def manage_groups():
     st.title("👥 Gerenciar Grupos")
 
@@ -755,11 +784,16 @@ def manage_settings():
         groq_keys = storage.get_groq_keys()
         if groq_keys:
             st.write("Chaves configuradas para rodízio:")
+            status_icons = {"healthy": "🟢", "penalized": "🟡", "invalid": "🔴"}
             for key in groq_keys:
                 col1, col2 = st.columns([4, 1])
                 with col1:
                     masked_key = f"{key[:10]}...{key[-4:]}"
-                    st.code(masked_key, language=None)
+                    health = KeyPool.read_health(storage.redis, "groq", key)
+                    status = health.get("status") or "healthy"
+                    st.code(f"{status_icons.get(status, '⚪')} {masked_key} ({status})", language=None)
+                    if health.get("last_error"):
+                        st.caption(f"Último erro: {health['last_error']}")
                 with col2:
                     if st.button("🗑️", key=f"remove_{key}", help="Remover esta chave"):
                         storage.remove_groq_key(key)
@@ -818,6 +852,26 @@ def manage_settings():
                     st.success("✅ Chave OpenAI adicionada com sucesso!")
                 else:
                     st.error("Chave inválida! Deve começar com 'sk-'")
+
+            # Chaves OpenAI em rodízio, com o mesmo registro de saúde das chaves GROQ
+            openai_keys = storage.get_openai_keys()
+            if openai_keys:
+                st.write("Chaves OpenAI configuradas para rodízio:")
+                status_icons = {"healthy": "🟢", "penalized": "🟡", "invalid": "🔴"}
+                for key in sorted(openai_keys):
+                    col1, col2 = st.columns([4, 1])
+                    with col1:
+                        masked_key = f"{key[:10]}...{key[-4:]}"
+                        health = KeyPool.read_health(storage.redis, "openai", key)
+                        status = health.get("status") or "healthy"
+                        st.code(f"{status_icons.get(status, '⚪')} {masked_key} ({status})", language=None)
+                        if health.get("last_error"):
+                            st.caption(f"Último erro: {health['last_error']}")
+                    with col2:
+                        if st.button("🗑️", key=f"remove_openai_{key}", help="Remover esta chave"):
+                            storage.remove_openai_key(key)
+                            st.success("Chave removida do rodízio!")
+                            st.experimental_rerun()
                     
         # Save provider selection
         if st.button("💾 Salvar Configuração do Provedor"):
@@ -826,6 +880,18 @@ def manage_settings():
                 st.success(f"Provedor alterado para: {provider}")
             except Exception as e:
                 st.error(f"Erro ao salvar provedor: {str(e)}")
+
+        # Estado dos circuitos (failover automático entre provedores)
+        st.markdown("---")
+        st.subheader("Disponibilidade dos Provedores")
+        state_icons = {"closed": "🟢", "half_open": "🟡", "open": "🔴"}
+        state_labels = {"closed": "normal", "half_open": "em teste", "open": "desviado para o outro provedor"}
+        for circuit_provider in ["groq", "openai"]:
+            cols = st.columns(2)
+            for col, endpoint, label in zip(cols, ["transcription", "chat"], ["Transcrição", "Chat"]):
+                state = CircuitBreaker.read_state(storage.redis, circuit_provider, endpoint).get("state") or "closed"
+                with col:
+                    st.write(f"{state_icons.get(state, '⚪')} {circuit_provider.upper()} · {label}: {state_labels.get(state, state)}")
     
     with tab3:
         st.subheader("Configurações do Sistema")
@@ -889,6 +955,68 @@ def manage_settings():
             help="Selecione o idioma para transcrição dos áudios e geração dos resumos",
             key="transcription_language"
         )
+
+        # Configuração de logs gravados no Redis
+        st.markdown("---")
+        st.subheader("📜 Logs")
+        log_policy = storage.get_log_policy()
+        log_levels = ["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"]
+        min_log_level = st.selectbox(
+            "Nível mínimo gravado no Redis",
+            options=log_levels,
+            index=log_levels.index(log_policy["min_level"]) if log_policy["min_level"] in log_levels else 1,
+            help="Logs abaixo deste nível são exibidos apenas no console do container"
+        )
+        st.caption(
+            "Retenção por nível: " + ", ".join(
+                f"{level}: {size}" for level, size in log_policy["ring_sizes"].items()
+            )
+        )
+
+        st.markdown("**Amostragem de mensagens frequentes** (mantém 1 a cada N)")
+        for message, rate in log_policy["sampling"].items():
+            col1, col2 = st.columns([4, 1])
+            with col1:
+                st.text(f"{message} → 1 a cada {rate}")
+            with col2:
+                if st.button("🗑️", key=f"remove_sampling_{message}", help="Remover regra"):
+                    storage.remove_log_sampling(message)
+                    st.experimental_rerun()
+        col1, col2 = st.columns([3, 1])
+        with col1:
+            sampling_message = st.text_input("Mensagem de log", placeholder="Ex: Mensagem ignorada - não é áudio")
+        with col2:
+            sampling_rate = st.number_input("N", min_value=1, max_value=10000, value=10)
+
+        if st.button("💾 Salvar Configurações de Log"):
+            try:
+                storage.set_log_level_threshold(min_log_level)
+                if sampling_message:
+                    storage.set_log_sampling(sampling_message, sampling_rate)
+                st.success("✅ Configurações de log salvas! Serão aplicadas em alguns segundos.")
+            except Exception as e:
+                st.error(f"Erro ao salvar configurações de log: {str(e)}")
+
+        with st.expander("🔎 Consultar logs"):
+            col1, col2, col3 = st.columns([2, 1, 1])
+            with col1:
+                view_levels = st.multiselect("Níveis", options=log_levels, default=["WARNING", "ERROR", "CRITICAL"])
+            with col2:
+                view_hours = st.number_input("Últimas horas", min_value=1, max_value=168, value=24)
+            with col3:
+                view_count = st.number_input("Máximo de entradas", min_value=10, max_value=1000, value=100)
+            logs = storage.get_logs(
+                levels=view_levels,
+                start=datetime.now() - timedelta(hours=view_hours),
+                count=view_count
+            )
+            if logs:
+                st.dataframe(
+                    pd.DataFrame(logs)[["timestamp", "level", "message", "metadata"]],
+                    use_container_width=True
+                )
+            else:
+                st.info("Nenhum log encontrado no período.")
         pass
     
     with tab4:
@@ -941,6 +1069,14 @@ def manage_settings():
                 help="Se a transcrição exceder este limite, será enviado apenas o resumo"
             )
 
+        if output_mode == "both":
+            progressive_delivery = st.toggle(
+                "Entrega Progressiva",
+                value=get_from_redis("progressive_delivery", "false") == "true",
+                help="Envia a transcrição assim que ficar pronta e o resumo em seguida, em outra mensagem. "
+                     "Áudios longos têm cada trecho enviado à medida que é transcrito."
+            )
+
     # Botão de salvar unificado
     if st.button("💾 Salvar Todas as Configurações"):
         try:
@@ -953,6 +1089,8 @@ def manage_settings():
             save_to_redis("output_mode", output_mode)
             if output_mode == "smart":
                 save_to_redis("character_limit", str(character_limit))
+            if output_mode == "both":
+                save_to_redis("progressive_delivery", str(progressive_delivery).lower())
                 
             # Se há uma chave principal, adicionar ao sistema de rodízio
             if main_key and main_key.startswith("gsk_"):
@@ -963,6 +1101,7 @@ def manage_settings():
             
             # Salvamento do modo de processamento
             storage.redis.set(storage._get_redis_key("process_mode"), process_mode)
+            storage.notify_config_change()
             
             st.success("✅ Todas as configurações foram salvas com sucesso!")
             
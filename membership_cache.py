@@ -0,0 +1,109 @@
+import asyncio
+import os
+import time
+import logging
+import redis
+from metrics import metrics
+from utils import create_redis_client, create_async_redis_client, get_redis_connection_params, MEMBERSHIP_CHANNEL
+
+logger = logging.getLogger("TranscreveZAP")
+
+class MembershipCache:
+    """
+    Cópia em memória dos conjuntos `allowed_groups` e `blocked_users`.
+
+    As decisões de permitir/bloquear no caminho quente não fazem nenhum
+    round-trip ao Redis. O cache é invalidado quando o manager adiciona ou
+    remove entradas (publicação em `transcrevezap:membership_updates`) e
+    pelas keyspace notifications dos conjuntos, quando habilitadas no
+    servidor (`notify-keyspace-events Ks`). Como fallback, é recarregado a
+    cada MEMBERSHIP_CACHE_TTL segundos; com TTL 0 o cache é desativado e
+    cada verificação usa SISMEMBER.
+    """
+    CHANNEL = MEMBERSHIP_CHANNEL
+    ALLOWED_GROUPS_KEY = "transcrevezap:allowed_groups"
+    BLOCKED_USERS_KEY = "transcrevezap:blocked_users"
+
+    def __init__(self, client, ttl: float = None):
+        self.redis = client
+        self.ttl = ttl if ttl is not None else float(os.getenv("MEMBERSHIP_CACHE_TTL", 300))
+        self._allowed_groups = frozenset()
+        self._blocked_users = frozenset()
+        self._loaded = False
+        self._loaded_at = 0.0
+        self._invalidated = True
+        self._lock = asyncio.Lock()
+        self._listener = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0
+
+    def _ensure_listener(self):
+        """Inicia (uma vez) a thread que escuta alterações dos conjuntos."""
+        if self._listener is not None:
+            return
+        try:
+            db = get_redis_connection_params()["db"]
+            handler = lambda message: self.invalidate()
+            pubsub = create_redis_client().pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(**{
+                self.CHANNEL: handler,
+                f"__keyspace@{db}__:{self.ALLOWED_GROUPS_KEY}": handler,
+                f"__keyspace@{db}__:{self.BLOCKED_USERS_KEY}": handler,
+            })
+            self._listener = pubsub.run_in_thread(sleep_time=1, daemon=True)
+        except Exception as e:
+            # Sem pub/sub o cache continua válido via fallback de TTL
+            logger.warning(f"Não foi possível assinar alterações de grupos/usuários: {e}")
+            self._listener = False
+
+    def invalidate(self):
+        """Força o recarregamento na próxima verificação."""
+        self._invalidated = True
+
+    def _is_fresh(self) -> bool:
+        return not self._invalidated and time.monotonic() - self._loaded_at < self.ttl
+
+    async def _ensure_fresh(self):
+        self._ensure_listener()
+        if self._is_fresh():
+            return
+        async with self._lock:
+            if self._is_fresh():
+                return
+            # Limpa antes de ler: uma invalidação durante a carga força nova leitura
+            self._invalidated = False
+            try:
+                pipe = self.redis.pipeline(transaction=False)
+                pipe.smembers(self.ALLOWED_GROUPS_KEY)
+                pipe.smembers(self.BLOCKED_USERS_KEY)
+                allowed_groups, blocked_users = await pipe.execute()
+            except redis.exceptions.RedisError as e:
+                self._invalidated = True
+                # Mantém a última cópia válida se o Redis estiver indisponível
+                logger.error(f"Erro ao recarregar grupos/usuários: {e}")
+                if not self._loaded:
+                    raise
+                return
+            self._allowed_groups = frozenset(allowed_groups)
+            self._blocked_users = frozenset(blocked_users)
+            self._loaded = True
+            self._loaded_at = time.monotonic()
+            metrics.incr("membership", "reloads")
+
+    async def is_allowed_group(self, group: str) -> bool:
+        if not self.enabled:
+            return bool(await self.redis.sismember(self.ALLOWED_GROUPS_KEY, group))
+        await self._ensure_fresh()
+        return group in self._allowed_groups
+
+    async def is_blocked_user(self, user: str) -> bool:
+        if not self.enabled:
+            return bool(await self.redis.sismember(self.BLOCKED_USERS_KEY, user))
+        await self._ensure_fresh()
+        return user in self._blocked_users
+
+# Cache compartilhado por todos os AsyncStorageHandler do processo
+# (uma cópia dos conjuntos e uma assinatura de pub/sub)
+membership_cache = MembershipCache(create_async_redis_client())
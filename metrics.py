@@ -0,0 +1,74 @@
+import asyncio
+import threading
+from collections import defaultdict
+from typing import Dict
+import logging
+import redis
+
+logger = logging.getLogger("TranscreveZAP")
+
+class Metrics:
+    """
+    Contadores em memória agregados periodicamente no Redis.
+
+    Cada processo (API e workers) acumula os incrementos localmente e os
+    envia em um único pipeline de HINCRBYFLOAT para
+    `transcrevezap:metrics:<grupo>`, de onde a API e o manager leem o total.
+    """
+    KEY_PREFIX = "transcrevezap:metrics:"
+
+    def __init__(self):
+        self._pending = defaultdict(float)
+        self._local = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def incr(self, group: str, field: str, amount: float = 1):
+        with self._lock:
+            self._pending[(group, field)] += amount
+            self._local[(group, field)] += amount
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        """Contadores acumulados por este processo desde o início."""
+        result = defaultdict(dict)
+        with self._lock:
+            for (group, field), value in self._local.items():
+                result[group][field] = value
+        return dict(result)
+
+    def flush(self, client: redis.Redis):
+        """Envia os incrementos pendentes ao Redis."""
+        with self._lock:
+            pending, self._pending = self._pending, defaultdict(float)
+        if not pending:
+            return
+        try:
+            pipe = client.pipeline(transaction=False)
+            for (group, field), amount in pending.items():
+                pipe.hincrbyfloat(f"{self.KEY_PREFIX}{group}", field, amount)
+            pipe.execute()
+        except redis.exceptions.RedisError as e:
+            # Devolve os incrementos para a próxima tentativa
+            with self._lock:
+                for item, amount in pending.items():
+                    self._pending[item] += amount
+            logger.error(f"Erro ao enviar métricas para o Redis: {e}")
+
+    async def run_flusher(self, client: redis.Redis, interval: float = 10):
+        """Loop em background que envia as métricas periodicamente."""
+        try:
+            while True:
+                await asyncio.sleep(interval)
+                await asyncio.to_thread(self.flush, client)
+        finally:
+            self.flush(client)
+
+def get_metrics(client: redis.Redis) -> Dict[str, Dict[str, float]]:
+    """Lê os totais agregados de todos os processos."""
+    result = {}
+    for key in client.scan_iter(f"{Metrics.KEY_PREFIX}*"):
+        group = key[len(Metrics.KEY_PREFIX):]
+        result[group] = {field: float(value) for field, value in client.hgetall(key).items()}
+    return result
+
+# Instância compartilhada pelo processo
+metrics = Metrics()
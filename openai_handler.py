@@ -1,8 +1,9 @@
-import aiohttp
-import json
-from datetime import datetime
+import os
+from typing import Optional
 import logging
-from storage import StorageHandler
+from http_client import http_client
+from async_storage import AsyncStorageHandler
+from key_pool import KeyPool
 
 logger = logging.getLogger("OpenAIHandler")
 logger.setLevel(logging.DEBUG)
@@ -17,7 +18,7 @@ async def test_openai_key(key: str) -> bool:
     headers = {"Authorization": f"Bearer {key}"}
 
     try:
-        async with aiohttp.ClientSession() as session:
+        async with http_client.session() as session:
             async with session.get(url, headers=headers) as response:
                 if response.status == 200:
                     data = await response.json()
@@ -27,48 +28,42 @@ async def test_openai_key(key: str) -> bool:
         logger.error(f"Error testing OpenAI key: {e}")
         return False
 
+_openai_key_pool: Optional[KeyPool] = None
+
+def get_openai_key_pool(storage: AsyncStorageHandler) -> KeyPool:
+    """Return the shared health registry of the OpenAI keys."""
+    global _openai_key_pool
+    if _openai_key_pool is None:
+        _openai_key_pool = KeyPool(
+            storage,
+            "openai",
+            storage.get_openai_keys,
+            resource_limits={
+                "audio": (3600, float(os.getenv("OPENAI_AUDIO_SECONDS_PER_HOUR", 0))),
+                "tokens": (60, float(os.getenv("OPENAI_TOKENS_PER_MINUTE", 200000))),
+            }
+        )
+    return _openai_key_pool
+
+async def get_working_openai_key(storage: AsyncStorageHandler, resource: str = None, exclude: Optional[set] = None) -> Optional[str]:
+    """
+    Get the OpenAI key with the most quota headroom for the resource
+    ('audio' for Whisper, 'tokens' for chat), without a test request.
+    """
+    key = await get_openai_key_pool(storage).select_key(resource, exclude)
+    if key:
+        return key
+
+    storage.add_log("ERROR", "Nenhuma chave OpenAI funcional disponível.")
+    return None
+
 async def handle_openai_request(
     url: str, 
     headers: dict, 
     data: any, 
-    storage: StorageHandler,
-    is_form_data: bool = False
+    storage: AsyncStorageHandler,
+    is_form_data: bool = False,
+    audio_seconds: float = None
 ) -> tuple[bool, dict, str]:
-    """Handle requests to OpenAI API with retries."""
-    max_retries = 3
-    
-    for attempt in range(max_retries):
-        try:
-            async with aiohttp.ClientSession() as session:
-                if is_form_data:
-                    async with session.post(url, headers=headers, data=data) as response:
-                        response_data = await response.json()
-                        if response.status == 200:
-                            if is_form_data and response_data.get("text"):
-                                return True, response_data, ""
-                            elif not is_form_data and response_data.get("choices"):
-                                return True, response_data, ""
-                else:
-                    async with session.post(url, headers=headers, json=data) as response:
-                        response_data = await response.json()
-                        if response.status == 200 and response_data.get("choices"):
-                            return True, response_data, ""
-                
-                error_msg = response_data.get("error", {}).get("message", "")
-                
-                if "invalid_api_key" in error_msg or "invalid authorization" in error_msg.lower():
-                    logger.error(f"OpenAI API key invalid or expired")
-                    return False, response_data, error_msg
-                
-                if attempt < max_retries - 1:
-                    continue
-
-                return False, response_data, error_msg
-
-        except Exception as e:
-            logger.error(f"Error in request: {str(e)}")
-            if attempt < max_retries - 1:
-                continue
-            return False, {}, f"Request failed: {str(e)}"
-
-    return False, {}, "All retries failed"
\ No newline at end of file
+    """Handle requests to OpenAI API with retries and key rotation."""
+    return await get_openai_key_pool(storage).request(url, headers, data, is_form_data, audio_seconds)
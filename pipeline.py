@@ -0,0 +1,191 @@
+from services import (
+    decode_base64_audio,
+    transcribe_audio,
+    send_message_to_whatsapp,
+    get_audio_base64,
+    summarize_text_if_needed,
+    download_remote_audio,
+    transcript_cache,
+)
+from config import get_config, load_dynamic_settings, config_snapshot
+from async_storage import AsyncStorageHandler
+from transcript_cache import CachedAudio, normalize_file_sha256, summary_field
+
+storage = AsyncStorageHandler()
+
+def build_job(body: dict) -> dict:
+    """
+    Extrai do payload do webhook apenas os campos necessários ao pipeline.
+    Lança KeyError se o payload não tiver a estrutura esperada.
+    """
+    data = body["data"]
+    job = {
+        "server_url": body["server_url"],
+        "instance": body["instance"],
+        "apikey": body["apikey"],
+        "audio_key": data["key"]["id"],
+        "from_me": data["key"]["fromMe"],
+        "remote_jid": data["key"]["remoteJid"],
+        "message_type": data["messageType"],
+    }
+    message = data.get("message") or {}
+    if "mediaUrl" in message:
+        job["media_url"] = message["mediaUrl"]
+    file_sha256 = normalize_file_sha256((message.get("audioMessage") or {}).get("fileSha256"))
+    if file_sha256:
+        job["file_sha256"] = file_sha256
+    return job
+
+async def process_audio_job(job: dict) -> str:
+    """
+    Executa o pipeline completo de um áudio: download, transcrição,
+    resumo e envio da resposta. Retorna a mensagem enviada ao WhatsApp.
+    """
+    dynamic_settings = load_dynamic_settings()
+
+    server_url = job["server_url"]
+    instance = job["instance"]
+    apikey = job["apikey"]
+    audio_key = job["audio_key"]
+    from_me = job["from_me"]
+    remote_jid = job["remote_jid"]
+    is_group = "@g.us" in remote_jid
+
+    # Carregar configurações de formatação
+    output_mode = get_config("output_mode", "both")
+    summary_header = get_config("summary_header", "🤖 *Resumo do áudio:*")
+    transcription_header = get_config("transcription_header", "🔊 *Transcrição do áudio:*")
+    character_limit = int(get_config("character_limit", "500"))
+
+    # Verificar se timestamps estão habilitados
+    use_timestamps = get_config("use_timestamps", "false") == "true"
+    # Entrega progressiva: transcrição primeiro, resumo em seguida
+    progressive = output_mode == "both" and get_config("progressive_delivery", "false") == "true"
+
+    storage.add_log("DEBUG", "Informações da mensagem", {
+        "from_me": from_me,
+        "remote_jid": remote_jid,
+        "is_group": is_group
+    })
+
+    # Obter áudio (só quando não houver resultado no cache de transcrições)
+    async def fetch_audio():
+        if job.get("media_url"):
+            media_url = job["media_url"]
+            storage.add_log("DEBUG", "Baixando áudio via URL", {"mediaUrl": media_url})
+            return await download_remote_audio(media_url)   # Baixa o áudio para um AudioBuffer
+        storage.add_log("DEBUG", "Obtendo áudio via base64")
+        base64_audio = await get_audio_base64(server_url, instance, apikey, audio_key)
+        audio = await decode_base64_audio(base64_audio)
+        del base64_audio
+        storage.add_log("DEBUG", "Áudio convertido", {"size": audio.size, "spilled": audio.spilled})
+        return audio
+
+    audio_source = CachedAudio(transcript_cache, fetch_audio, job.get("file_sha256"))
+
+    # Resumo sempre pedido nestes modos; no modo smart a decisão depende do
+    # texto final (já traduzido) e é tomada só depois da transcrição
+    summary_required = output_mode in ["both", "summary_only"]
+
+    async def send(message):
+        await send_message_to_whatsapp(server_url, instance, apikey, message, remote_jid, audio_key)
+
+    # Trechos de áudios longos entregues durante a transcrição
+    delivered_parts = []
+
+    async def send_partial(text, index, total):
+        try:
+            await send(f"{transcription_header} ({index}/{total})\n\n{text}")
+            delivered_parts.append((index, total))
+        except Exception as e:
+            storage.add_log("WARNING", "Falha no envio de trecho parcial", {"error": str(e), "part": index})
+
+    # Transcrever áudio (o buffer é liberado logo após a transcrição, mesmo em erro)
+    storage.add_log("INFO", "Iniciando transcrição")
+    with audio_source:
+        transcription_text, has_timestamps = await transcribe_audio(
+            audio_source,
+            apikey=apikey,
+            remote_jid=remote_jid,
+            from_me=from_me,
+            use_timestamps=use_timestamps,
+            need_summary=summary_required,
+            on_partial=send_partial if progressive else None
+        )
+    # Log do resultado
+    storage.add_log("INFO", "Transcrição concluída", {
+        "has_timestamps": has_timestamps,
+        "text_length": len(transcription_text),
+        "remote_jid": remote_jid
+    })
+
+    transcription_message = f"{transcription_header}\n\n{transcription_text}"
+    if progressive:
+        # Sem todos os trechos entregues, a transcrição completa é enviada
+        if not delivered_parts or len(set(delivered_parts)) < delivered_parts[0][1]:
+            await send(transcription_message)
+        storage.add_log("DEBUG", "Transcrição entregue antes do resumo", {
+            "partial_messages": len(delivered_parts),
+            "remote_jid": remote_jid
+        })
+
+    # Determinar se precisa de resumo baseado no modo de saída
+    summary_text = None
+    need_summary = summary_required or (
+        output_mode == "smart" and len(transcription_text) > character_limit
+    )
+    if need_summary:
+        try:
+            summary_text, _ = await audio_source.get_or_compute(
+                summary_field(config_snapshot.get_transcription_language(), transcription_text),
+                lambda: summarize_text_if_needed(transcription_text)
+            )
+        except Exception as e:
+            if not progressive:
+                raise
+            # A transcrição já foi entregue: repetir o job a reenviaria ao chat
+            storage.add_log("WARNING", "Resumo indisponível; job concluído apenas com a transcrição", {
+                "error": str(e),
+                "type": type(e).__name__,
+                "remote_jid": remote_jid
+            })
+
+    # Construir mensagem baseada no modo de saída
+    message_parts = []
+
+    if output_mode == "smart":
+        if len(transcription_text) > character_limit:
+            message_parts.append(f"{summary_header}\n\n{summary_text}")
+        else:
+            message_parts.append(transcription_message)
+    elif progressive:
+        # A transcrição já foi enviada; o resumo segue como nova mensagem
+        if summary_text:
+            message_parts.append(f"{summary_header}\n\n{summary_text}")
+    else:
+        if output_mode in ["both", "summary_only"] and summary_text:
+            message_parts.append(f"{summary_header}\n\n{summary_text}")
+        if output_mode in ["both", "transcription_only"]:
+            message_parts.append(transcription_message)
+
+    # Adicionar mensagem de negócio
+    message_parts.append(dynamic_settings['BUSINESS_MESSAGE'])
+
+    # Juntar todas as partes da mensagem
+    summary_message = "\n\n".join(message_parts)
+
+    # Enviar resposta (na entrega progressiva pode não restar nada a enviar)
+    if summary_message.strip():
+        await send(summary_message)
+    if progressive:
+        summary_message = f"{transcription_message}\n\n{summary_message}"
+
+    # Registrar sucesso
+    await storage.record_processing(remote_jid)
+    storage.add_log("INFO", "Áudio processado com sucesso", {
+        "remote_jid": remote_jid,
+        "transcription_length": len(transcription_text) if transcription_text else 0,
+        "summary_length": len(summary_text) if summary_text else 0  # Adiciona verificação
+    })
+
+    return summary_message
@@ -0,0 +1,86 @@
+import os
+import random
+import threading
+import time
+from typing import Optional
+
+# Status que indicam falha transitória do provedor
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+class RetryBudget:
+    """
+    Orçamento de retries compartilhado pelo processo (token bucket).
+
+    Cada requisição original deposita RETRY_BUDGET_RATIO fichas e cada
+    retry consome uma, de modo que os retries fiquem limitados a essa
+    fração do tráfego base. RETRY_BUDGET_MIN_PER_SECOND fichas por segundo
+    garantem alguns retries mesmo com pouco tráfego, e o saldo nunca passa
+    de RETRY_BUDGET_MAX_TOKENS. Quando o provedor está limitando, o
+    orçamento se esgota e as falhas voltam ao chamador em vez de virarem
+    uma tempestade de retries.
+    """
+
+    def __init__(self, ratio: float = None, min_per_second: float = None, max_tokens: float = None):
+        self.ratio = ratio if ratio is not None else float(os.getenv("RETRY_BUDGET_RATIO", 0.1))
+        self.min_per_second = min_per_second if min_per_second is not None else float(
+            os.getenv("RETRY_BUDGET_MIN_PER_SECOND", 0.5)
+        )
+        self.max_tokens = max_tokens if max_tokens is not None else float(os.getenv("RETRY_BUDGET_MAX_TOKENS", 20))
+        self._tokens = self.max_tokens
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, amount: float = 0.0):
+        now = time.monotonic()
+        elapsed, self._updated_at = now - self._updated_at, now
+        self._tokens = min(self._tokens + elapsed * self.min_per_second + amount, self.max_tokens)
+
+    def record_request(self):
+        """Registra uma requisição original (não retry)."""
+        with self._lock:
+            self._refill(self.ratio)
+
+    def try_spend(self) -> bool:
+        """Consome uma ficha para um retry; False se o orçamento estiver esgotado."""
+        with self._lock:
+            self._refill()
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+class RetryPolicy:
+    """
+    Quando e quanto esperar antes de repetir uma requisição.
+
+    O atraso segue backoff exponencial com full jitter (um valor aleatório
+    entre 0 e RETRY_BASE_DELAY * 2^tentativa, limitado a RETRY_MAX_DELAY).
+    Se o provedor informar Retry-After, a espera é de pelo menos esse
+    tempo; acima de RETRY_MAX_DELAY não vale a pena esperar e a falha
+    volta ao chamador.
+    """
+
+    def __init__(self, base_delay: float = None, max_delay: float = None, max_attempts: int = None):
+        self.base_delay = base_delay if base_delay is not None else float(os.getenv("RETRY_BASE_DELAY", 0.5))
+        self.max_delay = max_delay if max_delay is not None else float(os.getenv("RETRY_MAX_DELAY", 20))
+        self.max_attempts = max_attempts if max_attempts is not None else int(os.getenv("RETRY_MAX_ATTEMPTS", 4))
+
+    @staticmethod
+    def is_retryable(status: int) -> bool:
+        return status in RETRYABLE_STATUS
+
+    def delay(self, attempt: int, retry_after: Optional[float] = None) -> Optional[float]:
+        """
+        Espera (s) antes da tentativa seguinte a `attempt` (0 = primeira
+        falha), ou None se o Retry-After exigir mais que RETRY_MAX_DELAY.
+        """
+        backoff = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+        if retry_after is None:
+            return backoff
+        if retry_after > self.max_delay:
+            return None
+        return retry_after + random.uniform(0, min(backoff, self.max_delay - retry_after))
+
+# Compartilhados por todas as requisições do processo
+retry_policy = RetryPolicy()
+retry_budget = RetryBudget()
@@ -1,30 +1,72 @@
 import aiohttp
-import base64
-import aiofiles
 from fastapi import HTTPException
-from config import settings, logger, redis_client
-from storage import StorageHandler
+from config import settings, logger, config_snapshot
+from async_storage import AsyncStorageHandler
 import os
 import json
-import tempfile
+import time
+import math
+import asyncio
 import traceback
+from typing import List
+from urllib.parse import urlparse
+from metrics import metrics
+from http_client import http_client
+from audio_buffer import AudioBuffer
+from transcript_cache import CachedAudio, TranscriptCache, summary_field
+from llm_cache import LLMCache, prompt_version
+from audio_chunker import AudioChunk, AudioChunker, close_chunks, stitch_responses
 from groq_handler import get_working_groq_key, validate_transcription_response, handle_groq_request
+from openai_handler import get_working_openai_key, handle_openai_request
+from circuit_breaker import CircuitBreaker, is_provider_failure
 # Inicializa o storage handler
-storage = StorageHandler()
+storage = AsyncStorageHandler()
+# Cache de transcrições por conteúdo do áudio (áudios encaminhados)
+transcript_cache = TranscriptCache(storage.redis)
+# Memoização de resumo, tradução e detecção de idioma por texto
+llm_cache = LLMCache(storage.redis)
+# Divisão de áudios longos para transcrição em paralelo
+audio_chunker = AudioChunker()
+# Estado dos provedores por tipo de chamada, compartilhado entre réplicas
+circuit_breaker = CircuitBreaker(storage.redis)
 
-async def convert_base64_to_file(base64_data):
-    """Converte dados base64 em arquivo temporário"""
+# Modelos de chat por provedor
+CHAT_MODELS = {
+    "openai": "gpt-4o-mini",
+    "groq": "llama-3.3-70b-versatile",
+}
+
+# Requisição com rodízio de chaves de cada provedor
+PROVIDER_HANDLERS = {
+    "openai": handle_openai_request,
+    "groq": handle_groq_request,
+}
+
+# Lista de idiomas suportados
+SUPPORTED_LANGUAGES = {
+    "pt", "en", "es", "fr", "de", "it", "ja", "ko",
+    "zh", "ro", "ru", "ar", "hi", "nl", "pl", "tr"
+}
+
+# Nomes retornados pelo Whisper no campo `language` do verbose_json
+WHISPER_LANGUAGE_CODES = {
+    "portuguese": "pt", "english": "en", "spanish": "es", "french": "fr",
+    "german": "de", "italian": "it", "japanese": "ja", "korean": "ko",
+    "chinese": "zh", "romanian": "ro", "russian": "ru", "arabic": "ar",
+    "hindi": "hi", "dutch": "nl", "polish": "pl", "turkish": "tr",
+}
+
+async def decode_base64_audio(base64_data) -> AudioBuffer:
+    """Decodifica o áudio base64 em um AudioBuffer (memória ou tmpfs)"""
     try:
-        storage.add_log("DEBUG", "Iniciando conversão de base64 para arquivo")
-        audio_data = base64.b64decode(base64_data)
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".mp3") as temp_file:
-            temp_file.write(audio_data)
-            audio_file_path = temp_file.name
-        
-        storage.add_log("DEBUG", "Arquivo temporário criado", {
-            "path": audio_file_path
+        storage.add_log("DEBUG", "Iniciando decodificação do áudio base64")
+        audio = AudioBuffer.from_base64(base64_data)
+
+        storage.add_log("DEBUG", "Áudio decodificado", {
+            "size": audio.size,
+            "spilled": audio.spilled
         })
-        return audio_file_path
+        return audio
     except Exception as e:
         storage.add_log("ERROR", "Erro na conversão base64", {
             "error": str(e),
@@ -32,131 +74,186 @@ async def convert_base64_to_file(base64_data):
         })
         raise
 
-async def get_groq_key():
-    """Obtém a próxima chave GROQ do sistema de rodízio."""
-    key = storage.get_next_groq_key()
-    if not key:
-        raise HTTPException(
-            status_code=500,
-            detail="Nenhuma chave GROQ configurada. Configure pelo menos uma chave no painel administrativo."
-        )
-    return key
+def get_chat_model() -> str:
+    """Modelo de chat (resumo, tradução, detecção) do provedor configurado."""
+    provider = config_snapshot.get_llm_provider()
+    return CHAT_MODELS["openai" if provider == "openai" else "groq"]
+
+async def select_provider(endpoint: str) -> str:
+    """
+    Provedor para uma chamada de 'transcription' ou 'chat': o configurado,
+    ou o outro enquanto o circuito do configurado estiver aberto. O
+    tráfego volta sozinho quando as sondas do configurado funcionam.
+    """
+    preferred = "openai" if config_snapshot.get_llm_provider() == "openai" else "groq"
+    if await circuit_breaker.allow(preferred, endpoint):
+        return preferred
+
+    fallback = "groq" if preferred == "openai" else "openai"
+    fallback_keys = await (storage.get_groq_keys() if fallback == "groq" else storage.get_openai_keys())
+    if fallback_keys and await circuit_breaker.allow(fallback, endpoint):
+        metrics.incr("circuit_breaker", f"{endpoint}.failovers")
+        storage.add_log("WARNING", "Circuito aberto; usando provedor alternativo", {
+            "endpoint": endpoint,
+            "provider": preferred,
+            "fallback": fallback
+        })
+        return fallback
+    # Sem alternativa disponível, tenta o configurado mesmo assim
+    return preferred
+
+async def get_chat_endpoint(provider: str = None):
+    """URL e headers de chat do provedor informado (padrão: o configurado)."""
+    provider = provider or config_snapshot.get_llm_provider()
 
-async def summarize_text_if_needed(text):
-    """Resumir texto usando a API GROQ com sistema de rodízio de chaves"""
-    storage.add_log("DEBUG", "Iniciando processo de resumo", {
-        "text_length": len(text)
-    })
-    provider = storage.get_llm_provider()
-    
-    # Obter idioma configurado
-    language = redis_client.get("TRANSCRIPTION_LANGUAGE") or "pt"
-    storage.add_log("DEBUG", "Idioma configurado para resumo", {
-    "language": language,
-    "redis_value": redis_client.get("TRANSCRIPTION_LANGUAGE")
-    })
-    
     if provider == "openai":
-        api_key = storage.get_openai_keys()[0]
+        api_key = await get_working_openai_key(storage, "tokens")
+        if not api_key:
+            raise Exception("Nenhuma chave OpenAI disponível")
         url = "https://api.openai.com/v1/chat/completions"
-        model = "gpt-4o-mini"
     else:  # groq
         url = "https://api.groq.com/openai/v1/chat/completions"
-        api_key = await get_working_groq_key(storage)
+        api_key = await get_working_groq_key(storage, "tokens")
         if not api_key:
             raise Exception("Nenhuma chave GROQ disponível")
-        model = "llama-3.3-70b-versatile"
-        
+
     headers = {
         "Authorization": f"Bearer {api_key}",
         "Content-Type": "application/json",
     }
-    
+    return url, headers
+
+async def request_chat(json_data: dict):
+    """
+    Chamada de chat com failover entre provedores. O modelo é ajustado ao
+    provedor escolhido e o resultado alimenta o circuit breaker. Retorna
+    (sucesso, resposta, erro, modelo usado); o modelo usado difere de
+    `json_data["model"]` quando houve failover.
+    """
+    provider = await select_provider("chat")
+    url, headers = await get_chat_endpoint(provider)
+    started = time.monotonic()
+    success, response_data, error = await PROVIDER_HANDLERS[provider](
+        url, headers, dict(json_data, model=CHAT_MODELS[provider]), storage, is_form_data=False
+    )
+    await circuit_breaker.record(
+        provider, "chat", not success and is_provider_failure(response_data), time.monotonic() - started
+    )
+    return success, response_data, error, CHAT_MODELS[provider]
+
+# Prompts de resumo por idioma
+SUMMARY_PROMPTS = {
+    "pt": """
+        Entenda o contexto desse áudio e faça um resumo super enxuto sobre o que se trata.
+        Esse áudio foi enviado pelo whatsapp, de alguém, para Fabio.  
+        Escreva APENAS o resumo do áudio como se fosse você que estivesse enviando 
+        essa mensagem! Não cumprimente, não de oi, não escreva nada antes nem depois 
+        do resumo, responda apenas um resumo enxuto do que foi falado no áudio.
+        """,
+    "en": """
+        Understand the context of this audio and make a very concise summary of what it's about.
+        This audio was sent via WhatsApp, from someone, to Fabio.
+        Write ONLY the summary of the audio as if you were sending this message yourself!
+        Don't greet, don't say hi, don't write anything before or after the summary,
+        respond with just a concise summary of what was said in the audio.
+        """,
+    "es": """
+        Entiende el contexto de este audio y haz un resumen muy conciso sobre de qué se trata. 
+        Este audio fue enviado por WhatsApp, de alguien, para Fabio. 
+        Escribe SOLO el resumen del audio como si tú estuvieras enviando este mensaje. 
+        No saludes, no escribas nada antes ni después del resumen, responde únicamente un resumen conciso de lo dicho en el audio.
+        """,
+    "fr": """
+        Comprenez le contexte de cet audio et faites un résumé très concis de ce dont il s'agit. 
+        Cet audio a été envoyé via WhatsApp, par quelqu'un, à Fabio. 
+        Écrivez UNIQUEMENT le résumé de l'audio comme si c'était vous qui envoyiez ce message. 
+        Ne saluez pas, n'écrivez rien avant ou après le résumé, répondez seulement par un résumé concis de ce qui a été dit dans l'audio.
+        """,
+    "de": """
+        Verstehen Sie den Kontext dieses Audios und erstellen Sie eine sehr kurze Zusammenfassung, worum es geht. 
+        Dieses Audio wurde über WhatsApp von jemandem an Fabio gesendet. 
+        Schreiben Sie NUR die Zusammenfassung des Audios, als ob Sie diese Nachricht senden würden. 
+        Grüßen Sie nicht, schreiben Sie nichts vor oder nach der Zusammenfassung, antworten Sie nur mit einer kurzen Zusammenfassung dessen, was im Audio gesagt wurde.
+        """,
+    "it": """
+        Comprendi il contesto di questo audio e fai un riassunto molto conciso di cosa si tratta. 
+        Questo audio è stato inviato tramite WhatsApp, da qualcuno, a Fabio. 
+        Scrivi SOLO il riassunto dell'audio come se fossi tu a inviare questo messaggio. 
+        Non salutare, non scrivere nulla prima o dopo il riassunto, rispondi solo con un riassunto conciso di ciò che è stato detto nell'audio.
+        """,
+    "ja": """
+        この音声の内容を理解し、それが何について話されているのかを非常に簡潔に要約してください。
+        この音声は、誰かがWhatsAppでファビオに送ったものです。
+        あなたがそのメッセージを送っているように、音声の要約だけを記述してください。
+        挨拶や前置き、後書きは書かず、音声で話された内容の簡潔な要約のみを返信してください。
+        """,
+    "ko": """
+        이 오디오의 맥락을 이해하고, 무엇에 관한 것인지 매우 간략하게 요약하세요.
+        이 오디오는 누군가가 WhatsApp을 통해 Fabio에게 보낸 것입니다.
+        마치 당신이 메시지를 보내는 것처럼 오디오의 요약만 작성하세요.
+        인사하거나, 요약 전후로 아무것도 쓰지 말고, 오디오에서 말한 내용을 간략하게 요약한 답변만 하세요.
+        """,
+    "zh": """
+        理解这个音频的上下文，并简洁地总结它的内容。
+        这个音频是某人通过WhatsApp发送给Fabio的。
+        请仅以摘要的形式回答，就好像是你在发送这条消息。
+        不要问候，也不要在摘要前后写任何内容，只需用一句简短的话总结音频中所说的内容。
+        """,
+    "ro": """
+        Înțelege contextul acestui audio și creează un rezumat foarte concis despre ce este vorba. 
+        Acest audio a fost trimis prin WhatsApp, de cineva, către Fabio. 
+        Scrie DOAR rezumatul audio-ului ca și cum tu ai trimite acest mesaj. 
+        Nu saluta, nu scrie nimic înainte sau după rezumat, răspunde doar cu un rezumat concis despre ce s-a spus în audio.
+        """,
+
+    "ru": """
+        Поймите контекст этого аудио и сделайте очень краткое резюме, о чем идет речь. 
+        Это аудио было отправлено через WhatsApp кем-то Фабио. 
+        Напишите ТОЛЬКО резюме аудио, как будто вы отправляете это сообщение. 
+        Не приветствуйте, не пишите ничего до или после резюме, ответьте только кратким резюме того, что говорилось в аудио.
+        """
+}
+
+def get_summary_prompt(language: str) -> str:
+    """Prompt de resumo do idioma informado, com fallback para português."""
+    return SUMMARY_PROMPTS.get(language, SUMMARY_PROMPTS["pt"])
+
+async def summarize_text_if_needed(text):
+    """Resumir texto usando a API GROQ com sistema de rodízio de chaves"""
+    storage.add_log("DEBUG", "Iniciando processo de resumo", {
+        "text_length": len(text)
+    })
+    model = get_chat_model()
+
+    # Obter idioma configurado
+    language = config_snapshot.get_transcription_language()
+    storage.add_log("DEBUG", "Idioma configurado para resumo", {
+    "language": language,
+    "config_version": config_snapshot.version
+    })
+
     # Adaptar o prompt para considerar o idioma
-    prompt_by_language = {
-        "pt": """
-            Entenda o contexto desse áudio e faça um resumo super enxuto sobre o que se trata.
-            Esse áudio foi enviado pelo whatsapp, de alguém, para Fabio.  
-            Escreva APENAS o resumo do áudio como se fosse você que estivesse enviando 
-            essa mensagem! Não cumprimente, não de oi, não escreva nada antes nem depois 
-            do resumo, responda apenas um resumo enxuto do que foi falado no áudio.
-            """,
-        "en": """
-            Understand the context of this audio and make a very concise summary of what it's about.
-            This audio was sent via WhatsApp, from someone, to Fabio.
-            Write ONLY the summary of the audio as if you were sending this message yourself!
-            Don't greet, don't say hi, don't write anything before or after the summary,
-            respond with just a concise summary of what was said in the audio.
-            """,
-        "es": """
-            Entiende el contexto de este audio y haz un resumen muy conciso sobre de qué se trata. 
-            Este audio fue enviado por WhatsApp, de alguien, para Fabio. 
-            Escribe SOLO el resumen del audio como si tú estuvieras enviando este mensaje. 
-            No saludes, no escribas nada antes ni después del resumen, responde únicamente un resumen conciso de lo dicho en el audio.
-            """,
-        "fr": """
-            Comprenez le contexte de cet audio et faites un résumé très concis de ce dont il s'agit. 
-            Cet audio a été envoyé via WhatsApp, par quelqu'un, à Fabio. 
-            Écrivez UNIQUEMENT le résumé de l'audio comme si c'était vous qui envoyiez ce message. 
-            Ne saluez pas, n'écrivez rien avant ou après le résumé, répondez seulement par un résumé concis de ce qui a été dit dans l'audio.
-            """,
-        "de": """
-            Verstehen Sie den Kontext dieses Audios und erstellen Sie eine sehr kurze Zusammenfassung, worum es geht. 
-            Dieses Audio wurde über WhatsApp von jemandem an Fabio gesendet. 
-            Schreiben Sie NUR die Zusammenfassung des Audios, als ob Sie diese Nachricht senden würden. 
-            Grüßen Sie nicht, schreiben Sie nichts vor oder nach der Zusammenfassung, antworten Sie nur mit einer kurzen Zusammenfassung dessen, was im Audio gesagt wurde.
-            """,
-        "it": """
-            Comprendi il contesto di questo audio e fai un riassunto molto conciso di cosa si tratta. 
-            Questo audio è stato inviato tramite WhatsApp, da qualcuno, a Fabio. 
-            Scrivi SOLO il riassunto dell'audio come se fossi tu a inviare questo messaggio. 
-            Non salutare, non scrivere nulla prima o dopo il riassunto, rispondi solo con un riassunto conciso di ciò che è stato detto nell'audio.
-            """,
-        "ja": """
-            この音声の内容を理解し、それが何について話されているのかを非常に簡潔に要約してください。
-            この音声は、誰かがWhatsAppでファビオに送ったものです。
-            あなたがそのメッセージを送っているように、音声の要約だけを記述してください。
-            挨拶や前置き、後書きは書かず、音声で話された内容の簡潔な要約のみを返信してください。
-            """,
-        "ko": """
-            이 오디오의 맥락을 이해하고, 무엇에 관한 것인지 매우 간략하게 요약하세요.
-            이 오디오는 누군가가 WhatsApp을 통해 Fabio에게 보낸 것입니다.
-            마치 당신이 메시지를 보내는 것처럼 오디오의 요약만 작성하세요.
-            인사하거나, 요약 전후로 아무것도 쓰지 말고, 오디오에서 말한 내용을 간략하게 요약한 답변만 하세요.
-            """,
-        "zh": """
-            理解这个音频的上下文，并简洁地总结它的内容。
-            这个音频是某人通过WhatsApp发送给Fabio的。
-            请仅以摘要的形式回答，就好像是你在发送这条消息。
-            不要问候，也不要在摘要前后写任何内容，只需用一句简短的话总结音频中所说的内容。
-            """,
-        "ro": """
-            Înțelege contextul acestui audio și creează un rezumat foarte concis despre ce este vorba. 
-            Acest audio a fost trimis prin WhatsApp, de cineva, către Fabio. 
-            Scrie DOAR rezumatul audio-ului ca și cum tu ai trimite acest mesaj. 
-            Nu saluta, nu scrie nimic înainte sau după rezumat, răspunde doar cu un rezumat concis despre ce s-a spus în audio.
-            """,
-
-        "ru": """
-            Поймите контекст этого аудио и сделайте очень краткое резюме, о чем идет речь. 
-            Это аудио было отправлено через WhatsApp кем-то Фабио. 
-            Напишите ТОЛЬКО резюме аудио, как будто вы отправляете это сообщение. 
-            Не приветствуйте, не пишите ничего до или после резюме, ответьте только кратким резюме того, что говорилось в аудио.
-            """
-    }
-    
-    # Usar o prompt do idioma configurado ou fallback para português
-    base_prompt = prompt_by_language.get(language, prompt_by_language["pt"])
-    json_data = {
-        "messages": [{
+    base_prompt = get_summary_prompt(language)
+
+    def build_messages(content):
+        return [{
             "role": "user",
-            "content": f"{base_prompt}\n\nTexto para resumir: {text}",
-        }],
+            "content": f"{base_prompt}\n\nTexto para resumir: {content}",
+        }]
+
+    cache_key = llm_cache.key("summary", text, model, prompt_version(build_messages), language)
+    cached_summary = await llm_cache.get("summary", cache_key)
+    if cached_summary is not None:
+        storage.add_log("DEBUG", "Resumo obtido do cache", {"language": language})
+        return cached_summary
+
+    json_data = {
+        "messages": build_messages(text),
         "model": model,
     }
 
     try:
-        success, response_data, error = await handle_groq_request(url, headers, json_data, storage, is_form_data=False)
+        success, response_data, error, used_model = await request_chat(json_data)
         if not success:
            raise Exception(error)
        
@@ -176,7 +273,10 @@ async def summarize_text_if_needed(text):
             "summary_length": len(summary_text),
             "language": language
         })
-        
+
+        # A chave é do modelo configurado; respostas de failover não entram no cache
+        if used_model == model:
+            await llm_cache.set(cache_key, summary_text)
         return summary_text
     
     except Exception as e:
@@ -186,16 +286,24 @@ async def summarize_text_if_needed(text):
         })
         raise
 
-async def transcribe_audio(audio_source, apikey=None, remote_jid=None, from_me=False, use_timestamps=False):
+async def transcribe_audio(audio_source: CachedAudio, apikey=None, remote_jid=None, from_me=False, use_timestamps=False, need_summary=False, on_partial=None):
     """
     Transcreve áudio com suporte a detecção de idioma e tradução automática.
+    Idioma detectado, transcrições e traduções são reaproveitados do cache
+    de transcrições; o áudio só é baixado quando o Whisper é necessário.
     
     Args:
-        audio_source: Caminho do arquivo de áudio ou URL
+        audio_source: CachedAudio do job (a liberação fica com quem o criou)
         apikey: Chave da API opcional para download de áudio
         remote_jid: ID do remetente/destinatário
         from_me: Se o áudio foi enviado pelo próprio usuário
         use_timestamps: Se True, usa verbose_json para incluir timestamps
+        need_summary: Se o pipeline certamente vai resumir o texto (decidido
+            por ele antes da transcrição). Quando há tradução, o resumo é
+            gerado na mesma chamada e fica no cache de transcrições.
+        on_partial: Corrotina (texto, parte, total) chamada com cada trecho
+            de um áudio longo, em ordem, assim que ele é transcrito. Não é
+            usada quando o texto ainda precisa ser traduzido.
         
     Returns:
         tuple: (texto_transcrito, has_timestamps)
@@ -204,24 +312,10 @@ async def transcribe_audio(audio_source, apikey=None, remote_jid=None, from_me=F
         "from_me": from_me,
         "remote_jid": remote_jid
     })
-    provider = storage.get_llm_provider()
-    
-    if provider == "openai":
-        api_key = storage.get_openai_keys()[0]  # Get first OpenAI key
-        url = "https://api.openai.com/v1/audio/transcriptions"
-        model = "whisper-1"
-    else:  # groq
-        api_key = await get_working_groq_key(storage)
-        if not api_key:
-            raise Exception("Nenhuma chave GROQ disponível")
-        url = "https://api.groq.com/openai/v1/audio/transcriptions"
-        model = "whisper-large-v3"
-
-    headers = {"Authorization": f"Bearer {api_key}"}
-    
     # Inicializar variáveis
     contact_language = None
-    system_language = redis_client.get("TRANSCRIPTION_LANGUAGE") or "pt"
+    detection_response = None
+    system_language = config_snapshot.get_transcription_language()
     is_private = remote_jid and "@s.whatsapp.net" in remote_jid
 
     # Determinar idioma do contato em conversas privadas
@@ -230,7 +324,7 @@ async def transcribe_audio(audio_source, apikey=None, remote_jid=None, from_me=F
         contact_id = remote_jid.split('@')[0]
         
         # 1. Primeiro tentar obter idioma configurado manualmente
-        contact_language = storage.get_contact_language(contact_id)
+        contact_language = await storage.get_contact_language(contact_id)
         if contact_language:
             storage.add_log("DEBUG", "Usando idioma configurado manualmente", {
                 "contact_language": contact_language,
@@ -239,9 +333,9 @@ async def transcribe_audio(audio_source, apikey=None, remote_jid=None, from_me=F
                 "is_private": is_private
             })
         # 2. Se não houver configuração manual e detecção automática estiver ativa
-        elif storage.get_auto_language_detection():
+        elif config_snapshot.get_auto_language_detection():
             # Verificar cache primeiro
-            cached_lang = storage.get_cached_language(contact_id)
+            cached_lang = await storage.get_cached_language(contact_id)
             if cached_lang:
                 contact_language = cached_lang.get('language')
                 storage.add_log("DEBUG", "Usando idioma do cache", {
@@ -251,29 +345,56 @@ async def transcribe_audio(audio_source, apikey=None, remote_jid=None, from_me=F
             # Se não há cache ou está expirado, fazer detecção
             elif not from_me:  # Só detecta em mensagens recebidas
                 try:
-                    # Realizar transcrição inicial sem idioma específico
-                    with open(audio_source, 'rb') as audio_file:
-                        data = aiohttp.FormData()
-                        data.add_field('file', audio_file, filename='audio.mp3')
-                        data.add_field('model', model)
-
-                        success, response_data, error = await handle_groq_request(url, headers, data, storage, is_form_data=True)
-                        if success:
-                            initial_text = response_data.get("text", "")
-
-                            # Detectar idioma do texto transcrito
-                            detected_lang = await detect_language(initial_text)
-
-                            # Salvar no cache E na configuração do contato
-                            storage.cache_language_detection(contact_id, detected_lang)
-                            storage.set_contact_language(contact_id, detected_lang)
-
-                            contact_language = detected_lang
-                            storage.add_log("INFO", "Idioma detectado e configurado", {
-                                "language": detected_lang,
-                                "remote_jid": remote_jid,
-                                "auto_detected": True
-                            })
+                    async def detect_with_whisper():
+                        """Primeira passagem sem idioma: o próprio Whisper informa o idioma."""
+                        nonlocal detection_response
+                        success, response_data, error = await request_whisper(
+                            await audio_source.fetch(), verbose=True
+                        )
+                        if not success:
+                            raise Exception(error)
+
+                        detected, confidence = whisper_detected_language(response_data)
+                        if not detected:
+                            # Idioma fora da lista suportada: recorre ao detector por texto
+                            metrics.incr("language_detection", "llm_fallback")
+                            detected = await detect_language(response_data.get("text", ""))
+                            confidence = 0.0
+
+                        if confidence >= get_language_confidence_threshold():
+                            # Transcrição já está no idioma detectado; reaproveitada abaixo
+                            detection_response = response_data
+                            if await validate_transcription_response(response_data.get("text", "")):
+                                await audio_source.set(transcript_cache_fields(detected, response_data))
+                            metrics.incr("language_detection", "whisper_reused")
+                        else:
+                            metrics.incr("language_detection", "second_pass")
+                        storage.add_log("INFO", "Idioma detectado pelo Whisper", {
+                            "language": detected,
+                            "confidence": round(confidence, 3),
+                            "reused": detection_response is not None,
+                            "remote_jid": remote_jid
+                        })
+                        return detected
+
+                    # Cópias do mesmo áudio (ex.: encaminhado) reaproveitam a detecção
+                    detected_lang, detected_here = await audio_source.get_or_compute(
+                        "language", detect_with_whisper
+                    )
+                    if not detected_here:
+                        metrics.incr("language_detection", "transcript_cache")
+
+                    # Salvar no cache E na configuração do contato
+                    await storage.cache_language_detection(contact_id, detected_lang)
+                    await storage.set_contact_language(contact_id, detected_lang)
+
+                    contact_language = detected_lang
+                    storage.add_log("INFO", "Idioma detectado e configurado", {
+                        "language": detected_lang,
+                        "from_cache": not detected_here,
+                        "remote_jid": remote_jid,
+                        "auto_detected": True
+                    })
                 except Exception as e:
                     storage.add_log("WARNING", "Erro na detecção automática de idioma", {
                         "error": str(e),
@@ -323,75 +444,95 @@ async def transcribe_audio(audio_source, apikey=None, remote_jid=None, from_me=F
         "contact_language": contact_language
     })
 
-    try:
-        # Realizar transcrição
-        with open(audio_source, 'rb') as audio_file:
-            data = aiohttp.FormData()
-            data.add_field('file', audio_file, filename='audio.mp3')
-            data.add_field('model', model)
-            data.add_field('language', transcription_language)
+    # Tradução quando necessário
+    need_translation = (
+        is_private and contact_language and
+        (
+            (from_me and transcription_language != target_language) or
+            (not from_me and target_language != transcription_language)
+        )
+    )
 
-            if use_timestamps:
-                data.add_field('response_format', 'verbose_json')
+    async def emit_partial(response_data, index, total):
+        text = format_timestamped_result(response_data) if use_timestamps else response_data.get("text", "")
+        if text.strip():
+            await on_partial(text.strip(), index, total)
 
-            # Usar handle_groq_request para ter retry e validação
-            success, response_data, error = await handle_groq_request(url, headers, data, storage, is_form_data=True)
-            if not success:
-                raise Exception(f"Erro na transcrição: {error}")
+    try:
+        async def run_whisper():
+            if detection_response is not None:
+                # Primeira passagem com confiança suficiente: sem segunda chamada ao Whisper
+                response_data = detection_response
+            else:
+                # Realizar transcrição
+                success, response_data, error = await request_whisper(
+                    await audio_source.fetch(),
+                    language=transcription_language, verbose=use_timestamps,
+                    on_partial=emit_partial if on_partial and not need_translation else None
+                )
+                if not success:
+                    raise Exception(f"Erro na transcrição: {error}")
 
-            transcription = format_timestamped_result(response_data) if use_timestamps else response_data.get("text", "")
+            text = format_timestamped_result(response_data) if use_timestamps else response_data.get("text", "")
 
             # Validar o conteúdo da transcrição
-            if not await validate_transcription_response(transcription):
+            if not await validate_transcription_response(text):
                 storage.add_log("ERROR", "Transcrição vazia ou inválida recebida")
                 raise Exception("Transcrição vazia ou inválida recebida")
+            return text
 
-            # Detecção automática para novos contatos
-            if (is_private and storage.get_auto_language_detection() and 
-                not from_me and not contact_language):
-                try:
-                    detected_lang = await detect_language(transcription)
-                    storage.cache_language_detection(remote_jid, detected_lang)
-                    contact_language = detected_lang
-                    storage.add_log("INFO", "Idioma detectado e cacheado", {
-                        "language": detected_lang,
-                        "remote_jid": remote_jid
-                    })
-                except Exception as e:
-                    storage.add_log("WARNING", "Erro na detecção de idioma", {"error": str(e)})
-
-            # Tradução quando necessário
-            need_translation = (
-                is_private and contact_language and
-                (
-                    (from_me and transcription_language != target_language) or
-                    (not from_me and target_language != transcription_language)
-                )
-            )
+        transcript_field = f"transcript:{transcription_language}:{int(use_timestamps)}"
+        if detection_response is not None:
+            audio_source.record_miss()
+            transcription = await run_whisper()
+            await audio_source.set({transcript_field: transcription})
+        else:
+            # Uma única chamada ao Whisper por áudio, mesmo com cópias simultâneas
+            transcription, transcribed_here = await audio_source.get_or_compute(transcript_field, run_whisper)
+            if transcribed_here:
+                audio_source.record_miss()
+            else:
+                audio_source.record_hit()
+                storage.add_log("DEBUG", "Transcrição obtida do cache", {
+                    "digest": audio_source.digest,
+                    "language": transcription_language
+                })
 
-            if need_translation:
-                try:
-                    transcription = await translate_text(
-                        transcription,
-                        transcription_language,
-                        target_language
+        if need_translation:
+            try:
+                translation_field = f"translation:{transcription_language}:{target_language}:{int(use_timestamps)}"
+                source_text = transcription
+
+                async def translate():
+                    # Resumo necessário: tradução e resumo na mesma chamada
+                    if not need_summary:
+                        return await translate_text(source_text, transcription_language, target_language)
+                    translation, summary = await translate_and_summarize(
+                        source_text, transcription_language, target_language
                     )
-                    storage.add_log("INFO", "Texto traduzido automaticamente", {
-                        "from": transcription_language,
-                        "to": target_language
-                    })
-                except Exception as e:
-                    storage.add_log("ERROR", "Erro na tradução", {"error": str(e)})
+                    if summary:
+                        await audio_source.set({
+                            summary_field(config_snapshot.get_transcription_language(), translation): summary
+                        })
+                    return translation
 
-            # Registrar estatísticas de uso
-            used_language = contact_language if contact_language else system_language
-            storage.record_language_usage(
-                used_language,
-                from_me,
-                bool(contact_language and contact_language != system_language)
-            )
+                transcription, _ = await audio_source.get_or_compute(translation_field, translate)
+                storage.add_log("INFO", "Texto traduzido automaticamente", {
+                    "from": transcription_language,
+                    "to": target_language
+                })
+            except Exception as e:
+                storage.add_log("ERROR", "Erro na tradução", {"error": str(e)})
 
-            return transcription, use_timestamps
+        # Registrar estatísticas de uso
+        used_language = contact_language if contact_language else system_language
+        await storage.record_language_usage(
+            used_language,
+            from_me,
+            bool(contact_language and contact_language != system_language)
+        )
+
+        return transcription, use_timestamps
 
     except Exception as e:
         storage.add_log("ERROR", "Erro no processo de transcrição", {
@@ -399,15 +540,169 @@ async def transcribe_audio(audio_source, apikey=None, remote_jid=None, from_me=F
             "type": type(e).__name__
         })
         raise
-    finally:
-        # Limpar arquivos temporários
-        if isinstance(audio_source, str) and os.path.exists(audio_source):
+
+def get_language_confidence_threshold() -> float:
+    """Confiança mínima para reaproveitar a transcrição da detecção de idioma."""
+    return float(os.getenv("LANGUAGE_DETECTION_MIN_CONFIDENCE", 0.5))
+
+async def get_whisper_endpoint(exclude_keys: set = None):
+    """URL, headers, modelo e provedor de transcrição (com failover)."""
+    provider = await select_provider("transcription")
+
+    if provider == "openai":
+        api_key = await get_working_openai_key(storage, "audio", exclude_keys)
+        if not api_key:
+            raise Exception("Nenhuma chave OpenAI disponível")
+        url = "https://api.openai.com/v1/audio/transcriptions"
+        model = "whisper-1"
+    else:  # groq
+        api_key = await get_working_groq_key(storage, "audio", exclude_keys)
+        if not api_key:
+            raise Exception("Nenhuma chave GROQ disponível")
+        url = "https://api.groq.com/openai/v1/audio/transcriptions"
+        model = "whisper-large-v3"
+
+    return url, {"Authorization": f"Bearer {api_key}"}, model, provider
+
+async def request_whisper(audio_source: AudioBuffer, language=None, verbose=False, on_partial=None):
+    """
+    Envia o áudio ao Whisper; sem `language` o idioma é detectado pela API.
+    Áudios longos são divididos nos silêncios e os trechos transcritos em
+    paralelo (ver request_whisper_chunks).
+    """
+    if audio_chunker.should_split(estimate_audio_seconds(audio_source)):
+        chunks = await audio_chunker.split(audio_source)
+        if chunks:
+            return await request_whisper_chunks(chunks, language, on_partial)
+    return await send_whisper(audio_source, language, verbose)
+
+async def request_whisper_chunks(chunks: List[AudioChunk], language=None, on_partial=None):
+    """
+    Transcreve os trechos ao mesmo tempo, cada um com uma chave diferente
+    sempre que houver chaves livres, e costura o resultado em uma única
+    resposta verbose_json com os tempos do áudio original. Com
+    `on_partial`, cada trecho é entregue em ordem assim que ele e todos os
+    anteriores estiverem prontos.
+    """
+    keys_in_use = set()
+    semaphore = asyncio.Semaphore(int(os.getenv("AUDIO_CHUNK_PARALLELISM", 8)))
+    completed = [None] * len(chunks)
+    delivered = 0
+    delivery_lock = asyncio.Lock()
+
+    async def deliver_ready():
+        nonlocal delivered
+        async with delivery_lock:
+            while delivered < len(chunks) and completed[delivered] is not None:
+                index = delivered
+                delivered += 1
+                try:
+                    await on_partial(stitch_responses([chunks[index]], [completed[index]]), index + 1, len(chunks))
+                except Exception as e:
+                    storage.add_log("WARNING", "Erro ao entregar trecho parcial", {"error": str(e), "part": index + 1})
+
+    async def transcribe_chunk(index: int, chunk: AudioChunk):
+        async with semaphore:
+            endpoint = await get_whisper_endpoint(keys_in_use)
+            api_key = endpoint[1]["Authorization"][len("Bearer "):]
+            keys_in_use.add(api_key)
             try:
-                os.unlink(audio_source)
-            except Exception as e:
-                storage.add_log("WARNING", "Erro ao remover arquivo temporário", {
-                    "error": str(e)
-                })
+                result = await send_whisper(chunk.audio, language, verbose=True, endpoint=endpoint)
+            finally:
+                keys_in_use.discard(api_key)
+        success, response_data, _ = result
+        if success and on_partial:
+            completed[index] = response_data
+            await deliver_ready()
+        return result
+
+    started = time.monotonic()
+    try:
+        results = await asyncio.gather(
+            *(transcribe_chunk(index, chunk) for index, chunk in enumerate(chunks)), return_exceptions=True
+        )
+    finally:
+        close_chunks(chunks)
+
+    for result in results:
+        if isinstance(result, BaseException):
+            return False, {}, f"Erro ao transcrever trecho: {result}"
+        success, _, error = result
+        if not success:
+            return False, {}, error
+
+    response_data = stitch_responses(chunks, [result[1] for result in results])
+    elapsed = time.monotonic() - started
+    metrics.incr("chunked_transcription", "audios")
+    metrics.incr("chunked_transcription", "chunks", len(chunks))
+    metrics.incr("chunked_transcription", "seconds", elapsed)
+    storage.add_log("INFO", "Áudio longo transcrito em trechos", {
+        "chunks": len(chunks),
+        "duration": round(response_data["duration"], 1),
+        "elapsed": round(elapsed, 2)
+    })
+    return True, response_data, ""
+
+async def send_whisper(audio_source: AudioBuffer, language=None, verbose=False, endpoint=None):
+    """Uma requisição ao Whisper com o áudio inteiro."""
+    url, headers, model, provider = endpoint or await get_whisper_endpoint()
+
+    def build_form():
+        # Um FormData por tentativa: o aiohttp não reenvia um formulário já enviado
+        data = aiohttp.FormData()
+        data.add_field('file', audio_source.upload_payload(), filename='audio.mp3')
+        data.add_field('model', model)
+        if language:
+            data.add_field('language', language)
+        if verbose:
+            data.add_field('response_format', 'verbose_json')
+        return data
+
+    # Handler do provedor para ter retry, rodízio de chaves e validação
+    started = time.monotonic()
+    success, response_data, error = await PROVIDER_HANDLERS[provider](
+        url, headers, build_form, storage, is_form_data=True,
+        audio_seconds=estimate_audio_seconds(audio_source)
+    )
+    await circuit_breaker.record(
+        provider, "transcription", not success and is_provider_failure(response_data), time.monotonic() - started
+    )
+    return success, response_data, error
+
+def transcript_cache_fields(language, response_data):
+    """Transcrições (com e sem timestamps) de uma resposta verbose_json para o cache."""
+    return {
+        f"transcript:{language}:0": response_data.get("text", ""),
+        f"transcript:{language}:1": format_timestamped_result(response_data),
+    }
+
+def whisper_detected_language(response_data):
+    """
+    Extrai do verbose_json o idioma detectado pelo Whisper (código ISO
+    639-1, ou None se não suportado) e a confiança da transcrição: a média
+    de `avg_logprob` dos segmentos, ponderada pela duração, convertida em
+    probabilidade.
+    """
+    language = (response_data.get("language") or "").strip().lower()
+    code = language if language in SUPPORTED_LANGUAGES else WHISPER_LANGUAGE_CODES.get(language)
+
+    weighted_logprob = 0.0
+    total_duration = 0.0
+    for segment in response_data.get("segments") or []:
+        if "avg_logprob" not in segment:
+            continue
+        duration = max(segment.get("end", 0) - segment.get("start", 0), 0.01)
+        weighted_logprob += segment["avg_logprob"] * duration
+        total_duration += duration
+    confidence = math.exp(weighted_logprob / total_duration) if total_duration else 0.0
+    return code, confidence
+
+def estimate_audio_seconds(audio: AudioBuffer):
+    """
+    Estima a duração do áudio pelo tamanho (voz do WhatsApp em
+    Opus ~32 kbps). A GROQ cobra no mínimo 10 segundos por requisição.
+    """
+    return max(audio.size / 4000, 10)
 
 def format_timestamped_result(result):
     """
@@ -445,32 +740,11 @@ async def detect_language(text: str) -> str:
     Returns:
         str: Código ISO 639-1 do idioma detectado
     """
-    provider = storage.get_llm_provider()
+    model = get_chat_model()
     storage.add_log("DEBUG", "Iniciando detecção de idioma", {
         "text_length": len(text)
     })
     
-    # Lista de idiomas suportados
-    SUPPORTED_LANGUAGES = {
-        "pt", "en", "es", "fr", "de", "it", "ja", "ko", 
-        "zh", "ro", "ru", "ar", "hi", "nl", "pl", "tr"
-    }
-    if provider == "openai":
-        api_key = storage.get_openai_keys()[0]
-        url = "https://api.openai.com/v1/chat/completions"
-        model = "gpt-4o-mini"
-    else:  # groq
-        url = "https://api.groq.com/openai/v1/chat/completions"
-        api_key = await get_working_groq_key(storage)
-        if not api_key:
-            raise Exception("Nenhuma chave GROQ disponível")
-        model = "llama-3.3-70b-versatile"
-        
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json",
-    }
-    
     # Prompt melhorado com exemplos e restrições
     prompt = """
     Analise o texto e retorne APENAS o código ISO 639-1 do idioma principal.
@@ -488,20 +762,29 @@ async def detect_language(text: str) -> str:
     Texto para análise:
     """
     
-    json_data = {
-        "messages": [{
+    def build_messages(content):
+        return [{
             "role": "system",
             "content": "Você é um detector de idiomas preciso que retorna apenas códigos ISO 639-1."
         }, {
             "role": "user",
-            "content": f"{prompt}\n\n{text[:500]}"  # Limitando para os primeiros 500 caracteres
-        }],
+            "content": f"{prompt}\n\n{content}"
+        }]
+
+    sample = text[:500]  # Limitando para os primeiros 500 caracteres
+    cache_key = llm_cache.key("detect_language", sample, model, prompt_version(build_messages))
+    cached_language = await llm_cache.get("detect_language", cache_key)
+    if cached_language is not None:
+        return cached_language
+
+    json_data = {
+        "messages": build_messages(sample),
         "model": model,
         "temperature": 0.1
     }
 
     try:
-        success, response_data, error = await handle_groq_request(url, headers, json_data, storage, is_form_data=False)
+        success, response_data, error, used_model = await request_chat(json_data)
         if not success:
             raise Exception(f"Falha na detecção de idioma: {error}")
         
@@ -518,6 +801,8 @@ async def detect_language(text: str) -> str:
         storage.add_log("INFO", "Idioma detectado com sucesso", {
             "detected_language": detected_language
         })
+        if used_model == model:
+            await llm_cache.set(cache_key, detected_language)
         return detected_language
 
     except Exception as e:
@@ -578,7 +863,7 @@ def get_body_message_to_whatsapp_v2(message, remote_jid, message_id):
 async def call_whatsapp(url, body, headers):
     """Realiza chamada à API do WhatsApp"""
     try:
-        async with aiohttp.ClientSession() as session:
+        async with http_client.session() as session:
             storage.add_log("DEBUG", "Enviando requisição para WhatsApp", {
                 "url": url
             })
@@ -610,7 +895,7 @@ async def get_audio_base64(server_url, instance, apikey, message_id):
     body = {"message": {"key": {"id": message_id}}, "convertToMp4": False}
 
     try:
-        async with aiohttp.ClientSession() as session:
+        async with http_client.session() as session:
             async with session.post(url, json=body, headers=headers) as response:
                 if response.status in [200, 201]:
                     result = await response.json()
@@ -633,7 +918,7 @@ async def get_audio_base64(server_url, instance, apikey, message_id):
     
 async def format_message(transcription_text, summary_text=None):
     """Formata a mensagem baseado nas configurações."""
-    settings = storage.get_message_settings()
+    settings = await storage.get_message_settings()
     message_parts = []
     
     # Determinar modo de saída
@@ -674,7 +959,7 @@ async def translate_text(text: str, source_language: str, target_language: str)
     Returns:
         str: Texto traduzido
     """
-    provider = storage.get_llm_provider()
+    model = get_chat_model()
     storage.add_log("DEBUG", "Iniciando tradução", {
        "source_language": source_language,
        "target_language": target_language,
@@ -684,24 +969,9 @@ async def translate_text(text: str, source_language: str, target_language: str)
     # Se os idiomas forem iguais, retorna o texto original
     if source_language == target_language:
         return text
-   
-    if provider == "openai":
-        api_key = storage.get_openai_keys()[0]
-        url = "https://api.openai.com/v1/chat/completions"
-        model = "gpt-4o-mini"
-    else:  # groq
-        url = "https://api.groq.com/openai/v1/chat/completions"
-        api_key = await get_working_groq_key(storage)
-        if not api_key:
-            raise Exception("Nenhuma chave GROQ disponível")
-        model = "llama-3.3-70b-versatile"
-        
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json",
-    }
-   
-    prompt = f"""
+
+    def build_messages(content):
+        prompt = f"""
     Você é um tradutor profissional especializado em manter o tom e estilo do texto original.
     
     Instruções:
@@ -714,23 +984,35 @@ async def translate_text(text: str, source_language: str, target_language: str)
     7. Mantenha o mesmo nível de formalidade
     
     Texto para tradução:
-    {text}
+    {content}
     """
-    
-    json_data = {
-        "messages": [{
+        return [{
             "role": "system",
             "content": "Você é um tradutor profissional que mantém o estilo e formatação do texto original."
         }, {
             "role": "user",
             "content": prompt
-        }],
+        }]
+
+    cache_key = llm_cache.key(
+        "translate", text, model, prompt_version(build_messages), source_language, target_language
+    )
+    cached_translation = await llm_cache.get("translate", cache_key)
+    if cached_translation is not None:
+        storage.add_log("DEBUG", "Tradução obtida do cache", {
+            "source_language": source_language,
+            "target_language": target_language
+        })
+        return cached_translation
+
+    json_data = {
+        "messages": build_messages(text),
         "model": model,
         "temperature": 0.3
     }
 
     try:
-        success, response_data, error = await handle_groq_request(url, headers, json_data, storage, is_form_data=False)
+        success, response_data, error, used_model = await request_chat(json_data)
         if not success:
             raise Exception(f"Falha na tradução: {error}")
         
@@ -755,7 +1037,9 @@ async def translate_text(text: str, source_language: str, target_language: str)
             "translated_length": len(translated_text),
             "ratio": length_ratio
         })
-        
+
+        if used_model == model:
+            await llm_cache.set(cache_key, translated_text)
         return translated_text
 
     except Exception as e:
@@ -765,23 +1049,138 @@ async def translate_text(text: str, source_language: str, target_language: str)
         })
         raise
 
+async def translate_and_summarize(text: str, source_language: str, target_language: str):
+    """
+    Traduz e resume o texto em uma única chamada de chat com saída JSON,
+    tirando uma ida e volta ao LLM do caminho crítico de mensagens
+    traduzidas. Se a resposta combinada falhar ou vier inválida, tradução
+    e resumo são feitos em paralelo (o resumo a partir do texto original).
+
+    Returns:
+        tuple: (texto_traduzido, resumo ou None)
+    """
+    model = get_chat_model()
+    summary_language = config_snapshot.get_transcription_language()
+
+    def build_messages(content):
+        return [{
+            "role": "system",
+            "content": "Você é um tradutor profissional que mantém o estilo e formatação do texto original e responde apenas com JSON válido."
+        }, {
+            "role": "user",
+            "content": f"""
+    Retorne um objeto JSON com exatamente duas chaves:
+    - "translation": o texto traduzido de {source_language} para {target_language}, preservando formatações (negrito, itálico, emojis), parágrafos, quebras de linha, números, datas e nomes próprios, sem adicionar ou remover informações e mantendo o mesmo nível de formalidade
+    - "summary": um resumo seguindo estas instruções:
+    {get_summary_prompt(summary_language)}
+
+    Texto:
+    {content}
+    """
+        }]
+
+    cache_key = llm_cache.key(
+        "translate_summarize", text, model, prompt_version(build_messages),
+        source_language, target_language, summary_language
+    )
+    cached = await llm_cache.get("translate_summarize", cache_key)
+    if cached is not None:
+        result = json.loads(cached)
+        return result["translation"], result["summary"]
+
+    json_data = {
+        "messages": build_messages(text),
+        "model": model,
+        "temperature": 0.3,
+        "response_format": {"type": "json_object"}
+    }
+
+    try:
+        success, response_data, error, used_model = await request_chat(json_data)
+        if not success:
+            raise Exception(error)
+
+        result = json.loads(response_data["choices"][0]["message"]["content"])
+        translated_text = str(result.get("translation", "")).strip()
+        summary_text = str(result.get("summary", "")).strip()
+        if not (await validate_transcription_response(translated_text) and await validate_transcription_response(summary_text)):
+            raise Exception("Tradução ou resumo vazio na resposta combinada")
+
+        metrics.incr("translate_summarize", "combined")
+        storage.add_log("INFO", "Tradução e resumo gerados em uma única chamada", {
+            "from": source_language,
+            "to": target_language,
+            "translated_length": len(translated_text),
+            "summary_length": len(summary_text)
+        })
+        if used_model == model:
+            await llm_cache.set(cache_key, json.dumps({"translation": translated_text, "summary": summary_text}))
+        return translated_text, summary_text
+
+    except Exception as e:
+        storage.add_log("WARNING", "Chamada combinada falhou; traduzindo e resumindo em paralelo", {
+            "error": str(e),
+            "type": type(e).__name__
+        })
+
+    metrics.incr("translate_summarize", "parallel")
+    translated_text, summary_text = await asyncio.gather(
+        translate_text(text, source_language, target_language),
+        summarize_text_if_needed(text),
+        return_exceptions=True
+    )
+    if isinstance(translated_text, BaseException):
+        raise translated_text
+    if isinstance(summary_text, BaseException):
+        # Sem resumo aqui; o pipeline tenta novamente pelo caminho normal
+        summary_text = None
+    return translated_text, summary_text
+
 # Nova função para baixar áudio remoto
-async def download_remote_audio(url: str) -> str:
+async def download_remote_audio(url: str) -> AudioBuffer:
     """
-    Baixa um arquivo de áudio remoto e salva localmente como um arquivo temporário.
-    Retorna o caminho para o arquivo salvo.
+    Baixa um arquivo de áudio remoto em blocos para um AudioBuffer.
+    Rejeita mídias maiores que AUDIO_MAX_BYTES (pelo Content-Length, antes
+    de baixar, ou durante o download) e downloads que excedam
+    AUDIO_DOWNLOAD_TIMEOUT segundos. Registra bytes, duração e falhas por
+    host de mídia nas métricas `download`.
     """
+    max_bytes = int(os.getenv("AUDIO_MAX_BYTES", 25 * 1024 * 1024))
+    timeout = float(os.getenv("AUDIO_DOWNLOAD_TIMEOUT", 60))
+    host = urlparse(url).hostname or "unknown"
+    started = time.monotonic()
+    audio = AudioBuffer()
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as response:
-                if response.status == 200:
-                    audio_data = await response.read()
-                    # Cria um arquivo temporário para armazenar o áudio (pode ajustar o sufixo caso necessário)
-                    with tempfile.NamedTemporaryFile(delete=False, suffix=".mp3") as temp_file:
-                        temp_file.write(audio_data)
-                        local_path = temp_file.name
-                    return local_path
-                else:
+        async with http_client.session() as session:
+            async with session.get(url, timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+                if response.status != 200:
                     raise Exception(f"Falha no download, código de status: {response.status}")
+                if response.content_length and response.content_length > max_bytes:
+                    metrics.incr("download", f"{host}.rejected")
+                    raise Exception(
+                        f"Áudio excede o tamanho máximo ({response.content_length} > {max_bytes} bytes)"
+                    )
+                async for chunk in response.content.iter_chunked(64 * 1024):
+                    if audio.size + len(chunk) > max_bytes:
+                        metrics.incr("download", f"{host}.rejected")
+                        raise Exception(f"Áudio excede o tamanho máximo ({max_bytes} bytes)")
+                    audio.write(chunk)
+        elapsed = time.monotonic() - started
+        metrics.incr("download", f"{host}.requests")
+        metrics.incr("download", f"{host}.bytes", audio.size)
+        metrics.incr("download", f"{host}.seconds", elapsed)
+        storage.add_log("DEBUG", "Áudio remoto baixado", {
+            "host": host,
+            "size": audio.size,
+            "seconds": round(elapsed, 3),
+            "throughput_kbps": round(audio.size / 1024 / elapsed, 1) if elapsed else None
+        })
+        return audio.finish()
+    except asyncio.TimeoutError:
+        audio.close()
+        metrics.incr("download", f"{host}.timeouts")
+        raise Exception(f"Erro ao baixar áudio remoto: tempo limite de {timeout:.0f}s excedido")
     except Exception as e:
-        raise Exception(f"Erro ao baixar áudio remoto: {str(e)}")
\ No newline at end of file
+        audio.close()
+        metrics.incr("download", f"{host}.errors")
+        raise Exception(f"Erro ao baixar áudio remoto: {str(e)}")
@@ -0,0 +1,118 @@
+import asyncio
+import os
+import time
+import uuid
+import logging
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+import redis
+from metrics import metrics
+from utils import RENEW_LOCK_SCRIPT, RELEASE_LOCK_SCRIPT
+
+logger = logging.getLogger("TranscreveZAP")
+
+class SingleFlight:
+    """
+    Coalescência de chamadas idênticas simultâneas.
+
+    Dentro do processo, chamadas com a mesma chave aguardam o mesmo future.
+    Entre processos e réplicas, o primeiro a obter o lock
+    `transcrevezap:inflight:<chave>` (SET NX com lease renovado) executa a
+    chamada remota; os demais consultam `lookup` até o resultado aparecer
+    no cache. Se o dono do lock morrer, o lease expira e um dos que
+    aguardam assume a execução; após SINGLEFLIGHT_WAIT_TIMEOUT cada um
+    segue por conta própria.
+    """
+    KEY_PREFIX = "transcrevezap:inflight"
+
+    def __init__(self, client, lease_seconds: float = None, wait_timeout: float = None):
+        self.redis = client
+        self.lease_ms = int((lease_seconds or float(os.getenv("SINGLEFLIGHT_LOCK_LEASE_SECONDS", 30))) * 1000)
+        self.wait_timeout = wait_timeout or float(os.getenv("SINGLEFLIGHT_WAIT_TIMEOUT", 300))
+        self.poll_interval = 0.25
+        self.max_poll_interval = 2.0
+        self._renew_script = client.register_script(RENEW_LOCK_SCRIPT)
+        self._release_script = client.register_script(RELEASE_LOCK_SCRIPT)
+        self._local: Dict[str, asyncio.Future] = {}
+
+    async def run(
+        self,
+        key: str,
+        compute: Callable[[], Awaitable[Any]],
+        lookup: Callable[[], Awaitable[Optional[Any]]],
+    ) -> Tuple[Any, bool]:
+        """
+        Retorna (resultado, executou). `compute` deve gravar o resultado onde
+        `lookup` o encontra antes de retornar.
+        """
+        local = self._local.get(key)
+        if local is not None:
+            metrics.incr("singleflight", "local_joins")
+            value, _ = await asyncio.shield(local)
+            return value, False
+
+        future = asyncio.get_running_loop().create_future()
+        # Evita o aviso de exceção não lida quando ninguém mais aguardava
+        future.add_done_callback(lambda done: done.cancelled() or done.exception())
+        self._local[key] = future
+        try:
+            result = await self._run_distributed(key, compute, lookup)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            if not future.done():
+                future.set_exception(e)
+            raise
+        finally:
+            self._local.pop(key, None)
+
+    async def _renew_lease(self, lock_key: str, token: str):
+        while True:
+            await asyncio.sleep(self.lease_ms / 3000)
+            if not await self._renew_script(keys=[lock_key], args=[token, self.lease_ms]):
+                return
+
+    async def _run_distributed(self, key, compute, lookup) -> Tuple[Any, bool]:
+        lock_key = f"{self.KEY_PREFIX}:{key}"
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + self.wait_timeout
+        delay = self.poll_interval
+        waited = False
+
+        while True:
+            try:
+                acquired = await self.redis.set(lock_key, token, nx=True, px=self.lease_ms)
+            except redis.exceptions.RedisError as e:
+                # Sem Redis não há coordenação; segue com a chamada
+                logger.warning(f"Erro ao obter lock de coalescência '{key}': {e}")
+                return await compute(), True
+
+            if acquired:
+                metrics.incr("singleflight", "leaders")
+                renewer = asyncio.create_task(self._renew_lease(lock_key, token))
+                try:
+                    # Outro dono pode ter concluído entre a consulta ao cache e o lock
+                    value = await lookup()
+                    if value is not None:
+                        return value, False
+                    return await compute(), True
+                finally:
+                    renewer.cancel()
+                    await asyncio.gather(renewer, return_exceptions=True)
+                    try:
+                        await self._release_script(keys=[lock_key], args=[token])
+                    except redis.exceptions.RedisError as e:
+                        logger.warning(f"Erro ao liberar lock de coalescência '{key}': {e}")
+
+            if not waited:
+                waited = True
+                metrics.incr("singleflight", "followers")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_poll_interval)
+
+            value = await lookup()
+            if value is not None:
+                return value, False
+            if time.monotonic() >= deadline:
+                metrics.incr("singleflight", "timeouts")
+                logger.warning(f"Tempo de espera esgotado para '{key}'; executando sem coalescência")
+                return await compute(), True
@@ -46,9 +46,20 @@ initialize_redis_config
 
 # Iniciar o FastAPI em background
 uvicorn main:app --host 0.0.0.0 --port 8005 &
+pids="$!"
+
+# Iniciar os workers da fila de transcrição em background
+for i in $(seq 1 ${WORKER_PROCESSES:-1}); do
+    python worker.py &
+    pids="$pids $!"
+done
 
 # Iniciar o Streamlit
-streamlit run manager.py --server.address 0.0.0.0 --server.port 8501
+streamlit run manager.py --server.address 0.0.0.0 --server.port 8501 &
+pids="$pids $!"
+
+# Repassar SIGTERM/SIGINT (docker stop) para que os workers terminem os jobs em andamento
+trap 'kill -TERM $pids 2>/dev/null' TERM INT
 
 # Manter o script rodando
 wait
\ No newline at end of file
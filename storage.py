@@ -5,32 +5,351 @@ from datetime import datetime, timedelta
 import traceback
 import logging
 import redis
-from utils import create_redis_client
+from utils import create_redis_client, publish_config_change, MEMBERSHIP_CHANNEL
+from config import config_snapshot
+from metrics import metrics
 import uuid
+import threading
+import atexit
+import time
+from collections import deque
+
+LOG_LEVELS = {
+    "DEBUG": logging.DEBUG,
+    "INFO": logging.INFO,
+    "WARNING": logging.WARNING,
+    "ERROR": logging.ERROR,
+    "CRITICAL": logging.CRITICAL,
+}
+
+# Tamanho do ring buffer de cada nível: erros ficam retidos muito mais tempo
+DEFAULT_LOG_RING_SIZES = {
+    "DEBUG": 200,
+    "INFO": 1000,
+    "WARNING": 2000,
+    "ERROR": 5000,
+    "CRITICAL": 5000,
+}
+
+# Amostragem padrão de mensagens de alto volume (mantém 1 a cada N)
+DEFAULT_LOG_SAMPLING = {
+    "Mensagem ignorada - não é áudio": 10,
+}
+
+def get_default_log_level() -> str:
+    """Nível mínimo padrão: DEBUG_MODE força DEBUG, senão usa LOG_LEVEL."""
+    if os.getenv("DEBUG_MODE", "false").lower() == "true":
+        return "DEBUG"
+    level = os.getenv("LOG_LEVEL", "INFO").upper()
+    return level if level in LOG_LEVELS else "INFO"
+
+class LogWriter:
+    """
+    Escritor de logs em lote para o Redis.
+
+    add_log apenas enfileira a entrada em memória (sem I/O no event loop);
+    uma thread em background envia os lotes com pipeline quando o buffer
+    atinge LOG_BATCH_SIZE ou a cada LOG_FLUSH_INTERVAL segundos. O buffer é
+    limitado a LOG_BUFFER_SIZE entradas e o excedente é descartado e contado.
+
+    Antes de enfileirar, a entrada passa pelo nível mínimo configurado e
+    pela amostragem por mensagem. Cada nível tem seu próprio Redis Stream
+    (`transcrevezap:log_stream:<NÍVEL>`), limitado a LOG_RING_SIZE_<NÍVEL>
+    entradas; como os IDs do stream são timestamps, a retenção por tempo é
+    um único XTRIM MINID e leituras por intervalo usam XREVRANGE. O nível
+    mínimo (e DEBUG_MODE) vem do snapshot de configurações, invalidado via
+    pub/sub quando o manager altera a política; as regras de amostragem são
+    relidas só quando a versão do snapshot muda.
+    """
+    LEGACY_LIST_KEYS = ["transcrevezap:logs"] + [f"transcrevezap:logs:{level}" for level in LOG_LEVELS]
+    POLICY_LEVEL_KEY = "transcrevezap:redis_log_level"
+    POLICY_SAMPLING_KEY = "transcrevezap:log_sampling"
+
+    def __init__(self, client: redis.Redis, key_prefix: str):
+        self.redis = client
+        self.key_prefix = key_prefix
+        self.ring_sizes = {
+            level: int(os.getenv(f"LOG_RING_SIZE_{level}", size))
+            for level, size in DEFAULT_LOG_RING_SIZES.items()
+        }
+        self.max_buffer = int(os.getenv("LOG_BUFFER_SIZE", 5000))
+        self.batch_size = int(os.getenv("LOG_BATCH_SIZE", 100))
+        self.flush_interval = float(os.getenv("LOG_FLUSH_INTERVAL", 0.5))
+        self.min_level = LOG_LEVELS[get_default_log_level()]
+        self.sampling = dict(DEFAULT_LOG_SAMPLING)
+        self.dropped = 0
+        self.filtered = 0
+        self.sampled_out = 0
+        self._sample_counters = {}
+        self._policy_version = object()  # Força a primeira leitura da amostragem
+        self._buffer = deque()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._flush_lock = threading.Lock()
+        atexit.register(self.flush)
+
+    def level_key(self, level: str) -> str:
+        return f"{self.key_prefix}:{level}"
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="redis-log-writer", daemon=True)
+            self._thread.start()
+
+    def should_write(self, level: str, message: str) -> Optional[int]:
+        """
+        Aplica nível mínimo e amostragem. Retorna a taxa de amostragem
+        (1 = sem amostragem) se a entrada deve ser gravada, ou None.
+        """
+        self.sync_policy()
+        if LOG_LEVELS.get(level, logging.INFO) < self.min_level:
+            self.filtered += 1
+            return None
+        rate = self.sampling.get(message, 1)
+        if rate > 1:
+            count = self._sample_counters.get(message, 0)
+            self._sample_counters[message] = count + 1
+            if count % rate != 0:
+                self.sampled_out += 1
+                return None
+        return rate
+
+    def submit(self, level: str, entry: Dict) -> bool:
+        """Enfileira os campos de uma entrada. Retorna False se descartada."""
+        with self._condition:
+            if len(self._buffer) >= self.max_buffer:
+                self.dropped += 1
+                metrics.incr("logs", "dropped")
+                return False
+            self._buffer.append((level, entry))
+            if len(self._buffer) >= self.batch_size:
+                self._condition.notify()
+        self._ensure_thread()
+        return True
+
+    def _take_batch(self) -> list:
+        with self._condition:
+            batch = [self._buffer.popleft() for _ in range(min(len(self._buffer), self.batch_size))]
+        return batch
+
+    def flush(self):
+        """Envia imediatamente tudo o que estiver no buffer."""
+        with self._flush_lock:
+            while True:
+                batch = self._take_batch()
+                if not batch:
+                    return
+                by_level = {}
+                for level, entry in batch:
+                    by_level.setdefault(level, []).append(entry)
+                try:
+                    pipe = self.redis.pipeline(transaction=False)
+                    for level, entries in by_level.items():
+                        key = self.level_key(level)
+                        for entry in entries:
+                            pipe.xadd(key, entry, maxlen=self.ring_sizes.get(level, 1000), approximate=True)
+                    pipe.execute()
+                    metrics.incr("logs", "written", len(batch))
+                except redis.exceptions.RedisError as e:
+                    self.dropped += len(batch)
+                    metrics.incr("logs", "dropped", len(batch))
+                    logging.getLogger("StorageHandler").error(f"Erro ao gravar logs no Redis: {e}")
+                    return
+
+    def sync_policy(self):
+        """
+        Aplica o nível mínimo do snapshot de configurações (DEBUG_MODE força
+        DEBUG) e relê as regras de amostragem quando a versão muda. Sem
+        Redis, mantém a última política válida.
+        """
+        try:
+            if config_snapshot.get("DEBUG_MODE", os.getenv("DEBUG_MODE", "false")).lower() == "true":
+                level = "DEBUG"
+            else:
+                level = (config_snapshot.get(self.POLICY_LEVEL_KEY) or "").upper()
+            self.min_level = LOG_LEVELS.get(level, LOG_LEVELS[get_default_log_level()])
+            if config_snapshot.version == self._policy_version:
+                return
+            version = config_snapshot.version
+            policy = dict(DEFAULT_LOG_SAMPLING)
+            for message, rate in (self.redis.hgetall(self.POLICY_SAMPLING_KEY) or {}).items():
+                try:
+                    policy[message] = max(int(rate), 1)
+                except ValueError:
+                    continue
+            self.sampling = policy
+            self._policy_version = version
+        except redis.exceptions.RedisError as e:
+            logging.getLogger("StorageHandler").error(f"Erro ao carregar política de logs: {e}")
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if len(self._buffer) < self.batch_size:
+                    self._condition.wait(timeout=self.flush_interval)
+            self.flush()
+
+    def trim_expired(self, retention_hours: float) -> int:
+        """Remove de todos os níveis as entradas mais antigas que a retenção."""
+        cutoff_ms = int((time.time() - retention_hours * 3600) * 1000)
+        pipe = self.redis.pipeline(transaction=False)
+        for level in LOG_LEVELS:
+            pipe.xtrim(self.level_key(level), minid=cutoff_ms, approximate=False)
+        return sum(pipe.execute())
+
+    def read_range(self, levels: List[str] = None, start: datetime = None,
+                   end: datetime = None, count: int = 100) -> List[Dict]:
+        """Entradas mais recentes primeiro, no intervalo [start, end], mescladas entre níveis."""
+        max_id = f"{int(end.timestamp() * 1000)}" if end else "+"
+        min_id = f"{int(start.timestamp() * 1000)}" if start else "-"
+        levels = [level.upper() for level in (levels or LOG_LEVELS)]
+        pipe = self.redis.pipeline(transaction=False)
+        for level in levels:
+            pipe.xrevrange(self.level_key(level), max=max_id, min=min_id, count=count)
+        entries = []
+        for stream_entries in pipe.execute():
+            for entry_id, fields in stream_entries:
+                fields["id"] = entry_id
+                entries.append(fields)
+        entries.sort(key=lambda entry: tuple(int(part) for part in entry["id"].split("-")), reverse=True)
+        return entries[:count]
+
+    def get_stats(self) -> Dict:
+        return {
+            "buffered": len(self._buffer),
+            "dropped": self.dropped,
+            "filtered": self.filtered,
+            "sampled_out": self.sampled_out,
+            "max_buffer": self.max_buffer,
+        }
+
+# Um único escritor de logs por processo, compartilhado pelas instâncias
+_log_writer: Optional[LogWriter] = None
+_log_writer_lock = threading.Lock()
+
+def get_log_writer(client: redis.Redis, key_prefix: str) -> LogWriter:
+    global _log_writer
+    with _log_writer_lock:
+        if _log_writer is None:
+            _log_writer = LogWriter(client, key_prefix)
+    return _log_writer
+
+# Estatísticas de processamento em contadores e hashes por dia (HINCRBY),
+# com TTL de STATS_RETENTION_DAYS. As mesmas funções montam os comandos
+# para os pipelines do StorageHandler e do AsyncStorageHandler.
+STATS_KEY_PREFIX = "transcrevezap:stats"
+
+def get_stats_retention_days() -> int:
+    return int(os.getenv("STATS_RETENTION_DAYS", 90))
+
+def _stats_days(retention_days: int) -> List[str]:
+    today = datetime.now().date()
+    return [(today - timedelta(days=offset)).isoformat() for offset in range(retention_days)]
+
+def queue_processing_stats(pipe, remote_jid: str, retention_days: int):
+    """Enfileira no pipeline (MULTI) os incrementos de um áudio processado."""
+    now = datetime.now()
+    day = now.strftime("%Y-%m-%d")
+    ttl = retention_days * 24 * 60 * 60
+    daily_key = f"{STATS_KEY_PREFIX}:daily:{day}"
+    contacts_key = f"{STATS_KEY_PREFIX}:{'groups' if '@g.us' in remote_jid else 'users'}:{day}"
+
+    pipe.incr("transcrevezap:total_processed")
+    pipe.set("transcrevezap:last_processed", now.isoformat())
+    pipe.incr(daily_key)
+    pipe.expire(daily_key, ttl)
+    pipe.hincrby(contacts_key, remote_jid, 1)
+    pipe.expire(contacts_key, ttl)
+
+def queue_statistics_reads(pipe, retention_days: int) -> List[str]:
+    """Enfileira no pipeline as leituras de get_statistics; retorna os dias lidos."""
+    days = _stats_days(retention_days)
+    pipe.get("transcrevezap:total_processed")
+    pipe.get("transcrevezap:last_processed")
+    pipe.get("transcrevezap:error_count")
+    pipe.mget([f"{STATS_KEY_PREFIX}:daily:{day}" for day in days])
+    for kind in ("groups", "users"):
+        pipe.hgetall(f"{STATS_KEY_PREFIX}:{kind}:legacy")
+        for day in days:
+            pipe.hgetall(f"{STATS_KEY_PREFIX}:{kind}:{day}")
+    return days
+
+def build_statistics(results: list, days: List[str]) -> Dict:
+    """Agrega o resultado de queue_statistics_reads; a taxa de sucesso é calculada aqui."""
+    total_processed, last_processed, error_count, daily_values = results[:4]
+    total_processed = int(total_processed or 0)
+    error_count = int(error_count or 0)
+
+    counts = {}
+    offset = 4
+    for kind in ("groups", "users"):
+        aggregated = {}
+        for contacts in results[offset:offset + len(days) + 1]:
+            for jid, value in (contacts or {}).items():
+                aggregated[jid] = aggregated.get(jid, 0) + int(value)
+        counts[kind] = aggregated
+        offset += len(days) + 1
+
+    daily_count = {
+        day: int(value)
+        for day, value in sorted(zip(days, daily_values))
+        if value
+    }
+    success_rate = (
+        ((total_processed - error_count) / total_processed) * 100 if total_processed > 0 else 100.0
+    )
+
+    return {
+        "total_processed": total_processed,
+        "last_processed": last_processed,
+        "stats": {
+            "daily_count": daily_count,
+            "group_count": counts["groups"],
+            "user_count": counts["users"],
+            "error_count": error_count,
+            "success_rate": success_rate,
+        }
+    }
 
 class StorageHandler:
     # Chaves Redis para webhooks
     WEBHOOK_KEY = "webhook_redirects"  # Chave para armazenar os webhooks
     WEBHOOK_STATS_KEY = "webhook_stats"  # Chave para estatísticas
+
+    # Estados de processamento por mensagem (idempotência de webhooks)
+    MESSAGE_STATUS_RECEIVED = "received"
+    MESSAGE_STATUS_PROCESSING = "processing"
+    # Falhou, mas o job continua pendente no stream e será reassumido
+    MESSAGE_STATUS_RETRYING = "retrying"
+    MESSAGE_STATUS_DONE = "done"
+    MESSAGE_STATUS_FAILED = "failed"
     
     def __init__(self):
         # Configuração de logger
         self.logger = logging.getLogger("StorageHandler")
-        handler = logging.StreamHandler()
-        formatter = logging.Formatter(
-            '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-        )
-        handler.setFormatter(formatter)
-        self.logger.addHandler(handler)
-        self.logger.setLevel(logging.DEBUG)
+        if not self.logger.handlers:
+            handler = logging.StreamHandler()
+            formatter = logging.Formatter(
+                '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+            )
+            handler.setFormatter(formatter)
+            self.logger.addHandler(handler)
+        self.logger.setLevel(LOG_LEVELS[get_default_log_level()])
         self.logger.info("StorageHandler inicializado.")
 
         # Conexão com o Redis
         self.redis = create_redis_client()
+        self.log_writer = get_log_writer(self.redis, self._get_redis_key("log_stream"))
 
         # Retenção de logs e backups
         self.log_retention_hours = int(os.getenv('LOG_RETENTION_HOURS', 48))
         self.backup_retention_days = int(os.getenv('BACKUP_RETENTION_DAYS', 7))
+        self.stats_retention_days = get_stats_retention_days()
+
+        # Tempo de vida do estado de processamento por mensagem (deduplicação)
+        self.message_state_ttl = int(os.getenv('MESSAGE_STATE_TTL', 86400))
+        # Validade do `received` até o job entrar na fila (confirm_message)
+        self.message_claim_ttl = int(os.getenv('MESSAGE_CLAIM_TTL', 60))
 
         # Garantir valores padrão para configurações de idioma
         if not self.redis.exists(self._get_redis_key("auto_translation")):
@@ -42,64 +361,248 @@ class StorageHandler:
     def _get_redis_key(self, key):
         return f"transcrevezap:{key}"
 
+    def notify_config_change(self):
+        """Notifica a API e os workers para recarregarem o snapshot de configurações."""
+        return publish_config_change(self.redis)
+
     def add_log(self, level: str, message: str, metadata: dict = None):
+        level = level.upper()
+        self.logger.log(LOG_LEVELS.get(level, logging.INFO), f"{message} | Metadata: {metadata}")
+
+        # Nível mínimo e amostragem decididos em memória, antes de serializar
+        sample_rate = self.log_writer.should_write(level, message)
+        if sample_rate is None:
+            return
+
         log_entry = {
             "timestamp": datetime.now().isoformat(),
             "level": level,
             "message": message,
-            "metadata": json.dumps(metadata) if metadata else None
+            "metadata": json.dumps(metadata) if metadata else ""
         }
-        self.redis.lpush(self._get_redis_key("logs"), json.dumps(log_entry))
-        self.redis.ltrim(self._get_redis_key("logs"), 0, 999)  # Manter apenas os últimos 1000 logs
-        self.logger.log(getattr(logging, level.upper(), logging.INFO), f"{message} | Metadata: {metadata}")
+        if sample_rate > 1:
+            log_entry["sample_rate"] = sample_rate
+        # Gravação em lote em background, no stream do nível
+        self.log_writer.submit(level, log_entry)
+
+    def get_log_policy(self) -> Dict:
+        """Retorna o nível mínimo gravado no Redis e as regras de amostragem."""
+        return {
+            "min_level": self.redis.get(LogWriter.POLICY_LEVEL_KEY) or get_default_log_level(),
+            "sampling": {
+                **DEFAULT_LOG_SAMPLING,
+                **{k: int(v) for k, v in self.redis.hgetall(LogWriter.POLICY_SAMPLING_KEY).items()}
+            },
+            "ring_sizes": dict(self.log_writer.ring_sizes),
+        }
+
+    def set_log_level_threshold(self, level: str):
+        """Define o nível mínimo de log gravado no Redis."""
+        level = level.upper()
+        if level not in LOG_LEVELS:
+            raise ValueError(f"Nível de log inválido: {level}")
+        self.redis.set(LogWriter.POLICY_LEVEL_KEY, level)
+        self.notify_config_change()
+
+    def set_log_sampling(self, message: str, rate: int):
+        """Mantém apenas 1 a cada `rate` ocorrências da mensagem (1 desativa a amostragem)."""
+        self.redis.hset(LogWriter.POLICY_SAMPLING_KEY, message, max(int(rate), 1))
+        self.notify_config_change()
+
+    def remove_log_sampling(self, message: str):
+        """Remove a regra de amostragem personalizada da mensagem."""
+        self.redis.hdel(LogWriter.POLICY_SAMPLING_KEY, message)
+        self.notify_config_change()
+
+    # Reassume uma mensagem somente se o estado atual ainda for o lido (CAS)
+    _RECLAIM_MESSAGE_SCRIPT = """
+    if redis.call('GET', KEYS[1]) == ARGV[1] then
+        redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+        return 1
+    end
+    return 0
+    """
+
+    def _message_state_key(self, message_id: str) -> str:
+        return self._get_redis_key(f"message_state:{message_id}")
+
+    def _build_message_state(self, status: str, **extra) -> str:
+        state = {"status": status, "updated_at": datetime.now().isoformat()}
+        state.update(extra)
+        return json.dumps(state)
+
+    def claim_message(self, message_id: str) -> Optional[Dict]:
+        """
+        Registra atomicamente (SET NX) o recebimento de uma mensagem.
+        Retorna None se a mensagem foi assumida por esta chamada, ou o estado
+        já existente se for uma reentrega/duplicata. Apenas mensagens que
+        falharam em definitivo (job descartado) podem ser reassumidas; em
+        `retrying` o job original ainda está pendente na fila.
+
+        O `received` vale só MESSAGE_CLAIM_TTL segundos: se o processo morrer
+        antes de enfileirar o job, a reentrega volta a ser aceita logo.
+        Depois do XADD, `confirm_message` estende o estado para
+        MESSAGE_STATE_TTL.
+        """
+        key = self._message_state_key(message_id)
+        new_state = self._build_message_state(self.MESSAGE_STATUS_RECEIVED)
+        if self.redis.set(key, new_state, nx=True, ex=self.message_claim_ttl):
+            return None
+
+        current = self.redis.get(key)
+        if current is None:
+            # Expirou entre o SET e o GET; tenta novamente uma única vez
+            if self.redis.set(key, new_state, nx=True, ex=self.message_claim_ttl):
+                return None
+            current = self.redis.get(key)
+
+        try:
+            state = json.loads(current)
+        except (TypeError, ValueError):
+            state = {"status": self.MESSAGE_STATUS_RECEIVED}
+
+        if state.get("status") == self.MESSAGE_STATUS_FAILED:
+            reclaimed = self.redis.eval(
+                self._RECLAIM_MESSAGE_SCRIPT, 1, key,
+                current, new_state, self.message_claim_ttl
+            )
+            if reclaimed:
+                return None
+        return state
+
+    def confirm_message(self, message_id: str):
+        """Job enfileirado: o estado passa a valer MESSAGE_STATE_TTL."""
+        self.redis.expire(self._message_state_key(message_id), self.message_state_ttl)
+
+    def get_message_state(self, message_id: str) -> Optional[Dict]:
+        """Retorna o estado de processamento registrado para a mensagem."""
+        current = self.redis.get(self._message_state_key(message_id))
+        if not current:
+            return None
+        try:
+            return json.loads(current)
+        except ValueError:
+            return None
+
+    def set_message_state(self, message_id: str, status: str, **extra):
+        """Atualiza o estado de processamento (processing, retrying, done ou failed)."""
+        self.redis.set(
+            self._message_state_key(message_id),
+            self._build_message_state(status, **extra),
+            ex=self.message_state_ttl
+        )
+
+    def notify_membership_change(self, set_name: str):
+        """Invalida o cache de grupos/usuários da API e dos workers."""
+        try:
+            self.redis.publish(MEMBERSHIP_CHANNEL, set_name)
+        except redis.exceptions.RedisError as e:
+            self.logger.error(f"Erro ao publicar alteração de {set_name}: {e}")
 
     def get_allowed_groups(self) -> List[str]:
         return self.redis.smembers(self._get_redis_key("allowed_groups"))
 
     def add_allowed_group(self, group: str):
         self.redis.sadd(self._get_redis_key("allowed_groups"), group)
+        self.notify_membership_change("allowed_groups")
 
     def remove_allowed_group(self, group: str):
         self.redis.srem(self._get_redis_key("allowed_groups"), group)
+        self.notify_membership_change("allowed_groups")
 
     def get_blocked_users(self) -> List[str]:
         return self.redis.smembers(self._get_redis_key("blocked_users"))
 
     def add_blocked_user(self, user: str):
         self.redis.sadd(self._get_redis_key("blocked_users"), user)
+        self.notify_membership_change("blocked_users")
 
     def remove_blocked_user(self, user: str):
         self.redis.srem(self._get_redis_key("blocked_users"), user)
+        self.notify_membership_change("blocked_users")
 
     def get_statistics(self) -> Dict:
-        total_processed = int(self.redis.get(self._get_redis_key("total_processed")) or 0)
-        last_processed = self.redis.get(self._get_redis_key("last_processed"))
-        daily_count = json.loads(self.redis.get(self._get_redis_key("daily_count")) or "{}")
-        group_count = json.loads(self.redis.get(self._get_redis_key("group_count")) or "{}")
-        user_count = json.loads(self.redis.get(self._get_redis_key("user_count")) or "{}")
-        error_count = int(self.redis.get(self._get_redis_key("error_count")) or 0)
-        success_rate = float(self.redis.get(self._get_redis_key("success_rate")) or 100.0)
+        pipe = self.redis.pipeline(transaction=False)
+        days = queue_statistics_reads(pipe, self.stats_retention_days)
+        return build_statistics(pipe.execute(), days)
 
-        return {
-            "total_processed": total_processed,
-            "last_processed": last_processed,
-            "stats": {
-                "daily_count": daily_count,
-                "group_count": group_count,
-                "user_count": user_count,
-                "error_count": error_count,
-                "success_rate": success_rate,
-            }
-        }
+    def migrate_legacy_statistics(self):
+        """
+        Converte os blobs JSON antigos (daily_count, group_count, user_count)
+        para o layout em hashes. Contagens por contato sem data vão para
+        `stats:groups:legacy` / `stats:users:legacy`, sem expiração.
+
+        Roda como tarefa de manutenção. A leitura, a conversão e a remoção
+        dos blobs acontecem em uma transação com WATCH: se outra réplica
+        migrar ao mesmo tempo, o EXEC falha, a leitura é refeita e não
+        encontra mais nada, sem somar os totais duas vezes. Um blob que não
+        puder ser convertido é renomeado para `<chave>:invalid`, para não ser
+        reprocessado (nem logado) a cada execução.
+        """
+        legacy_keys = [self._get_redis_key(key) for key in ("daily_count", "group_count", "user_count")]
+        today = datetime.now().date()
+
+        def parse(raw):
+            try:
+                data = json.loads(raw or "{}")
+                return {str(k): int(v) for k, v in data.items()}
+            except (TypeError, ValueError, AttributeError):
+                return None
+
+        def migrate(pipe):
+            migrated, invalid = False, []
+            blobs = dict(zip(legacy_keys, pipe.mget(legacy_keys)))
+            if not any(blobs.values()):
+                return migrated, invalid
+            parsed = {key: parse(raw) for key, raw in blobs.items()}
+
+            pipe.multi()
+            daily, groups, users = (parsed[key] for key in legacy_keys)
+            for day, count in (daily or {}).items():
+                try:
+                    age = (today - datetime.fromisoformat(day).date()).days
+                except ValueError:
+                    continue
+                expires_in = self.stats_retention_days - age
+                if expires_in <= 0:
+                    continue
+                daily_key = f"{STATS_KEY_PREFIX}:daily:{day}"
+                pipe.incrby(daily_key, count)
+                pipe.expire(daily_key, expires_in * 24 * 60 * 60)
+            for kind, counts in (("groups", groups), ("users", users)):
+                for jid, count in (counts or {}).items():
+                    pipe.hincrby(f"{STATS_KEY_PREFIX}:{kind}:legacy", jid, count)
+            for key, raw in blobs.items():
+                if raw is None:
+                    continue
+                if parsed[key] is None:
+                    pipe.rename(key, f"{key}:invalid")
+                    invalid.append(key)
+                else:
+                    pipe.delete(key)
+                    migrated = True
+            pipe.delete(self._get_redis_key("success_rate"))
+            return migrated, invalid
+
+        try:
+            migrated, invalid = self.redis.transaction(migrate, *legacy_keys, value_from_callable=True)
+            if invalid:
+                self.logger.error(f"Estatísticas antigas inválidas movidas para '<chave>:invalid': {invalid}")
+            if migrated:
+                self.logger.info("Estatísticas antigas migradas para o layout em hashes")
+        except Exception as e:
+            self.logger.error(f"Erro ao migrar estatísticas antigas: {e}")
 
     def can_process_message(self, remote_jid):
         try:
-            allowed_groups = self.get_allowed_groups()
-            blocked_users = self.get_blocked_users()
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.sismember(self._get_redis_key("blocked_users"), remote_jid)
+            pipe.sismember(self._get_redis_key("allowed_groups"), remote_jid)
+            is_blocked, is_allowed_group = pipe.execute()
 
-            if remote_jid in blocked_users:
+            if is_blocked:
                 return False
-            if "@g.us" in remote_jid and remote_jid not in allowed_groups:
+            if "@g.us" in remote_jid and not is_allowed_group:
                 return False
 
             return True
@@ -109,52 +612,30 @@ class StorageHandler:
 
     def record_processing(self, remote_jid):
         try:
-            # Incrementar total processado
-            self.redis.incr(self._get_redis_key("total_processed"))
-
-            # Atualizar último processamento
-            self.redis.set(self._get_redis_key("last_processed"), datetime.now().isoformat())
-
-            # Atualizar contagem diária
-            today = datetime.now().strftime("%Y-%m-%d")
-            daily_count = json.loads(self.redis.get(self._get_redis_key("daily_count")) or "{}")
-            daily_count[today] = daily_count.get(today, 0) + 1
-            self.redis.set(self._get_redis_key("daily_count"), json.dumps(daily_count))
-
-            # Atualizar contagem de grupo ou usuário
-            if "@g.us" in remote_jid:
-                group_count = json.loads(self.redis.get(self._get_redis_key("group_count")) or "{}")
-                group_count[remote_jid] = group_count.get(remote_jid, 0) + 1
-                self.redis.set(self._get_redis_key("group_count"), json.dumps(group_count))
-            else:
-                user_count = json.loads(self.redis.get(self._get_redis_key("user_count")) or "{}")
-                user_count[remote_jid] = user_count.get(remote_jid, 0) + 1
-                self.redis.set(self._get_redis_key("user_count"), json.dumps(user_count))
-
-            # Atualizar taxa de sucesso
-            total = int(self.redis.get(self._get_redis_key("total_processed")) or 0)
-            errors = int(self.redis.get(self._get_redis_key("error_count")) or 0)
-            success_rate = ((total - errors) / total) * 100 if total > 0 else 100
-            self.redis.set(self._get_redis_key("success_rate"), success_rate)
-
+            pipe = self.redis.pipeline(transaction=True)
+            queue_processing_stats(pipe, remote_jid, self.stats_retention_days)
+            pipe.execute()
         except Exception as e:
             self.logger.error(f"Erro ao registrar processamento: {e}")
 
     def record_error(self):
         self.redis.incr(self._get_redis_key("error_count"))
 
+    def get_logs(self, levels: List[str] = None, start: datetime = None,
+                 end: datetime = None, count: int = 100) -> List[Dict]:
+        """Logs gravados no Redis em um intervalo de tempo, mais recentes primeiro."""
+        return self.log_writer.read_range(levels, start, end, count)
+
     def clean_old_logs(self):
+        """Aplica LOG_RETENTION_HOURS com um XTRIM MINID por nível."""
         try:
-            cutoff_time = datetime.now() - timedelta(hours=self.log_retention_hours)
-            logs = self.redis.lrange(self._get_redis_key("logs"), 0, -1)
-            for log in logs:
-                log_entry = json.loads(log)
-                if datetime.fromisoformat(log_entry["timestamp"]) < cutoff_time:
-                    self.redis.lrem(self._get_redis_key("logs"), 0, log)
-                else:
-                    break  # Assumindo que os logs estão ordenados por tempo
+            removed = self.log_writer.trim_expired(self.log_retention_hours)
+            # Listas do formato anterior não recebem mais entradas
+            self.redis.delete(*LogWriter.LEGACY_LIST_KEYS)
+            return removed
         except Exception as e:
             self.logger.error(f"Erro ao limpar logs antigos: {e}")
+            return 0
 
     def backup_data(self):
         try:
@@ -170,13 +651,30 @@ class StorageHandler:
         except Exception as e:
             self.logger.error(f"Erro ao criar backup: {e}")
 
-    def clean_old_backups(self):
+    def clean_old_backups(self, cursor: int = None, count: int = 100) -> int:
+        """
+        Remove backups sem expiração. Com `cursor`, processa apenas um lote
+        do SCAN e retorna o próximo cursor (0 quando a varredura termina).
+        """
         try:
-            for key in self.redis.scan_iter("backup:*"):
-                if self.redis.ttl(key) <= 0:
-                    self.redis.delete(key)
+            if cursor is None:
+                for key in self.redis.scan_iter("backup:*"):
+                    if self.redis.ttl(key) <= 0:
+                        self.redis.delete(key)
+                return 0
+
+            cursor, keys = self.redis.scan(cursor=cursor, match="backup:*", count=count)
+            if keys:
+                pipe = self.redis.pipeline(transaction=False)
+                for key in keys:
+                    pipe.ttl(key)
+                expired = [key for key, ttl in zip(keys, pipe.execute()) if ttl <= 0]
+                if expired:
+                    self.redis.delete(*expired)
+            return cursor
         except Exception as e:
             self.logger.error(f"Erro ao limpar backups antigos: {e}")
+            return 0
             
     # Método de rotação de chaves groq
     def get_groq_keys(self) -> List[str]:
@@ -197,16 +695,13 @@ class StorageHandler:
     def get_next_groq_key(self) -> str:
         """
         Obtém a próxima chave GROQ no sistema de rodízio.
-        Utiliza um contador no Redis para controlar a rotação.
+        Utiliza um contador atômico no Redis para controlar a rotação.
         """
-        keys = self.get_groq_keys()
+        keys = sorted(self.get_groq_keys())
         if not keys:
             return None  
-        # Obtém e incrementa o contador de rodízio
-        counter = int(self.redis.get(self._get_redis_key("groq_key_counter")) or "0")
-        next_counter = (counter + 1) % len(keys)
-        self.redis.set(self._get_redis_key("groq_key_counter"), str(next_counter))
-        
+        # Incrementa o contador de rodízio de forma atômica (INCR)
+        counter = self.redis.incr(self._get_redis_key("groq_key_counter")) - 1
         return keys[counter % len(keys)]
     
     def get_penalized_until(self, key: str) -> Optional[datetime]:
@@ -245,6 +740,7 @@ class StorageHandler:
         """Salva as configurações de mensagens."""
         for key, value in settings.items():
             self.redis.set(self._get_redis_key(key), str(value))
+        self.notify_config_change()
             
     def get_process_mode(self):
         """Retorna o modo de processamento configurado"""
@@ -295,6 +791,7 @@ class StorageHandler:
         Ativa ou desativa a detecção automática de idioma
         """
         self.redis.set(self._get_redis_key("auto_language_detection"), str(enabled).lower())
+        self.notify_config_change()
         self.logger.info(f"Detecção automática de idioma {'ativada' if enabled else 'desativada'}")
 
     def get_auto_translation(self) -> bool:
@@ -308,6 +805,7 @@ class StorageHandler:
         Ativa ou desativa a tradução automática
         """
         self.redis.set(self._get_redis_key("auto_translation"), str(enabled).lower())
+        self.notify_config_change()
         self.logger.info(f"Tradução automática {'ativada' if enabled else 'desativada'}")
         
     def record_language_usage(self, language: str, from_me: bool, auto_detected: bool = False):
@@ -543,15 +1041,56 @@ class StorageHandler:
         except Exception as e:
             self.logger.error(f"Erro ao atualizar estatísticas do webhook {webhook_id}: {e}")
     
-    def retry_failed_webhooks(self):
-        """Tenta reenviar webhooks que falharam nas últimas 24h."""
-        webhooks = self.get_webhook_redirects()
-        for webhook in webhooks:
-            if webhook.get("last_error"):
-                error_time = datetime.fromisoformat(webhook["last_error"]["timestamp"])
-                if datetime.now() - error_time < timedelta(hours=24):
-                    # Tentar reenviar
-                    pass
+    def retry_failed_webhooks(self, max_deliveries: int = 20) -> bool:
+        """
+        Tenta reenviar as entregas que falharam nas últimas 24h, das mais
+        antigas para as mais recentes, até `max_deliveries` reenvios por
+        chamada. Entregas que falham de novo voltam para a fila com backoff
+        exponencial (WEBHOOK_RETRY_BACKOFF * 2^tentativas) até
+        WEBHOOK_MAX_RETRIES tentativas. Retorna True se o limite da chamada
+        foi atingido e ainda pode haver entregas a reenviar.
+        """
+        max_retries = int(os.getenv("WEBHOOK_MAX_RETRIES", 5))
+        backoff = float(os.getenv("WEBHOOK_RETRY_BACKOFF", 60))
+        now = datetime.now()
+        cutoff = now - timedelta(hours=24)
+        attempted = 0
+
+        for webhook in self.get_webhook_redirects():
+            key = self._get_redis_key(f"webhook_failed_{webhook['id']}")
+            # Cada entrega é visitada uma única vez por chamada
+            for _ in range(self.redis.llen(key)):
+                if attempted >= max_deliveries:
+                    return True
+                raw = self.redis.rpop(key)
+                if raw is None:
+                    break
+                try:
+                    delivery = json.loads(raw)
+                    if datetime.fromisoformat(delivery["timestamp"]) < cutoff:
+                        continue
+                    last_attempt = delivery.get("last_attempt")
+                    wait = backoff * (2 ** delivery.get("retry_count", 0))
+                    if last_attempt and (now - datetime.fromisoformat(last_attempt)).total_seconds() < wait:
+                        # Ainda em backoff: volta para a fila sem reenviar
+                        self.redis.lpush(key, raw)
+                        continue
+                except (ValueError, KeyError, TypeError):
+                    continue
+
+                attempted += 1
+                if self.retry_webhook(webhook["id"], delivery["payload"]):
+                    continue
+                delivery["retry_count"] = delivery.get("retry_count", 0) + 1
+                delivery["last_attempt"] = datetime.now().isoformat()
+                if delivery["retry_count"] < max_retries:
+                    self.redis.lpush(key, json.dumps(delivery))
+                else:
+                    self.add_log("WARNING", "Entrega de webhook descartada após exceder tentativas", {
+                        "webhook_id": webhook["id"],
+                        "retry_count": delivery["retry_count"]
+                    })
+        return False
     
     def test_webhook(self, url: str) -> tuple[bool, str]:
         """
@@ -704,6 +1243,7 @@ class StorageHandler:
         if provider not in ["groq", "openai"]:
             raise ValueError("Provider must be 'groq' or 'openai'")
         self.redis.set(self._get_redis_key("active_llm_provider"), provider)
+        self.notify_config_change()
     
     def get_openai_keys(self) -> List[str]:
         """Get stored OpenAI API keys"""
@@ -714,4 +1254,8 @@ class StorageHandler:
         if key and key.startswith("sk-"):
             self.redis.sadd(self._get_redis_key("openai_keys"), key)
             return True
-        return False
\ No newline at end of file
+        return False
+
+    def remove_openai_key(self, key: str):
+        """Remove OpenAI API key"""
+        self.redis.srem(self._get_redis_key("openai_keys"), key)
\ No newline at end of file
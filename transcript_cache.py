@@ -0,0 +1,225 @@
+import base64
+import binascii
+import hashlib
+import os
+import time
+import logging
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+import redis
+from audio_buffer import AudioBuffer
+from metrics import metrics
+from singleflight import SingleFlight
+
+logger = logging.getLogger("TranscreveZAP")
+
+KEY_PREFIX = "transcrevezap:transcript_cache"
+INDEX_KEY = f"{KEY_PREFIX}:index"
+
+def get_transcript_cache_ttl() -> int:
+    return int(os.getenv("TRANSCRIPT_CACHE_TTL", 7 * 86400))
+
+def get_transcript_cache_max_entries() -> int:
+    return int(os.getenv("TRANSCRIPT_CACHE_MAX_ENTRIES", 10000))
+
+def normalize_file_sha256(value) -> Optional[str]:
+    """
+    Converte o `audioMessage.fileSha256` do WhatsApp (base64, buffer
+    serializado ou hex) para o mesmo formato hex de `AudioBuffer.sha256`,
+    de modo que as duas chaves apontem para a mesma entrada.
+    """
+    if not value:
+        return None
+    try:
+        if isinstance(value, dict):
+            # Buffer serializado: {"type": "Buffer", "data": [...]} ou {"0": 12, "1": 34, ...}
+            data = value.get("data")
+            if data is None:
+                data = [value[index] for index in sorted(value, key=int)]
+            raw = bytes(data)
+        elif isinstance(value, list):
+            raw = bytes(value)
+        elif len(value) == 64 and all(char in "0123456789abcdefABCDEF" for char in value):
+            return value.lower()
+        else:
+            raw = base64.b64decode(value, validate=True)
+    except (ValueError, TypeError, binascii.Error):
+        return None
+    return raw.hex() if len(raw) == 32 else None
+
+def text_digest(text: str) -> str:
+    """Hash curto de um texto, usado nos campos que dependem do texto final."""
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+
+def summary_field(language: str, text: str) -> str:
+    """Campo do resumo de um texto no idioma informado."""
+    return f"summary:{language}:{text_digest(text)}"
+
+def trim_transcript_cache(client: redis.Redis, batch: int = 500) -> bool:
+    """
+    Remove do índice as entradas expiradas e, acima de
+    TRANSCRIPT_CACHE_MAX_ENTRIES, as menos usadas recentemente.
+    Retorna True se ainda houver entradas a remover (próxima fatia).
+    """
+    client.zremrangebyscore(INDEX_KEY, "-inf", time.time() - get_transcript_cache_ttl())
+    excess = client.zcard(INDEX_KEY) - get_transcript_cache_max_entries()
+    if excess <= 0:
+        return False
+    digests = client.zrange(INDEX_KEY, 0, min(excess, batch) - 1)
+    if digests:
+        pipe = client.pipeline(transaction=False)
+        pipe.delete(*[f"{KEY_PREFIX}:{digest}" for digest in digests])
+        pipe.zrem(INDEX_KEY, *digests)
+        pipe.execute()
+    return excess > batch
+
+class TranscriptCache:
+    """
+    Cache de transcrições endereçado pelo conteúdo do áudio.
+
+    Cada áudio é um hash `transcrevezap:transcript_cache:<sha256>` com o
+    idioma detectado, as transcrições por idioma, as traduções e os
+    resumos. O TTL é renovado a cada acesso e o índice ordenado pelo
+    último acesso permite descartar as entradas menos usadas quando o
+    limite de entradas é atingido (tarefa de manutenção). Cópias do mesmo
+    áudio processadas ao mesmo tempo são coalescidas (`flights`), de modo
+    que cada campo gera uma única chamada remota, mesmo com o cache
+    desativado.
+    """
+
+    def __init__(self, client, ttl: int = None):
+        self.redis = client
+        self.ttl = ttl if ttl is not None else get_transcript_cache_ttl()
+        self.flights = SingleFlight(client)
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0
+
+    def _key(self, digest: str) -> str:
+        return f"{KEY_PREFIX}:{digest}"
+
+    async def load(self, digest: str) -> Dict[str, str]:
+        if not self.enabled:
+            return {}
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.hgetall(self._key(digest))
+            pipe.expire(self._key(digest), self.ttl)
+            pipe.zadd(INDEX_KEY, {digest: time.time()}, xx=True)
+            entry, _, _ = await pipe.execute()
+            return entry
+        except redis.exceptions.RedisError as e:
+            # Sem cache o áudio é processado normalmente
+            logger.error(f"Erro ao ler cache de transcrição: {e}")
+            return {}
+
+    async def get_field(self, digest: str, field: str) -> Optional[str]:
+        try:
+            return await self.redis.hget(self._key(digest), field)
+        except redis.exceptions.RedisError as e:
+            logger.error(f"Erro ao ler cache de transcrição: {e}")
+            return None
+
+    async def store(self, digest: str, fields: Dict[str, str]):
+        if not fields:
+            return
+        # Com o cache desativado o hash só repassa o resultado às cópias
+        # simultâneas que aguardam a coalescência e expira junto com a espera
+        ttl = self.ttl if self.enabled else int(self.flights.wait_timeout)
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.hset(self._key(digest), mapping=fields)
+            pipe.expire(self._key(digest), ttl)
+            if self.enabled:
+                pipe.zadd(INDEX_KEY, {digest: time.time()})
+            await pipe.execute()
+        except redis.exceptions.RedisError as e:
+            logger.error(f"Erro ao gravar cache de transcrição: {e}")
+
+class CachedAudio:
+    """
+    Áudio de um job com download preguiçoso e acesso ao cache.
+
+    Com o `fileSha256` do WhatsApp a entrada é consultada antes de baixar a
+    mídia; um acerto dispensa o download. Sem ele, o áudio é baixado e a
+    entrada é localizada pelo hash dos bytes. `close()` libera apenas o
+    áudio; o acesso ao cache continua disponível para as etapas seguintes.
+    """
+
+    def __init__(self, cache: TranscriptCache, fetch: Callable[[], Awaitable[AudioBuffer]], file_sha256=None):
+        self.cache = cache
+        self._fetch = fetch
+        self.digest = normalize_file_sha256(file_sha256)
+        self.buffer: Optional[AudioBuffer] = None
+        self.entry: Dict[str, str] = {}
+        self._loaded = False
+
+    async def _ensure_loaded(self):
+        if not self._loaded and self.digest:
+            self.entry = await self.cache.load(self.digest)
+            self._loaded = True
+
+    async def fetch(self) -> AudioBuffer:
+        """Baixa o áudio (uma vez) e, sem fileSha256, carrega a entrada pelo hash dos bytes."""
+        if self.buffer is None:
+            self.buffer = await self._fetch()
+            if not self.digest:
+                self.digest = self.buffer.sha256
+            await self._ensure_loaded()
+            if "size" not in self.entry:
+                await self.set({"size": str(self.buffer.size)})
+        return self.buffer
+
+    async def get(self, field: str) -> Optional[str]:
+        await self._ensure_loaded()
+        return self.entry.get(field)
+
+    async def set(self, fields: Dict[str, str]):
+        self.entry.update(fields)
+        if self.digest:
+            await self.cache.store(self.digest, fields)
+
+    async def get_or_compute(self, field: str, compute: Callable[[], Awaitable[str]]) -> Tuple[str, bool]:
+        """
+        Valor do campo no cache ou calculado por `compute`, com uma única
+        execução entre todas as cópias simultâneas do mesmo áudio.
+        Retorna (valor, calculado_aqui).
+        """
+        if not self.digest:
+            # Sem fileSha256 a entrada só é localizada pelo hash dos bytes
+            await self.fetch()
+        value = await self.get(field)
+        if value is not None:
+            return value, False
+
+        async def compute_and_store():
+            result = await compute()
+            await self.set({field: result})
+            return result
+
+        async def lookup():
+            return await self.cache.get_field(self.digest, field)
+
+        value, computed = await self.cache.flights.run(f"{self.digest}:{field}", compute_and_store, lookup)
+        self.entry[field] = value
+        return value, computed
+
+    def record_hit(self):
+        """Contabiliza um acerto: o áudio não precisou ser enviado ao Whisper."""
+        metrics.incr("transcript_cache", "hits")
+        metrics.incr("transcript_cache", "bytes_saved", int(self.entry.get("size", 0)))
+        if self.buffer is None:
+            metrics.incr("transcript_cache", "downloads_skipped")
+
+    def record_miss(self):
+        metrics.incr("transcript_cache", "misses")
+
+    def close(self):
+        if self.buffer is not None:
+            self.buffer.close()
+
+    def __enter__(self) -> "CachedAudio":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -1,9 +1,32 @@
 import os
 import redis
+import redis.asyncio
 import logging
 
 logger = logging.getLogger("TranscreveZAP")
 
+# Versionamento e notificação de alterações de configuração
+CONFIG_VERSION_KEY = "transcrevezap:config_version"
+CONFIG_CHANNEL = "transcrevezap:config_updates"
+
+# Notificação de alterações em grupos permitidos e usuários bloqueados
+MEMBERSHIP_CHANNEL = "transcrevezap:membership_updates"
+
+# Renova/libera um lock somente se ainda pertencer ao dono informado (CAS)
+RENEW_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
 def get_redis_connection_params():
     """
     Retorna os parâmetros de conexão do Redis baseado nas variáveis de ambiente.
@@ -46,4 +69,38 @@ def create_redis_client():
         raise
     except Exception as e:
         logger.error(f"Erro ao configurar Redis: {e}")
-        raise
\ No newline at end of file
+        raise
+
+# Pool de conexões assíncronas compartilhado pelo processo
+_async_pool = None
+
+def create_async_redis_client():
+    """
+    Cria um cliente redis.asyncio sobre um pool de conexões compartilhado
+    por todo o processo (REDIS_MAX_CONNECTIONS). As conexões são abertas
+    sob demanda dentro do event loop, então não há teste de conexão aqui.
+    Com o pool cheio, a chamada aguarda uma conexão livre por até
+    REDIS_POOL_TIMEOUT segundos em vez de falhar na hora.
+    """
+    global _async_pool
+    if _async_pool is None:
+        params = get_redis_connection_params()
+        _async_pool = redis.asyncio.BlockingConnectionPool(
+            max_connections=int(os.getenv('REDIS_MAX_CONNECTIONS', 50)),
+            timeout=float(os.getenv('REDIS_POOL_TIMEOUT', 5)),
+            **params
+        )
+    return redis.asyncio.Redis(connection_pool=_async_pool)
+
+def publish_config_change(client):
+    """
+    Incrementa a versão das configurações e notifica os processos da API
+    e dos workers para que recarreguem o snapshot em memória.
+    """
+    try:
+        version = client.incr(CONFIG_VERSION_KEY)
+        client.publish(CONFIG_CHANNEL, version)
+        return version
+    except redis.exceptions.RedisError as e:
+        logger.error(f"Erro ao publicar alteração de configuração: {e}")
+        return None
@@ -0,0 +1,173 @@
+import asyncio
+import os
+import signal
+import time
+import traceback
+from config import logger
+from job_queue import JobQueue
+from http_client import http_client
+from metrics import metrics
+from pipeline import process_audio_job, storage
+
+class TranscriptionWorker:
+    """
+    Consumidor do stream de jobs. Cada processo roda até `concurrency`
+    pipelines em paralelo; vários processos/containers podem compartilhar o
+    mesmo consumer group para escalar horizontalmente.
+    """
+
+    def __init__(self, queue: JobQueue = None, consumer_name: str = None, concurrency: int = None):
+        self.queue = queue or JobQueue()
+        self.consumer_name = consumer_name or JobQueue.default_consumer_name()
+        self.concurrency = concurrency or int(os.getenv("WORKER_CONCURRENCY", 4))
+        self.claim_interval = int(os.getenv("QUEUE_CLAIM_INTERVAL", 30))
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._tasks = set()
+        self._running = True
+
+    async def _handle(self, entry_id: str, job: dict, deliveries: int):
+        try:
+            if deliveries > self.queue.max_deliveries:
+                storage.add_log("ERROR", "Job descartado após exceder limite de entregas", {
+                    "entry_id": entry_id,
+                    "remote_jid": job.get("remote_jid"),
+                    "deliveries": deliveries
+                })
+                await asyncio.to_thread(self.queue.dead_letter, entry_id, job, "max_deliveries")
+                if job.get("audio_key"):
+                    await storage.set_message_state(job["audio_key"], storage.MESSAGE_STATUS_FAILED, error="max_deliveries")
+                return
+
+            message_id = job.get("audio_key")
+            state = await storage.get_message_state(message_id) if message_id else None
+            if state and state.get("status") == storage.MESSAGE_STATUS_DONE:
+                # Reentrega de um job já concluído (ex.: ACK perdido)
+                await asyncio.to_thread(self.queue.ack, entry_id)
+                return
+            if state and state.get("status") in (
+                storage.MESSAGE_STATUS_PROCESSING, storage.MESSAGE_STATUS_RETRYING
+            ) and state.get("entry_id") not in (None, entry_id):
+                # Outro job da mesma mensagem já é o responsável por ela
+                storage.add_log("WARNING", "Job duplicado da mesma mensagem descartado", {
+                    "entry_id": entry_id,
+                    "owner_entry_id": state.get("entry_id"),
+                    "message_id": message_id
+                })
+                await asyncio.to_thread(self.queue.ack, entry_id)
+                return
+
+            if message_id:
+                await storage.set_message_state(message_id, storage.MESSAGE_STATUS_PROCESSING, entry_id=entry_id)
+            keeper = asyncio.create_task(self._keep_alive(entry_id))
+            try:
+                result = await process_audio_job(job)
+            finally:
+                keeper.cancel()
+                await asyncio.gather(keeper, return_exceptions=True)
+            if message_id:
+                await storage.set_message_state(message_id, storage.MESSAGE_STATUS_DONE, result=result)
+            await asyncio.to_thread(self.queue.ack, entry_id)
+
+        except Exception as e:
+            # Sem ACK: o job continua pendente e será reassumido via XCLAIM.
+            # Não é `failed`: uma reentrega do webhook não deve gerar outro job
+            if job.get("audio_key"):
+                await storage.set_message_state(
+                    job["audio_key"], storage.MESSAGE_STATUS_RETRYING, entry_id=entry_id, error=str(e)
+                )
+            await storage.record_error()
+            storage.add_log("ERROR", f"Erro ao processar áudio: {str(e)}", {
+                "error_type": type(e).__name__,
+                "remote_jid": job.get("remote_jid"),
+                "entry_id": entry_id,
+                "deliveries": deliveries,
+                "traceback": traceback.format_exc()
+            })
+        finally:
+            self._semaphore.release()
+
+    async def _keep_alive(self, entry_id: str):
+        """Renova a posse do job a cada terço de QUEUE_CLAIM_IDLE_MS enquanto ele roda."""
+        interval = self.queue.claim_idle_ms / 3000
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                owned = await asyncio.to_thread(self.queue.renew, self.consumer_name, entry_id)
+            except Exception as e:
+                logger.error(f"Erro ao renovar posse do job {entry_id}: {e}")
+                continue
+            if not owned:
+                storage.add_log("WARNING", "Job reassumido por outro worker durante o processamento", {
+                    "entry_id": entry_id
+                })
+                return
+
+    async def _dispatch(self, entry_id: str, job: dict, deliveries: int):
+        await self._semaphore.acquire()
+        task = asyncio.create_task(self._handle(entry_id, job, deliveries))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def run(self):
+        await asyncio.to_thread(self.queue.ensure_group)
+        logger.info(
+            f"Worker '{self.consumer_name}' iniciado (concorrência: {self.concurrency})"
+        )
+        last_claim = 0.0
+
+        while self._running:
+            try:
+                # Reassumir jobs de workers que travaram ou morreram
+                if time.monotonic() - last_claim >= self.claim_interval:
+                    last_claim = time.monotonic()
+                    stale = await asyncio.to_thread(self.queue.claim_stale, self.consumer_name)
+                    for entry_id, job, deliveries in stale:
+                        await self._dispatch(entry_id, job, deliveries)
+
+                # Só lê novos jobs quando há capacidade livre
+                free_slots = max(self.concurrency - len(self._tasks), 1)
+                entries = await asyncio.to_thread(
+                    self.queue.read, self.consumer_name, free_slots, 5000
+                )
+                for entry_id, job in entries:
+                    await self._dispatch(entry_id, job, 1)
+
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"Erro no loop do worker: {e}")
+                await asyncio.sleep(1)
+
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+        # Parada limpa: sem pendências, o consumidor deste processo sai do grupo
+        try:
+            await asyncio.to_thread(self.queue.remove_consumer, self.consumer_name)
+        except Exception as e:
+            logger.warning(f"Não foi possível remover o consumidor '{self.consumer_name}': {e}")
+        logger.info(f"Worker '{self.consumer_name}' encerrado")
+
+    def stop(self):
+        """Para de ler novos jobs; os jobs em andamento terminam normalmente."""
+        self._running = False
+
+async def main():
+    worker = TranscriptionWorker()
+    # SIGTERM (docker stop) e SIGINT encerram o worker sem abandonar jobs no meio
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, worker.stop)
+    await http_client.start()
+    flusher = asyncio.create_task(
+        metrics.run_flusher(worker.queue.redis, float(os.getenv("METRICS_FLUSH_INTERVAL", 10)))
+    )
+    try:
+        await worker.run()
+    finally:
+        flusher.cancel()
+        await asyncio.gather(flusher, return_exceptions=True)
+        await http_client.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())